@@ -0,0 +1,86 @@
+"""Serial link throughput at each baud rate, against the pty XBee emulator.
+
+Run with ``python benchmarks/bench_baud.py`` (POSIX only). For each rate
+an emulated radio starts at 9600 baud, ``BaudNegotiator`` moves it to the
+rate under test (``ATBD``/``ATAC`` plus the verification round trips),
+and then ``FRAMES`` transmit requests with a ``PAYLOAD``-byte payload are
+streamed to it. Reports negotiation time, transmit frames per second and
+payload bytes per second once every Transmit Status has come back.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial  # noqa: E402
+
+from xbee_baud import BaudNegotiator  # noqa: E402
+from xbee_pty_emulator import PtyRadio  # noqa: E402
+
+RATES = (9600, 57600, 115200, 230400)
+FRAMES = 200
+PAYLOAD = 64
+
+
+def transmit_request(frame_id, payload):
+    body = bytes([0x10, frame_id]) + (0x0013A20040000002).to_bytes(8, "big") \
+        + b"\xff\xfe\x00\x00" + payload
+    return bytes([0x7E, len(body) >> 8, len(body) & 0xFF]) + body \
+        + bytes([0xFF - (sum(body) & 0xFF)])
+
+
+def run(rate, cache_path):
+    radio = PtyRadio(baud=9600)
+    try:
+        negotiator = BaudNegotiator(cache_path, rates=(rate,))
+        started = time.monotonic()
+        reached = negotiator.negotiate(radio.port, 9600)
+        negotiation = time.monotonic() - started
+        if reached != rate:
+            return {"rate": rate, "error": "negotiated %s" % reached}
+
+        frames = [transmit_request(n % 255 + 1, b"x" * PAYLOAD) for n in range(FRAMES)]
+        with serial.Serial(radio.port, rate, timeout=0.1) as link:
+            statuses = []
+
+            def read_statuses():
+                received = b""
+                deadline = time.monotonic() + 60
+                while received.count(b"\x7e\x00\x07\x8b") < FRAMES and time.monotonic() < deadline:
+                    received += link.read(link.in_waiting or 1)
+                statuses.append(received.count(b"\x7e\x00\x07\x8b"))
+
+            reader = threading.Thread(target=read_statuses)
+            started = time.monotonic()
+            reader.start()
+            for frame in frames:
+                link.write(frame)
+            reader.join()
+            elapsed = time.monotonic() - started
+        return {"rate": rate, "negotiation_s": negotiation, "frames": statuses[0],
+                "frames_per_s": statuses[0] / elapsed,
+                "payload_bytes_per_s": statuses[0] * PAYLOAD / elapsed}
+    finally:
+        radio.close()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "ports.json")
+        print(f"{FRAMES} transmit requests of {PAYLOAD} bytes each")
+        for rate in RATES:
+            result = run(rate, cache_path)
+            if "error" in result:
+                print(f"{rate:>7} baud: {result['error']}")
+                continue
+            print(f"{rate:>7} baud: negotiated in {result['negotiation_s'] * 1000:6.1f} ms, "
+                  f"{result['frames_per_s']:7.1f} frames/s, "
+                  f"{result['payload_bytes_per_s'] / 1000:6.2f} kB/s payload")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Delivery latency of short commands sent behind long messages.
+
+Run with ``python benchmarks/bench_fair_interleaving.py``. A ground station
+on a simulated radio (``xbee_sim``) whose ``send_packet`` takes as long as
+writing the frame to a 57600 baud UART sends, every round, one long message
+to the first drone and then a short ``move`` command to each of the others
+with ``send_single``. With every message on one scheduler flow the
+fragments go out back to back, as before the scheduler; with the default
+flow per destination they are interleaved by deficit round robin. The
+drones do not relay, so the station's UART is the only bottleneck. Reports
+latency percentiles from ``send_single`` to reassembly on the drone.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xbee_for_import import Communicator  # noqa: E402
+from xbee_sim import SimulatedDevice, SimulatedMedium  # noqa: E402
+
+BAUD = 57600
+DRONES = 5
+ROUNDS = 6
+LONG_MESSAGE = "MISSION " + "x" * 392   # 40 parts
+INTERVAL = 1.0                          # seconds between rounds
+
+
+class SerialPacedDevice(SimulatedDevice):
+    """``send_packet`` blocks for the UART time of the frame, like a real write."""
+
+    def send_packet(self, packet, sync=False):
+        time.sleep((len(packet.rf_data) + 18) * 10.0 / BAUD)
+        super().send_packet(packet, sync)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(fair):
+    medium = SimulatedMedium(discovery_time=0.2)
+    station = Communicator(sender_index=0)
+    drones = []
+    for index in range(DRONES):
+        drone = Communicator(sender_index=index + 1)
+        drone.forward_message = lambda *args: None
+        drone.attach_device(SimulatedDevice(medium, "D%d" % index, 0x0013A20000000100 + index))
+        drones.append(drone)
+    station.attach_device(SerialPacedDevice(medium, "GS", 0x0013A20000000001))
+    while len(station.current_discovered_devices) < DRONES:
+        time.sleep(0.05)
+
+    sent_at = {}
+    latencies = {"short": [], "long": []}
+    lock = threading.Lock()
+
+    def watch(drone):
+        subscription = drone.bus.subscribe("")
+        while True:
+            message = subscription.get()
+            with lock:
+                started = sent_at.pop((drone, message["msg"]), None)
+            if started is not None:
+                kind = "long" if message["msg"].startswith("MISSION") else "short"
+                latencies[kind].append(time.monotonic() - started)
+
+    for drone in drones:
+        threading.Thread(target=watch, args=(drone,), daemon=True).start()
+
+    traffic_class = None if fair else "fifo"
+    for round_number in range(ROUNDS):
+        long_message = LONG_MESSAGE[:-3] + "%03d" % round_number
+        with lock:
+            sent_at[(drones[0], long_message)] = time.monotonic()
+        station.send_single("D0", long_message, traffic_class)
+        for index in range(1, DRONES):
+            command = "move,%d,1500,1500,1500" % (1000 + round_number)
+            with lock:
+                sent_at[(drones[index], command)] = time.monotonic()
+            station.send_single("D%d" % index, command, traffic_class)
+        time.sleep(INTERVAL)
+    station.scheduler.wait_idle()
+    time.sleep(0.5)
+    return latencies
+
+
+def main():
+    print(f"{ROUNDS} rounds of one {len(LONG_MESSAGE)}-char message and "
+          f"{DRONES - 1} short commands at {BAUD} baud")
+    for fair in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = run(fair)
+        name = "deficit round robin" if fair else "back to back       "
+        for kind in ("short", "long"):
+            values = latencies[kind]
+            if not values:
+                print(f"{name} {kind:>5}: nothing delivered")
+                continue
+            print(f"{name} {kind:>5}: {len(values):3d} delivered, "
+                  f"p50 {percentile(values, 0.5) * 1000:7.1f} ms, "
+                  f"p99 {percentile(values, 0.99) * 1000:7.1f} ms, "
+                  f"max {max(values) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""How long the radio reader thread is held per received frame.
+
+Run with ``python benchmarks/bench_receive_workers.py``. A ``Communicator``
+on a simulated radio (``xbee_sim``) whose ``send_packet`` takes as long as
+writing the frame to a 57600 baud UART receives a burst of multi-part
+messages from four neighbors and forwards each completed one to the
+others. The frames are fed from one thread, as digi's reader thread
+would, either through ``message_callback`` (enqueue for the worker pool)
+or straight into ``process_frame`` (the old inline path). Reports the
+time per callback and how long the whole burst took to process; the
+total stays bound by the UART, since frames are written one at a time.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xbee_for_import import Communicator  # noqa: E402
+from xbee_sim import SimulatedDevice, SimulatedMedium, SimulatedMessage  # noqa: E402
+
+BAUD = 57600
+SENDERS = 4
+MESSAGES = 20           # per sender
+MESSAGE = "BATT 11.9V" * 5
+
+
+class SerialPacedDevice(SimulatedDevice):
+    """``send_packet`` blocks for the UART time of the frame, like a real write."""
+
+    def send_packet(self, packet, sync=False):
+        time.sleep((len(packet.rf_data) + 18) * 10.0 / BAUD)
+        super().send_packet(packet, sync)
+
+
+def burst(senders):
+    frames = []
+    for n in range(MESSAGES):
+        for sender, remote in senders:
+            for frame in sender.build_frames(MESSAGE, sender.prepare_message_id()):
+                frames.append(SimulatedMessage(remote, bytearray(frame.encode()), False))
+    return frames
+
+
+def run(pooled):
+    medium = SimulatedMedium(discovery_time=0.2)
+    receiver = Communicator()
+    senders = []
+    for index in range(SENDERS):
+        device = SimulatedDevice(medium, "N%d" % index, 0x0013A20000000100 + index)
+        device.open()
+        sender = Communicator(sender_index=index + 1)
+        sender.device = device
+        senders.append((sender, device.as_remote))
+    receiver.attach_device(SerialPacedDevice(medium, "GS", 0x0013A20000000001))
+    while len(receiver.current_discovered_devices) < SENDERS:
+        time.sleep(0.05)
+
+    frames = burst(senders)
+    held = []
+    started = time.perf_counter()
+    for message in frames:
+        before = time.perf_counter()
+        if pooled:
+            receiver.message_callback(message)
+        else:
+            receiver.process_frame(message, receiver.node_key(message.remote_device),
+                                   time.monotonic())
+        held.append(time.perf_counter() - before)
+    receiver.wait_receive_idle()
+    total = time.perf_counter() - started
+    held.sort()
+    return {"frames": len(frames), "total_s": total,
+            "p50_us": held[len(held) // 2] * 1e6,
+            "p99_us": held[int(len(held) * 0.99)] * 1e6,
+            "max_us": held[-1] * 1e6}
+
+
+def main():
+    for pooled in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run(pooled)
+        name = "worker pool" if pooled else "inline     "
+        print(f"{name}: {result['frames']} frames, reader thread held "
+              f"p50 {result['p50_us']:8.1f} us, p99 {result['p99_us']:8.1f} us, "
+              f"max {result['max_us']:8.1f} us; burst processed in {result['total_s']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Startup benchmark: import time of the entry points, with a budget.
+
+Run with ``python benchmarks/bench_startup.py [--budget MS]``. Each entry
+point is imported in a fresh interpreter under ``python -X importtime``;
+the script prints the total and the slowest top-level imports, and exits
+with status 1 if any entry point takes longer than the budget. Entry
+points whose toolkit is not installed (e.g. PySide6) are reported as
+skipped. The modules the GUIs load in the background after the window is
+shown are listed too, for information; they do not count against the
+budget.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ["xbee_run_gui_updated", "xbee_run_gui_pyside6", "list_ports"]
+BACKGROUND = ["xbee_for_import", "xbee_telemetry", "xbee_history", "serial.tools.list_ports"]
+
+
+def import_times(module):
+    """(cumulative ms, [(ms, name)] of its direct imports), or (None, error)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            # Children are printed before their parent
+            if name.strip() == module:
+                return int(cumulative) / 1000.0, sorted(children, reverse=True)
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1000.0, name.strip()))
+    return 0.0, []  # already imported during interpreter startup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure entry point import times.")
+    parser.add_argument("--budget", type=float, default=300.0, help="milliseconds per entry point")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports to show")
+    args = parser.parse_args()
+
+    over = []
+    for module in ENTRY_POINTS:
+        total, top = import_times(module)
+        if total is None:
+            print(f"{module}: skipped ({top})")
+            continue
+        verdict = "OK" if total <= args.budget else "OVER BUDGET"
+        print(f"{module}: {total:.1f} ms ({verdict}, budget {args.budget:.0f} ms)")
+        for cumulative, name in top[:args.top]:
+            print(f"    {cumulative:8.1f} ms  {name}")
+        if total > args.budget:
+            over.append(module)
+
+    print("Loaded in the background after the window is shown:")
+    for module in BACKGROUND:
+        total, _ = import_times(module)
+        print(f"    {module}: " + ("unavailable" if total is None else f"{total:.1f} ms"))
+
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
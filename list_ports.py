@@ -1,6 +1,5 @@
-import serial.tools.list_ports
-
 def list_serial_ports():
+    import serial.tools.list_ports
     ports = serial.tools.list_ports.comports()
     if ports:
         print("Available serial ports:")
@@ -15,4 +14,20 @@ def list_serial_ports():
     else:
         print("No serial ports available")
 
-list_serial_ports()
+def detect_xbee_ports():
+    # Probe every port for an XBee (parallel AT NI query), see xbee_port_detect.py
+    from xbee_port_detect import PortDetector
+    radios = PortDetector().detect()
+    if radios:
+        print("XBee radios found:")
+        for radio in radios:
+            print(f"- Port: {radio.port}  Node ID: {radio.node_id}  Baud: {radio.baud}")
+    else:
+        print("No XBee radios found")
+
+if __name__ == "__main__":
+    import sys
+    if "--detect" in sys.argv:
+        detect_xbee_ports()
+    else:
+        list_serial_ports()
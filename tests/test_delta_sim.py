@@ -0,0 +1,69 @@
+"""Delta-coded unicast over the simulated medium: one ACK per keyframe."""
+
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xbee_delta import KEYFRAME  # noqa: E402
+from xbee_for_import import Communicator  # noqa: E402
+from xbee_sim import SimulatedDevice, SimulatedMedium  # noqa: E402
+
+NODES = 6
+
+
+class DeltaUnicastTest(unittest.TestCase):
+    def setUp(self):
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        medium = SimulatedMedium(discovery_time=0.2, seed=1)
+        self.nodes = [Communicator(sender_index=index + 1) for index in range(NODES)]
+        for index, node in enumerate(self.nodes):
+            name = "G" if index == 0 else "N%d" % index
+            node.attach_device(SimulatedDevice(medium, name, 0x0013A20000000000 + index + 1))
+        deadline = time.monotonic() + 10
+        while any(len(node.current_discovered_devices) < NODES - 1 for node in self.nodes):
+            self.assertLess(time.monotonic(), deadline, "discovery did not finish")
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+
+    def test_one_ack_per_keyframe(self):
+        ground = self.nodes[0]
+        ground.delta.enabled = True
+        acks = []
+        on_ack = ground.delta._on_ack
+        ground.delta._on_ack = lambda node, sequence: (acks.append((node, sequence)),
+                                                       on_ack(node, sequence))
+        keyframes = []
+        encode = ground.delta.encode
+        ground.delta.encode = lambda *args: self._note(keyframes, encode(*args))
+        subscriptions = [node.bus.subscribe("", maxsize=100) for node in self.nodes[1:]]
+
+        for value in (1500, 1510, 1520):
+            ground.send_single("N1", "move,1500,1500,1500,%d" % value)
+            ground.scheduler.wait_idle()
+            time.sleep(0.5)
+        for node in self.nodes:
+            node.wait_receive_idle()
+        time.sleep(0.5)
+
+        self.assertTrue(keyframes)
+        self.assertEqual(sorted(acks), sorted(("N1", sequence) for sequence in keyframes))
+        received = [subscription.queue.qsize() for subscription in subscriptions]
+        self.assertEqual(received, [3] + [0] * (NODES - 2))
+
+    @staticmethod
+    def _note(keyframes, text):
+        if text.startswith(KEYFRAME):
+            keyframes.append(text[len(KEYFRAME):].partition("~")[0])
+        return text
+
+
+if __name__ == "__main__":
+    unittest.main()
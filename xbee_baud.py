@@ -0,0 +1,130 @@
+"""Host-to-radio serial rate: detect it, raise it, remember it.
+
+The XBee's UART rate is its ``BD`` parameter. ``negotiate`` asks the radio
+to switch (``ATBD`` then ``ATAC``), reopens the host side at the new rate
+and checks it with a few ``AT NI`` round trips. A rate that fails the
+check is abandoned: the radio is found again at whatever rate it answers
+and set back, and the next lower rate is tried. ``BD`` is not written to
+flash, so a power cycle also restores the radio's own setting.
+
+The result is kept per adapter in the port detection cache
+(``xbee_ports.json``), so the next ``connect()`` opens at the right rate
+without probing.
+"""
+
+import time
+from typing import Iterable, Optional
+
+from xbee_port_detect import (BAUD_RATES, DEFAULT_CACHE, PROBE_TIMEOUT, PortDetector,
+                              adapter_key, at_exchange, probe)
+
+BD_CODES = {1200: 0, 2400: 1, 4800: 2, 9600: 3, 19200: 4, 38400: 5, 57600: 6,
+            115200: 7, 230400: 8, 460800: 9, 921600: 10}
+# Highest first; 460800 and up only on XBee 3 and only with short cables.
+NEGOTIATION_RATES = (230400, 115200)
+VERIFY_ROUNDS = 3
+# The radio answers ATAC at the old rate and switches right after.
+SWITCH_DELAY = 0.05
+
+
+def device_key(port: str) -> str:
+    """Cache key for the radio on ``port``: its USB identity, else the path."""
+    return adapter_key(port) or "port:" + port
+
+
+class BaudNegotiator:
+    """Detects and raises the rate of one radio at a time; see the module docstring."""
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE, rates: Iterable[int] = NEGOTIATION_RATES,
+                 verify_rounds: int = VERIFY_ROUNDS, timeout: float = PROBE_TIMEOUT) -> None:
+        self.detector = PortDetector(cache_path)
+        self.rates = sorted(rates, reverse=True)
+        self.verify_rounds = verify_rounds
+        self.timeout = timeout
+
+    def remembered(self, port: str) -> Optional[int]:
+        entry = self.detector.cache.get(device_key(port))
+        return entry["baud"] if entry else None
+
+    def remember(self, port: str, baud: int, node_id: Optional[str] = None) -> None:
+        key = device_key(port)
+        entry = self.detector.cache.get(key, {})
+        entry.update({"port": port, "baud": baud, "seen": time.time()})
+        if node_id is not None:
+            entry["node_id"] = node_id
+        self.detector.cache[key] = entry
+        self.detector.save()
+
+    def detect(self, port: str, preferred: Optional[int] = None) -> Optional[int]:
+        """The rate the radio on ``port`` answers at: remembered one first, then the usual."""
+        candidates = [rate for rate in (preferred, self.remembered(port)) if rate]
+        candidates += [rate for rate in BAUD_RATES + tuple(self.rates) if rate not in candidates]
+        for rate in candidates:
+            node_id = probe(port, rate, self.timeout)
+            if node_id is not None:
+                self.remember(port, rate, node_id)
+                return rate
+        return None
+
+    def verify(self, port: str, baud: int) -> bool:
+        """``verify_rounds`` AT round trips in a row at ``baud``."""
+        import serial
+        try:
+            with serial.Serial(port, baud, timeout=0.05, write_timeout=self.timeout) as link:
+                return all(at_exchange(link, "NI", timeout=self.timeout) is not None
+                           for _ in range(self.verify_rounds))
+        except (serial.SerialException, OSError, ValueError):
+            return False
+
+    def switch(self, port: str, current: int, target: int) -> bool:
+        """Tell the radio at ``current`` to move to ``target`` and check it did."""
+        import serial
+        try:
+            with serial.Serial(port, current, timeout=0.05, write_timeout=self.timeout) as link:
+                if at_exchange(link, "BD", bytes([BD_CODES[target]]), self.timeout) is None:
+                    return False
+                if at_exchange(link, "AC", timeout=self.timeout) is None:
+                    return False
+        except (serial.SerialException, OSError, ValueError):
+            return False
+        time.sleep(SWITCH_DELAY)
+        return self.verify(port, target)
+
+    def negotiate(self, port: str, current: Optional[int] = None) -> Optional[int]:
+        """Move the link on ``port`` to the highest rate that verifies.
+
+        Returns the rate the radio is at afterwards (``current`` if nothing
+        higher worked), or None if the radio does not answer at all.
+        """
+        current = current or self.detect(port)
+        if current is None:
+            return None
+        for target in self.rates:
+            if target <= current:
+                break
+            if self.switch(port, current, target):
+                self.remember(port, target)
+                return target
+            # Most likely the radio did switch and the link is poor: put it
+            # back from there, else find it wherever it ended up
+            if self.switch(port, target, current):
+                continue
+            found = self.detect(port, preferred=current)
+            if found is None:
+                return None
+            if found != current and not self.switch(port, found, current):
+                current = found
+        self.remember(port, current)
+        return current
+
+
+def detect_baud(port: str, preferred: Optional[int] = None,
+                cache_path: str = DEFAULT_CACHE) -> Optional[int]:
+    """Rate the radio on ``port`` answers at, or None."""
+    return BaudNegotiator(cache_path).detect(port, preferred)
+
+
+def negotiate_baud(port: str, current: Optional[int] = None,
+                   cache_path: str = DEFAULT_CACHE) -> Optional[int]:
+    """Raise the link on ``port`` as high as it reliably goes; the resulting rate."""
+    return BaudNegotiator(cache_path).negotiate(port, current)
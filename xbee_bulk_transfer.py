@@ -0,0 +1,399 @@
+"""Streaming file transfer over the mesh with windowed flow control and resume.
+
+Bulk frames bypass message reassembly entirely: they are binary frames
+(``FRAME_MARKER`` + type byte) routed to this module by
+``Communicator.register_frame_handler``. The sender keeps at most
+``window`` chunks in memory and the receiver appends each in-order chunk
+straight to a ``.part`` file, so memory use does not depend on the size of
+the transfer. Because the ``.part`` file only ever holds acknowledged
+bytes, its length is the resume offset after a disconnect or restart.
+
+Files are identified by a digest of their content, not by name and size: an
+edited file is a new transfer, a ``.part`` file is only resumed by the same
+content, and the receiver checks the digest before it accepts the result.
+"""
+
+import hashlib
+import os
+import secrets
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+from xbee_for_import import FRAME_MARKER
+
+FRAME_START = b"S"
+FRAME_DATA = b"D"
+FRAME_ACK = b"A"
+FRAME_END = b"E"
+
+# marker, type, transfer id, then a type-specific 32-bit value
+# (START: total size or UNKNOWN_SIZE, DATA: offset, ACK: next expected
+# offset, END: total size). START is followed by the content digest and
+# the file name, DATA by the chunk.
+_FRAME = struct.Struct(">BcII")
+_DIGEST = struct.Struct(">I")
+UNKNOWN_SIZE = 0xFFFFFFFF
+UNKNOWN_DIGEST = 0  # iterator sources: the content is not known up front
+
+CHUNK_SIZE = 48
+
+Source = Union[str, os.PathLike, Iterable[bytes]]
+
+
+class TransferAborted(Exception):
+    """The transfer made no progress for too long; call again to resume."""
+
+
+def _frame(frame_type: bytes, transfer_id: int, value: int, body: bytes = b"") -> bytes:
+    return _FRAME.pack(FRAME_MARKER, frame_type, transfer_id, value) + body
+
+
+def _digest(file) -> int:
+    """First 32 bits of the SHA-256 of ``file`` from its current position to the end."""
+    hasher = hashlib.sha256()
+    for block in iter(lambda: file.read(1 << 16), b""):
+        hasher.update(block)
+    return int.from_bytes(hasher.digest()[:4], "big") or 1
+
+
+class _ChunkReader:
+    """Reads fixed-size chunks from a path, file object or byte iterator."""
+
+    def __init__(self, source: Source, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self._owned = isinstance(source, (str, os.PathLike))
+        self._file = open(source, "rb") if self._owned else (
+            source if hasattr(source, "read") else None)
+        self._iterator = None if self._file is not None else iter(source)
+        self._pending = bytearray()
+        self.position = 0
+
+    @property
+    def seekable(self) -> bool:
+        return self._file is not None and self._file.seekable()
+
+    def seek(self, offset: int) -> None:
+        """Move to ``offset``; non-seekable sources can only skip forward."""
+        if self.seekable:
+            self._file.seek(offset)
+            self.position = offset
+            return
+        if offset < self.position:
+            raise TransferAborted("source cannot rewind to offset %d" % offset)
+        while self.position < offset:
+            if not self.read(min(self.chunk_size, offset - self.position)):
+                break
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        size = size or self.chunk_size
+        if self._file is not None:
+            chunk = self._file.read(size)
+        else:
+            while len(self._pending) < size:
+                item = next(self._iterator, None)
+                if item is None:
+                    break
+                self._pending += item
+            chunk = bytes(self._pending[:size])
+            del self._pending[:size]
+        self.position += len(chunk)
+        return chunk
+
+    def digest(self) -> int:
+        """Digest of the whole content, read ahead and rewound; unknown for iterators."""
+        if not self.seekable:
+            return UNKNOWN_DIGEST
+        start = self._file.tell()
+        self._file.seek(0)
+        try:
+            return _digest(self._file)
+        finally:
+            self._file.seek(start)
+
+    def size(self) -> int:
+        if self._file is not None:
+            try:
+                return os.fstat(self._file.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                pass
+        return UNKNOWN_SIZE
+
+    def close(self) -> None:
+        if self._owned:
+            self._file.close()
+
+
+class _Outgoing:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.acked = -1
+        self.acks = 0
+
+
+class _Incoming:
+    def __init__(self, path: str, part_path: str, digest: int) -> None:
+        self.path = path
+        self.part_path = part_path
+        self.digest = digest
+        self.file = open(part_path, "ab")
+        self.offset = self.file.tell()
+        self.unacked = 0
+        self.last_ack = (-1, 0.0)
+
+
+class BulkTransferManager:
+    """Sends and receives bulk transfers on one ``Communicator``."""
+
+    def __init__(self, communicator, receive_dir: str = "received",
+                 window: int = 8, chunk_size: int = CHUNK_SIZE,
+                 ack_every: int = 4, timeout: float = 2.0,
+                 max_stall: float = 60.0,
+                 on_complete: Optional[Callable[[str, str], None]] = None) -> None:
+        self.communicator = communicator
+        self.receive_dir = receive_dir
+        self.window = window
+        self.chunk_size = chunk_size
+        self.ack_every = ack_every
+        self.timeout = timeout
+        self.max_stall = max_stall
+        self.on_complete = on_complete
+        self._outgoing: Dict[int, _Outgoing] = {}
+        self._incoming: Dict[Tuple[str, int], _Incoming] = {}
+        self._completed: Dict[Tuple[str, int], Tuple[int, int]] = {}  # key -> (size, digest)
+        self._lock = threading.Lock()
+        for frame_type, handler in ((FRAME_START, self._on_start),
+                                    (FRAME_DATA, self._on_data),
+                                    (FRAME_ACK, self._on_ack),
+                                    (FRAME_END, self._on_end)):
+            communicator.register_frame_handler(frame_type, handler)
+
+    # --- sending -------------------------------------------------------
+
+    def send_file(self, remote_address: str, source: Source,
+                  name: Optional[str] = None, transfer_id: Optional[int] = None,
+                  progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+        """Stream ``source`` to ``remote_address``; return the bytes delivered.
+
+        ``source`` is a path, a binary file object or an iterable of bytes.
+        For paths and seekable files the default transfer ID is derived from
+        the name and a digest of the content, so calling again after
+        ``TransferAborted`` resumes from the last offset the receiver
+        acknowledged, while an edited file starts over. An iterable gets a
+        random ID; pass ``transfer_id`` (and the same bytes) to resume it.
+        """
+        remote = self.communicator.find_remote_device(remote_address)
+        if remote is None:
+            raise TransferAborted("device not found with address: %s" % remote_address)
+        if name is None:
+            name = os.path.basename(str(source)) if isinstance(
+                source, (str, os.PathLike)) else "transfer.bin"
+        reader = _ChunkReader(source, self.chunk_size)
+        try:
+            size = reader.size()
+            digest = reader.digest()
+        except Exception:
+            reader.close()
+            raise
+        if transfer_id is None:
+            if digest == UNKNOWN_DIGEST:
+                transfer_id = secrets.randbits(32)
+            else:
+                transfer_id = zlib.crc32(f"{name}:{size}:{digest:08x}".encode("utf8"))
+        transfer = _Outgoing()
+        self._outgoing[transfer_id] = transfer
+        try:
+            return self._stream(remote, transfer, transfer_id, reader, name, size, digest,
+                                progress)
+        finally:
+            del self._outgoing[transfer_id]
+            reader.close()
+
+    def _send(self, remote, frame: bytes) -> None:
+        try:
+            self.communicator._transmit(remote, frame)
+        except Exception as error:
+            # A dropped radio looks like lost frames; the timeouts recover.
+            print("Bulk send error:", str(error))
+
+    def _wait_ack(self, transfer: _Outgoing, seen_acks: int) -> Optional[int]:
+        with transfer.condition:
+            transfer.condition.wait_for(lambda: transfer.acks != seen_acks, self.timeout)
+            return transfer.acked if transfer.acks != seen_acks else None
+
+    def _handshake(self, remote, transfer: _Outgoing, transfer_id: int,
+                   name: str, size: int, digest: int) -> int:
+        """Announce the transfer; return the offset the receiver already has."""
+        deadline = time.monotonic() + self.max_stall
+        body = _DIGEST.pack(digest) + name.encode("utf8")
+        while time.monotonic() < deadline:
+            seen = transfer.acks
+            self._send(remote, _frame(FRAME_START, transfer_id, size, body))
+            acked = self._wait_ack(transfer, seen)
+            if acked is not None:
+                return acked
+        raise TransferAborted("receiver did not answer")
+
+    def _stream(self, remote, transfer: _Outgoing, transfer_id: int,
+                reader: _ChunkReader, name: str, size: int, digest: int, progress) -> int:
+        offset = self._handshake(remote, transfer, transfer_id, name, size, digest)
+        reader.seek(offset)
+        window: deque = deque()
+        next_offset = offset
+        finished = False
+        last_progress = time.monotonic()
+        timeouts = 0
+
+        while True:
+            seen = transfer.acks
+            while not finished and len(window) < self.window:
+                chunk = reader.read()
+                if not chunk:
+                    finished = True
+                    break
+                self._send(remote, _frame(FRAME_DATA, transfer_id, next_offset, chunk))
+                window.append((next_offset, chunk))
+                next_offset += len(chunk)
+
+            if finished and not window:
+                self._send(remote, _frame(FRAME_END, transfer_id, next_offset))
+            acked = self._wait_ack(transfer, seen)
+            if finished and not window and acked == next_offset:
+                return next_offset
+
+            if time.monotonic() - last_progress > self.max_stall:
+                raise TransferAborted("no progress for %.0f s" % self.max_stall)
+
+            if acked is None:
+                timeouts += 1
+                if timeouts % 3:
+                    for chunk_offset, chunk in window:
+                        self._send(remote, _frame(FRAME_DATA, transfer_id, chunk_offset, chunk))
+                    continue
+                # Long silence: the receiver may have restarted, ask again.
+                acked = self._handshake(remote, transfer, transfer_id, name, size, digest)
+
+            timeouts = 0
+            if acked < (window[0][0] if window else next_offset):
+                # The receiver lost bytes we no longer hold: rewind the source.
+                reader.seek(acked)
+                window.clear()
+                next_offset = acked
+                finished = False
+                continue
+
+            advanced = False
+            while window and window[0][0] + len(window[0][1]) <= acked:
+                window.popleft()
+                advanced = True
+            if advanced:
+                last_progress = time.monotonic()
+                if progress is not None:
+                    progress(acked, None if size == UNKNOWN_SIZE else size)
+            elif window and acked == window[0][0]:
+                # Receiver is stuck at the start of the window: go back N.
+                for chunk_offset, chunk in window:
+                    self._send(remote, _frame(FRAME_DATA, transfer_id, chunk_offset, chunk))
+
+    def _on_ack(self, data, source_device) -> None:
+        _, _, transfer_id, offset = _FRAME.unpack_from(data)
+        transfer = self._outgoing.get(transfer_id)
+        if transfer is None:
+            return
+        with transfer.condition:
+            transfer.acked = offset
+            transfer.acks += 1
+            transfer.condition.notify_all()
+
+    # --- receiving -----------------------------------------------------
+
+    def _ack(self, source_device, transfer_id: int, offset: int) -> None:
+        self._send(source_device, _frame(FRAME_ACK, transfer_id, offset))
+
+    def _on_start(self, data, source_device) -> None:
+        _, _, transfer_id, size = _FRAME.unpack_from(data)
+        digest, = _DIGEST.unpack_from(data, _FRAME.size)
+        key = (self.communicator.node_key(source_device), transfer_id)
+        with self._lock:
+            completed = self._completed.get(key)
+            if completed is not None and completed[1] == digest:
+                self._ack(source_device, transfer_id, completed[0])
+                return
+            self._completed.pop(key, None)
+            incoming = self._incoming.get(key)
+            if incoming is not None and incoming.digest != digest:
+                # Same ID, different content: the partial file is stale
+                incoming.file.close()
+                os.remove(incoming.part_path)
+                incoming = None
+            if incoming is None:
+                name = bytes(data[_FRAME.size + _DIGEST.size:]).decode("utf8", "replace")
+                name = os.path.basename(name)
+                os.makedirs(self.receive_dir, exist_ok=True)
+                path = os.path.join(self.receive_dir, name or "transfer.bin")
+                # The digest in the name keeps other content from resuming it
+                incoming = _Incoming(path, "%s.%08x.%08x.part" % (path, transfer_id, digest),
+                                     digest)
+                self._incoming[key] = incoming
+            self._ack(source_device, transfer_id, incoming.offset)
+
+    def _on_data(self, data, source_device) -> None:
+        _, _, transfer_id, offset = _FRAME.unpack_from(data)
+        key = (self.communicator.node_key(source_device), transfer_id)
+        with self._lock:
+            incoming = self._incoming.get(key)
+            if incoming is None:
+                return
+            if offset == incoming.offset:
+                incoming.file.write(memoryview(data)[_FRAME.size:])
+                incoming.offset += len(data) - _FRAME.size
+                incoming.unacked += 1
+                if incoming.unacked < self.ack_every:
+                    return
+            now = time.monotonic()
+            if offset != incoming.offset and incoming.last_ack[0] == incoming.offset \
+                    and now - incoming.last_ack[1] < self.timeout / 2:
+                return  # this gap or duplicate has just been reported
+            # Acknowledge only bytes that reached the file, so a resume
+            # never skips data lost in a buffer.
+            incoming.file.flush()
+            incoming.unacked = 0
+            incoming.last_ack = (incoming.offset, now)
+            self._ack(source_device, transfer_id, incoming.offset)
+
+    def _on_end(self, data, source_device) -> None:
+        _, _, transfer_id, total = _FRAME.unpack_from(data)
+        key = (self.communicator.node_key(source_device), transfer_id)
+        with self._lock:
+            incoming = self._incoming.get(key)
+            if incoming is None:
+                completed = self._completed.get(key)
+                if completed is not None:
+                    self._ack(source_device, transfer_id, completed[0])
+                return
+            incoming.file.flush()
+            if incoming.offset != total:
+                self._ack(source_device, transfer_id, incoming.offset)
+                return
+            if incoming.digest != UNKNOWN_DIGEST:
+                with open(incoming.part_path, "rb") as part:
+                    received = _digest(part)
+                if received != incoming.digest:
+                    # Not what the sender announced: start the file over
+                    print("Bulk transfer %08x failed verification, restarting" % transfer_id)
+                    incoming.file.truncate(0)
+                    incoming.offset = 0
+                    self._ack(source_device, transfer_id, 0)
+                    return
+            incoming.file.close()
+            os.replace(incoming.part_path, incoming.path)
+            del self._incoming[key]
+            if len(self._completed) >= 64:
+                self._completed.pop(next(iter(self._completed)))
+            self._completed[key] = (total, incoming.digest)
+            self._ack(source_device, transfer_id, total)
+        if self.on_complete is not None:
+            self.on_complete(incoming.path, source_device.get_node_id())
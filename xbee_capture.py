@@ -0,0 +1,171 @@
+"""Binary capture of raw radio frames and replay into ``message_callback``.
+
+A capture file is ``MAGIC`` followed by records of::
+
+    u64 monotonic ns | u8 direction | u64 64-bit address | u8 node ID length
+    | u16 payload length | node ID | payload
+
+all big-endian. Records are only ever appended, so a capture cut short by
+a crash is readable up to its last complete record.
+"""
+
+import argparse
+import struct
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Iterable, Iterator, Optional
+
+from digi.xbee.models.address import XBee64BitAddress
+
+MAGIC = b"XBCAP1\n"
+_RECORD = struct.Struct(">QBQBH")
+
+INBOUND = 0
+OUTBOUND = 1
+BROADCAST = 2
+DIRECTION_NAMES = {INBOUND: "in", OUTBOUND: "out", BROADCAST: "bcast"}
+
+CaptureRecord = namedtuple("CaptureRecord", "timestamp_ns direction address node_id payload")
+
+
+class CaptureWriter:
+    """Appends frames to a capture file; safe to call from several threads."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def record(self, direction: int, address, node_id: Optional[str], payload,
+               timestamp_ns: Optional[int] = None) -> None:
+        """Append one frame; ``timestamp_ns`` (monotonic) defaults to now."""
+        address = int(str(address), 16) if address is not None else 0
+        node = (node_id or "").encode("utf8")[:255]
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        header = _RECORD.pack(timestamp_ns, direction, address, len(node), len(payload))
+        with self._lock:
+            self._file.write(header + node + bytes(payload))
+            # Flush every frame: the interesting part of a field capture is
+            # usually the moments before a crash.
+            self._file.flush()
+            self.records += 1
+
+    def record_device(self, direction: int, remote_device, payload,
+                      timestamp_ns: Optional[int] = None) -> None:
+        self.record(direction, remote_device.get_64bit_addr(),
+                    remote_device.get_node_id(), payload, timestamp_ns)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """Yield the complete records of a capture file in order."""
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        while True:
+            header = capture.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, direction, address, node_length, length = _RECORD.unpack(header)
+            body = capture.read(node_length + length)
+            if len(body) < node_length + length:
+                return
+            yield CaptureRecord(timestamp, direction, address,
+                                body[:node_length].decode("utf8", "replace"),
+                                body[node_length:])
+
+
+class ReplayRemote:
+    """Stands in for ``RemoteXBeeDevice`` during replay."""
+
+    def __init__(self, address: int, node_id: str) -> None:
+        self._address = XBee64BitAddress(address.to_bytes(8, "big"))
+        self._node_id = node_id
+
+    def get_64bit_addr(self) -> XBee64BitAddress:
+        return self._address
+
+    def get_node_id(self) -> str:
+        return self._node_id
+
+
+class ReplayMessage:
+    """Stands in for ``XBeeMessage``: ``remote_device``, ``data``, ``timestamp``."""
+
+    def __init__(self, remote_device: ReplayRemote, data: bytearray, timestamp: float) -> None:
+        self.remote_device = remote_device
+        self.data = data
+        self.timestamp = timestamp
+        self.is_broadcast = False
+
+
+def replay(records: Iterable[CaptureRecord], callback: Callable,
+           speed: Optional[float] = 1.0, directions=(INBOUND,)) -> int:
+    """Feed captured frames to ``callback`` (e.g. ``message_callback``).
+
+    ``speed`` 1.0 keeps the recorded timing, 4.0 plays four times faster
+    and ``None`` (or 0) replays as fast as possible. Returns the number of
+    frames delivered.
+    """
+    remotes = {}
+    delivered = 0
+    first = None
+    start = time.monotonic()
+    for record in records:
+        if record.direction not in directions:
+            continue
+        if speed:
+            if first is None:
+                first = record.timestamp_ns
+            delay = start + (record.timestamp_ns - first) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        remote = remotes.get((record.address, record.node_id))
+        if remote is None:
+            remote = remotes[(record.address, record.node_id)] = ReplayRemote(
+                record.address, record.node_id)
+        callback(ReplayMessage(remote, bytearray(record.payload), time.time()))
+        delivered += 1
+    return delivered
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or replay a radio capture.")
+    parser.add_argument("command", choices=["dump", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed multiplier, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        first = None
+        for record in read_capture(args.path):
+            first = record.timestamp_ns if first is None else first
+            print("%10.3f %-5s %016X %-12s %r" % (
+                (record.timestamp_ns - first) / 1e9, DIRECTION_NAMES.get(record.direction, "?"),
+                record.address, record.node_id, bytes(record.payload)))
+        return
+
+    from xbee_for_import import Communicator
+    from xbee_metrics import METRICS
+    communicator = Communicator()
+    # message_queue is bounded and drops the oldest, so it cannot be counted
+    reassembled = METRICS.get("messages.reassembled")
+    started = time.monotonic()
+    frames = replay(read_capture(args.path), communicator.message_callback, args.speed)
+    communicator.wait_receive_idle()
+    elapsed = time.monotonic() - started
+    print("Replayed %d frames in %.2f s, %d messages reassembled" % (
+        frames, elapsed, METRICS.get("messages.reassembled") - reassembled))
+
+
+if __name__ == "__main__":
+    main()
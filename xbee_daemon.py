@@ -0,0 +1,311 @@
+"""Headless radio daemon: one process owns the XBee, local clients share it.
+
+Clients connect over a Unix socket (or TCP on localhost where Unix sockets
+are unavailable) and exchange JSON lines. Requests::
+
+    {"op": "send", "msg": "..."}
+    {"op": "send_single", "to": "NODE", "msg": "..."}
+    {"op": "subscribe", "prefixes": ["BATT "], "topics": ["move"]}
+    {"op": "unsubscribe"}
+    {"op": "list"}
+    {"op": "refresh"}
+    {"op": "history", "minutes": 10, "node": "DRONE1", "limit": 100}
+    {"op": "stats"}
+
+Each request gets one ``{"ok": true, ...}`` or ``{"ok": false, "error": ...}``
+reply, in order. Received messages arrive as ``{"event": "message", "data":
+{...}}`` on every subscribed connection. Each message is encoded once and
+the same bytes object is handed to every client; a client whose socket
+buffer grows past ``max_buffer`` has messages dropped instead of slowing
+the radio or the other clients.
+
+Run as ``python xbee_daemon.py COM3 [--socket PATH | --tcp PORT] [--history DIR]``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from typing import List, Optional, Set
+
+from xbee_history import DEFAULT_DIR as DEFAULT_HISTORY_DIR, MessageHistory
+from xbee_metrics import METRICS
+from xbee_pubsub import MessageBus, message_topic
+from xbee_queues import DROP_OLDEST, BoundedQueue
+
+DEFAULT_SOCKET = "/tmp/xbee-daemon.sock"
+DEFAULT_TCP_PORT = 8765
+MAX_CLIENT_BUFFER = 256 * 1024
+
+
+def default_address() -> str:
+    """Unix socket path where supported, otherwise ``localhost:PORT``."""
+    if hasattr(socket, "AF_UNIX"):
+        return DEFAULT_SOCKET
+    return "localhost:%d" % DEFAULT_TCP_PORT
+
+
+def _split_tcp(address: str):
+    """``host:port`` -> (host, port), or None for a socket path."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and os.sep not in address:
+        return host, int(port)
+    return None
+
+
+class _Client:
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.prefixes: List[str] = []
+        self.topics: Set[str] = set()
+        self.subscribed = False
+        self.sent = 0
+        self.dropped = 0
+
+    def wants(self, text: str, topic: str) -> bool:
+        if not self.subscribed:
+            return False
+        if topic in self.topics:
+            return True
+        return any(text.startswith(prefix) for prefix in self.prefixes)
+
+
+class RadioDaemon:
+    """Serves one ``Communicator`` (or compatible object) to local clients."""
+
+    def __init__(self, communicator, address: Optional[str] = None,
+                 max_buffer: int = MAX_CLIENT_BUFFER,
+                 history: Optional[MessageHistory] = None) -> None:
+        self.communicator = communicator
+        self.history = history
+        self.address = address or default_address()
+        self.max_buffer = max_buffer
+        self.clients: Set[_Client] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        tcp = _split_tcp(self.address)
+        if tcp is not None:
+            self._server = await asyncio.start_server(self._serve, *tcp)
+        else:
+            if os.path.exists(self.address):
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(self.address)
+                    raise OSError("a daemon is already serving %s" % self.address)
+                except ConnectionError:
+                    os.unlink(self.address)  # stale socket from an earlier run
+                finally:
+                    probe.close()
+            self._server = await asyncio.start_unix_server(self._serve, self.address)
+        subscription = self.communicator.bus.subscribe("", maxsize=10000)
+        threading.Thread(target=self._pump, args=(subscription,), daemon=True).start()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _pump(self, subscription) -> None:
+        """Radio thread side: hand each received message to the event loop."""
+        while True:
+            message = subscription.get()
+            self._loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message: dict) -> None:
+        text = message["msg"]
+        topic = message_topic(text)
+        line = None
+        for client in self.clients:
+            if not client.wants(text, topic) or client.writer.transport.is_closing():
+                continue
+            if client.writer.transport.get_write_buffer_size() > self.max_buffer:
+                client.dropped += 1
+                METRICS.incr("queue.client.dropped")
+                continue
+            if line is None:
+                line = (json.dumps({"event": "message", "data": message}) + "\n").encode("utf8")
+            client.writer.write(line)
+            client.sent += 1
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self._handle(client, json.loads(line))
+                except Exception as error:
+                    reply = {"ok": False, "error": str(error)}
+                writer.write((json.dumps(reply) + "\n").encode("utf8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def _handle(self, client: _Client, request: dict) -> dict:
+        op = request.get("op")
+        # Radio calls block on the serial port: keep them off the event loop.
+        run = self._loop.run_in_executor
+        if op == "send":
+            await run(None, self.communicator.send, request["msg"])
+        elif op == "send_single":
+            await run(None, self.communicator.send_single, request["to"], request["msg"])
+        elif op == "subscribe":
+            client.prefixes = list(request.get("prefixes", [""]))
+            client.topics = set(request.get("topics", []))
+            client.subscribed = True
+        elif op == "unsubscribe":
+            client.subscribed = False
+        elif op == "list":
+            return {"ok": True, "devices": await run(None, self.communicator.list_devices)}
+        elif op == "refresh":
+            await run(None, self.communicator.refresh)
+        elif op == "history" and self.history is not None:
+            minutes = request.get("minutes")
+            records = await run(None, lambda: self.history.query(
+                start=time.time() - minutes * 60.0 if minutes else None,
+                node=request.get("node"), limit=request.get("limit")))
+            return {"ok": True, "records": [record._asdict() for record in records]}
+        elif op == "stats":
+            return {"ok": True, "clients": [{"sent": c.sent, "dropped": c.dropped}
+                                            for c in self.clients],
+                    "metrics": METRICS.snapshot()}
+        else:
+            return {"ok": False, "error": "unknown op: %s" % op}
+        return {"ok": True}
+
+
+class DaemonClient:
+    """Same API as ``Communicator``, talking to a ``RadioDaemon``.
+
+    ``connect`` takes the daemon address (socket path or ``host:port``)
+    instead of a serial port. Received messages are put on
+    ``message_queue`` and published on ``bus`` like a local radio's.
+    """
+
+    def __init__(self, prefixes=("",), topics=()) -> None:
+        self.message_queue = BoundedQueue(1000, DROP_OLDEST, name="reassembled")
+        self.bus = MessageBus()
+        self.prefixes = list(prefixes)
+        self.topics = list(topics)
+        self.sock: Optional[socket.socket] = None
+        self._replies: queue.Queue = queue.Queue()
+        self._request_lock = threading.Lock()
+
+    @property
+    def device(self):
+        """Truthy while connected to the daemon."""
+        return self.sock
+
+    def connect(self, device_name: Optional[str] = None,
+                baud_rate: Optional[int] = None) -> None:
+        """Connect to the daemon; ``baud_rate`` is ignored, the daemon owns the port."""
+        if self.sock is not None:
+            print("Device already connected")
+            return
+        address = device_name or default_address()
+        tcp = _split_tcp(address)
+        if tcp is not None:
+            sock = socket.create_connection(tcp)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+        self.sock = sock
+        threading.Thread(target=self._read, args=(sock.makefile("rb"),), daemon=True).start()
+        self._request({"op": "subscribe", "prefixes": self.prefixes, "topics": self.topics})
+
+    def _read(self, stream) -> None:
+        for line in stream:
+            data = json.loads(line)
+            if data.get("event") == "message":
+                message = data["data"]
+                self.message_queue.put(json.dumps(message))
+                self.bus.publish(message["msg"], message)
+            else:
+                self._replies.put(data)
+        self.sock = None
+        self._replies.put({"ok": False, "error": "daemon closed the connection"})
+
+    def _request(self, request: dict, timeout: float = 10.0) -> Optional[dict]:
+        if self.sock is None:
+            print("No device connected")
+            return None
+        with self._request_lock:
+            self.sock.sendall((json.dumps(request) + "\n").encode("utf8"))
+            try:
+                reply = self._replies.get(timeout=timeout)
+            except queue.Empty:
+                print("Daemon did not reply to", request.get("op"))
+                return None
+        if not reply.get("ok"):
+            print("Daemon error:", reply.get("error"))
+        return reply
+
+    def send(self, message: str) -> None:
+        self._request({"op": "send", "msg": message})
+
+    def send_single(self, remote_address: str, message: str) -> None:
+        self._request({"op": "send_single", "to": remote_address, "msg": message})
+
+    def list_devices(self) -> list:
+        reply = self._request({"op": "list"})
+        return reply.get("devices", []) if reply else []
+
+    def refresh(self) -> None:
+        self._request({"op": "refresh"})
+
+    def query_history(self, minutes: Optional[float] = None, node: Optional[str] = None,
+                      limit: Optional[int] = None) -> list:
+        """The daemon's message history as a list of record dicts."""
+        reply = self._request({"op": "history", "minutes": minutes, "node": node,
+                               "limit": limit})
+        return reply.get("records", []) if reply else []
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Share one XBee radio between local clients.")
+    parser.add_argument("port", help="serial port, or several separated by commas")
+    parser.add_argument("--socket", help="Unix socket path (default %s)" % DEFAULT_SOCKET)
+    parser.add_argument("--tcp", type=int, metavar="PORT", help="listen on localhost:PORT instead")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_DIR, metavar="DIR",
+                        help="message history directory (default: %s)" % DEFAULT_HISTORY_DIR)
+    args = parser.parse_args()
+
+    if "," in args.port:
+        from xbee_multi_radio import MultiRadioCommunicator
+        communicator = MultiRadioCommunicator()
+    else:
+        from xbee_for_import import Communicator
+        communicator = Communicator()
+    history = MessageHistory(args.history)
+    history.bind(communicator)
+    communicator.connect(args.port)
+
+    address = "localhost:%d" % args.tcp if args.tcp else args.socket
+    daemon = RadioDaemon(communicator, address, history=history)
+    print("Serving %s on %s" % (args.port, daemon.address))
+    try:
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
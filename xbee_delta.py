@@ -0,0 +1,232 @@
+"""Delta encoding of repeated control and telemetry messages.
+
+``move,1500,1500,1500,1510`` after ``move,1500,1500,1500,1500`` changes one
+field, yet is sent in full. ``DeltaCodec`` splits a message into fields at
+``,``, ``:`` and whitespace and, per stream (destination and topic, e.g.
+``DRONE1``/``move``), sends either
+
+``~K<seq>~<scope>~<text>``
+    a keyframe: the whole message, numbered; its receivers answer
+    ``~A<seq>~<sender>``;
+``~D<base>~<scope>~<field>=<value>,...``
+    only the fields that differ from keyframe ``<base>``.
+
+``<scope>`` is the addressee's node ID, or ``*`` for flooded messages.
+Only the addressee decodes and acknowledges a unicast stream, and it does
+not relay it; other nodes that see it only relay it. A flooded keyframe
+is decoded everywhere but acknowledged only by the nodes that heard it
+straight from the sender, the neighbours the sender waits for.
+
+Deltas are always taken against the newest keyframe every receiver of the
+stream has acknowledged, so a lost delta costs nothing and a lost keyframe
+just leaves the previous base in use. A keyframe is forced every
+``keyframe_interval`` messages, when the field layout changes, or when a
+receiver that lacks a base answers a delta with ``~R<base>~<sender>``.
+Sequence numbers are base 36 and unique per sender across streams, so
+answers name the sender they are for: relays see them too. Answers are
+consumed by the codec, never published.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from xbee_metrics import METRICS, Metrics
+from xbee_pubsub import message_topic
+
+PREFIX = "~"
+KEYFRAME = "~K"
+DELTA = "~D"
+ACK = "~A"
+REQUEST = "~R"
+
+KEYFRAME_INTERVAL = 20
+KEEP_KEYFRAMES = 8      # per sender, on the receiving side
+DELTA_TOPICS = ("move", "BATT")
+# Scope of flooded messages: any node may ask for a keyframe.
+EVERYONE = "*"
+
+_FIELDS = re.compile(r"([,:\s]+)")
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(number: int) -> str:
+    text = ""
+    while True:
+        number, digit = divmod(number, 36)
+        text = _DIGITS[digit] + text
+        if not number:
+            return text
+
+
+def split_fields(text: str) -> List[str]:
+    """Fields at even, separators at odd indexes; ``"".join`` gives ``text`` back."""
+    return _FIELDS.split(text)
+
+
+class _Keyframe:
+    __slots__ = ("fields", "needed", "acked")
+
+    def __init__(self, fields: List[str], needed: Set[str]) -> None:
+        self.fields = fields
+        self.needed = needed
+        self.acked: Set[str] = set()
+
+
+class _Stream:
+    __slots__ = ("scope", "base", "base_fields", "pending", "since_keyframe", "receivers")
+
+    def __init__(self, scope: str) -> None:
+        self.scope = scope
+        self.base: Optional[str] = None
+        self.base_fields: Optional[List[str]] = None
+        self.pending: "OrderedDict[str, _Keyframe]" = OrderedDict()
+        self.since_keyframe = 0
+        self.receivers: Set[str] = set()
+
+
+class DeltaCodec:
+    def __init__(self, enabled: bool = False, topics: Iterable[str] = DELTA_TOPICS,
+                 keyframe_interval: int = KEYFRAME_INTERVAL,
+                 metrics: Metrics = METRICS) -> None:
+        self.enabled = enabled
+        self.topics = set(topics)
+        self.keyframe_interval = keyframe_interval
+        self.metrics = metrics
+        self._sequence = 0
+        self._streams: Dict[Tuple[str, str], _Stream] = {}
+        self._by_sequence: Dict[str, _Stream] = {}
+        self._received: Dict[str, "OrderedDict[str, List[str]]"] = {}
+        self._requested: Dict[str, Set[str]] = {}  # sender -> bases asked for
+        self._lock = threading.Lock()
+
+    # --- sending -------------------------------------------------------
+
+    def encode(self, scope: str, text: str, receivers: Iterable[str]) -> str:
+        """Text to send instead of ``text`` on ``scope``.
+
+        ``receivers`` are the node IDs that must acknowledge a keyframe
+        before deltas are taken against it.
+        """
+        topic = message_topic(text)
+        if (not self.enabled or topic not in self.topics or text.startswith(PREFIX)
+                or PREFIX in scope):
+            return text
+        fields = split_fields(text)
+        with self._lock:
+            stream = self._streams.get((scope, topic))
+            if stream is None:
+                stream = self._streams[(scope, topic)] = _Stream(scope)
+            stream.receivers = set(receivers)
+            base = stream.base_fields
+            if (base is not None and stream.since_keyframe < self.keyframe_interval
+                    and len(base) == len(fields) and base[1::2] == fields[1::2]):
+                changes = ",".join("%d=%s" % (index // 2, fields[index])
+                                   for index in range(0, len(fields), 2)
+                                   if fields[index] != base[index])
+                delta = DELTA + stream.base + PREFIX + scope + PREFIX + changes
+                if len(delta) < len(text):
+                    stream.since_keyframe += 1
+                    self.metrics.incr("delta.deltas")
+                    self.metrics.incr("delta.bytes_saved", len(text) - len(delta))
+                    return delta
+            self._sequence += 1
+            sequence = _base36(self._sequence)
+            stream.pending[sequence] = _Keyframe(fields, set(stream.receivers))
+            while len(stream.pending) > KEEP_KEYFRAMES:
+                self._by_sequence.pop(stream.pending.popitem(last=False)[0], None)
+            self._by_sequence[sequence] = stream
+            stream.since_keyframe = 0
+        self.metrics.incr("delta.keyframes")
+        return KEYFRAME + sequence + PREFIX + scope + PREFIX + text
+
+    def _on_ack(self, node: str, sequence: str) -> None:
+        stream = self._by_sequence.get(sequence)
+        if stream is None or sequence not in stream.pending:
+            return
+        keyframe = stream.pending[sequence]
+        keyframe.acked.add(node)
+        if keyframe.needed <= keyframe.acked:
+            stream.base, stream.base_fields = sequence, keyframe.fields
+            # Older keyframes can no longer become the base
+            while stream.pending:
+                older, _ = stream.pending.popitem(last=False)
+                if older == sequence:
+                    break
+                self._by_sequence.pop(older, None)
+
+    def _on_request(self, node: str, sequence: str) -> None:
+        stream = self._by_sequence.get(sequence)
+        if stream is not None and (stream.scope == EVERYONE or node in stream.receivers):
+            stream.base = stream.base_fields = None
+            self.metrics.incr("delta.requests")
+
+    # --- receiving -----------------------------------------------------
+
+    def decode(self, sender: str, text: str, me: str,
+               direct: bool = False) -> Tuple[Optional[str], Optional[str]]:
+        """Return (message to publish or None, answer to send ``sender`` or None).
+
+        ``sender`` is the node the message came from first, ``me`` this
+        node's ID; ``direct`` tells whether it came straight from ``sender``
+        rather than through a relay.
+        """
+        if not text.startswith(PREFIX) or len(text) < 2:
+            return text, None
+        kind, body = text[:2], text[2:]
+        with self._lock:
+            if kind in (ACK, REQUEST):
+                sequence, _, target = body.partition(PREFIX)
+                if target != me:
+                    return None, None
+                if kind == ACK:
+                    self._on_ack(sender, sequence)
+                else:
+                    self._on_request(sender, sequence)
+                return None, None
+            if kind not in (KEYFRAME, DELTA):
+                return text, None
+            head, _, body = body.partition(PREFIX)
+            scope, _, body = body.partition(PREFIX)
+            if scope not in (EVERYONE, me):
+                # Another node's stream: relayed only, never decoded here
+                return None, None
+            if kind == KEYFRAME:
+                sequence, message = head, body
+                keyframes = self._received.setdefault(sender, OrderedDict())
+                keyframes[sequence] = split_fields(message)
+                while len(keyframes) > KEEP_KEYFRAMES:
+                    keyframes.popitem(last=False)
+                self._requested.pop(sender, None)
+                if scope == me or direct:
+                    return message, ACK + sequence + PREFIX + sender
+                return message, None
+            base, changes = head, body
+            fields = self._received.get(sender, {}).get(base)
+            if fields is None:
+                self.metrics.incr("delta.undecodable")
+                requested = self._requested.setdefault(sender, set())
+                if base in requested:
+                    return None, None
+                requested.add(base)
+                return None, REQUEST + base + PREFIX + sender
+            fields = list(fields)
+            try:
+                for change in changes.split(",") if changes else ():
+                    index, _, value = change.partition("=")
+                    fields[int(index) * 2] = value
+            except (ValueError, IndexError):
+                self.metrics.incr("delta.undecodable")
+                return None, None
+            self.metrics.incr("delta.decoded")
+            return "".join(fields), None
+
+
+def addressed_to(text: str, me: str) -> bool:
+    """Whether ``text`` is codec traffic for ``me`` alone, which is not relayed."""
+    if not text.startswith((KEYFRAME, DELTA, ACK, REQUEST)):
+        return False
+    if text.startswith((ACK, REQUEST)):
+        return text[2:].partition(PREFIX)[2] == me
+    return text[2:].split(PREFIX, 2)[1:2] == [me]
@@ -0,0 +1,92 @@
+"""Choose between unicasting a message to each neighbor and broadcasting it.
+
+A unicast costs ``expected_transmissions`` per destination (retries and
+re-sent failures included), so N of them grow with the swarm and with loss.
+A broadcast costs ``BROADCAST_TRANSMISSIONS`` whatever N is, but nothing is
+acknowledged: a neighbor whose link delivers a single transmission with
+probability p misses all repeats with probability (1 - p) ** repeats.
+
+``FanoutPlanner.plan`` prices both for the current neighbors: the broadcast
+price includes a targeted unicast repair to every neighbor likely to miss
+it (when repairs are enabled), and the cheaper plan wins. Every decision is
+counted in ``xbee_metrics.METRICS`` under ``fanout.*`` with its reason, and
+the last plan is kept in ``last_plan``.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+from xbee_link_quality import BROADCAST_TRANSMISSIONS, LinkQualityEstimator
+from xbee_metrics import METRICS, Metrics
+
+UNICAST = "unicast"
+BROADCAST = "broadcast"
+
+# Neighbors whose chance of missing every broadcast repeat is above this get
+# the frame again by unicast.
+REPAIR_MISS_PROBABILITY = 0.05
+
+
+@dataclass
+class FanoutPlan:
+    strategy: str
+    reason: str
+    unicast_cost: float = 0.0
+    broadcast_cost: float = 0.0
+    repairs: List = field(default_factory=list)  # neighbors to unicast after a broadcast
+
+
+class FanoutPlanner:
+    def __init__(self, link_quality: LinkQualityEstimator,
+                 broadcast_transmissions: float = BROADCAST_TRANSMISSIONS,
+                 repairs: bool = True,
+                 repair_miss_probability: float = REPAIR_MISS_PROBABILITY,
+                 metrics: Metrics = METRICS) -> None:
+        self.link_quality = link_quality
+        self.broadcast_transmissions = broadcast_transmissions
+        self.repairs = repairs
+        self.repair_miss_probability = repair_miss_probability
+        self.metrics = metrics
+        self.last_plan: Optional[FanoutPlan] = None
+
+    def miss_probability(self, node: str) -> float:
+        """Chance that ``node`` hears none of a broadcast's repeats."""
+        # expected_transmissions = (1 + retries) / delivery, so its inverse
+        # is the success rate of one transmission on this link
+        single = min(1.0, 1.0 / self.link_quality.expected_transmissions(node))
+        return (1.0 - single) ** self.broadcast_transmissions
+
+    def plan(self, nodes: Iterable, key: Callable = str) -> FanoutPlan:
+        nodes = list(nodes)
+        if len(nodes) <= 1:
+            plan = FanoutPlan(UNICAST, "single_destination" if nodes else "no_destinations",
+                              sum(self.link_quality.expected_transmissions(key(n)) for n in nodes))
+            return self._record(plan)
+
+        unicast_cost = 0.0
+        broadcast_cost = float(self.broadcast_transmissions)
+        repairs = []
+        for node in nodes:
+            transmissions = self.link_quality.expected_transmissions(key(node))
+            unicast_cost += transmissions
+            if self.repairs and self.miss_probability(key(node)) > self.repair_miss_probability:
+                repairs.append(node)
+                broadcast_cost += transmissions
+
+        if unicast_cost <= broadcast_cost:
+            plan = FanoutPlan(UNICAST, "unicast_cheaper", unicast_cost, broadcast_cost)
+        elif repairs:
+            plan = FanoutPlan(BROADCAST, "broadcast_with_repairs", unicast_cost, broadcast_cost,
+                              repairs)
+        else:
+            plan = FanoutPlan(BROADCAST, "broadcast_cheaper", unicast_cost, broadcast_cost)
+        return self._record(plan)
+
+    def _record(self, plan: FanoutPlan) -> FanoutPlan:
+        self.last_plan = plan
+        self.metrics.incr("fanout." + plan.strategy)
+        self.metrics.incr("fanout.reason." + plan.reason)
+        self.metrics.incr("fanout.repairs", len(plan.repairs))
+        self.metrics.set_gauge("fanout.last_unicast_cost", round(plan.unicast_cost, 2))
+        self.metrics.set_gauge("fanout.last_broadcast_cost", round(plan.broadcast_cost, 2))
+        return plan
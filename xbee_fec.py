@@ -0,0 +1,126 @@
+"""Forward error correction for message parts with interleaved XOR parity.
+
+With K parity blocks for a message of N parts, block j is the XOR of every
+part i (1-based) with ``(i - 1) % K == j``. A receiver missing at most one
+part of a class rebuilds it from the other parts and the block, without a
+round trip; in particular any K consecutive lost parts come back. (Reed-
+Solomon would rebuild any K losses, but needs a GF(256) codec; XOR stays
+a few lines and covers the burst losses seen on air.) Each part is coded
+as its length byte followed by its UTF-8 bytes, zero-padded to the longest,
+so a rebuilt part has its exact length.
+
+A parity frame body (after ``FRAME_MARKER`` and ``FEC_PARITY``) is: group
+ID (0 for none), message ID, total parts, K, j, length of the first
+sender, the first sender and the block.
+
+``FecPolicy`` picks K for a send from the expected fragment loss on the
+links it uses.
+"""
+
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from xbee_sequence import MESSAGE_ID_LENGTH
+
+MAX_PARITY = 4
+MAX_PARTS = 255
+# Below this expected fragment loss no parity is sent.
+MIN_LOSS = 0.01
+
+
+class ParityFrame(NamedTuple):
+    group: int
+    message_id: str
+    total: int
+    k: int
+    index: int
+    first_sender: str
+    block: bytes
+
+
+def _code(part: str) -> bytes:
+    data = part.encode("utf8")
+    return bytes([len(data)]) + data
+
+
+def _xor(blocks: Iterable[bytes]) -> bytearray:
+    result = bytearray()
+    for block in blocks:
+        if len(block) > len(result):
+            result.extend(bytes(len(block) - len(result)))
+        for position, byte in enumerate(block):
+            result[position] ^= byte
+    return result
+
+
+def parity_blocks(parts: List[str], k: int) -> List[bytes]:
+    """The K parity blocks of ``parts`` (part 1 is ``parts[0]``)."""
+    return [bytes(_xor(_code(part) for part in parts[j::k])) for j in range(k)]
+
+
+def pack_parity(group: int, message_id: str, total: int, k: int, index: int,
+                first_sender: str, block: bytes) -> bytes:
+    sender = first_sender.encode("utf8")
+    return (bytes([group]) + message_id.encode("ascii") + bytes([total, k, index, len(sender)])
+            + sender + block)
+
+
+def parse_parity(body: bytes) -> Optional[ParityFrame]:
+    header = 1 + MESSAGE_ID_LENGTH + 4
+    if len(body) < header:
+        return None
+    group = body[0]
+    message_id = bytes(body[1:1 + MESSAGE_ID_LENGTH]).decode("ascii", "replace")
+    total, k, index, sender_length = body[1 + MESSAGE_ID_LENGTH:header]
+    if not k or index >= k or len(body) < header + sender_length:
+        return None
+    first_sender = bytes(body[header:header + sender_length]).decode("utf8", "replace")
+    return ParityFrame(group, message_id, total, k, index, first_sender,
+                       bytes(body[header + sender_length:]))
+
+
+def recover_parts(parts: Dict[int, str], total: int, frames: Iterable[ParityFrame]) -> int:
+    """Rebuild missing entries of ``parts`` in place; return how many came back."""
+    recovered = 0
+    for frame in frames:
+        covered = range(frame.index + 1, total + 1, frame.k)
+        missing = [number for number in covered if number not in parts]
+        if len(missing) != 1:
+            continue
+        coded = _xor([frame.block] + [_code(parts[number]) for number in covered
+                                      if number != missing[0]])
+        if not coded or coded[0] > len(coded) - 1:
+            continue
+        try:
+            parts[missing[0]] = bytes(coded[1:1 + coded[0]]).decode("utf8")
+        except UnicodeDecodeError:
+            continue
+        recovered += 1
+    return recovered
+
+
+class FecPolicy:
+    """How many parity blocks to add to a message.
+
+    Off unless ``enabled``. ``parity`` fixes K; otherwise K covers the
+    expected number of lost parts ``margin`` times over, at least one once
+    the loss reaches ``min_loss`` and at most ``max_parity``.
+    """
+
+    def __init__(self, enabled: bool = False, parity: Optional[int] = None,
+                 max_parity: int = MAX_PARITY, min_loss: float = MIN_LOSS,
+                 margin: float = 2.0) -> None:
+        self.enabled = enabled
+        self.parity = parity
+        self.max_parity = max_parity
+        self.min_loss = min_loss
+        self.margin = margin
+
+    def parity_count(self, parts: int, loss: float) -> int:
+        if not self.enabled or parts > MAX_PARTS:
+            return 0
+        if self.parity is not None:
+            return min(self.parity, parts)
+        if loss < self.min_loss:
+            return 0
+        return min(self.max_parity, parts, max(1, math.ceil(parts * loss * self.margin)))
@@ -2,16 +2,105 @@ import time
 import uuid
 import threading
 from digi.xbee.devices import DigiMeshDevice, NetworkEventReason
-from digi.xbee.models.status import NetworkDiscoveryStatus
+from digi.xbee.models.address import XBee16BitAddress, XBee64BitAddress
+from digi.xbee.models.options import TransmitOptions
+from digi.xbee.models.status import NetworkDiscoveryStatus, TransmitStatus
+from digi.xbee.packets.common import TransmitPacket, TransmitStatusPacket
 from serial.serialutil import SerialException
-import secrets
-import string
 import json
 import queue
+from functools import partial
+from xbee_baud import detect_baud, negotiate_baud
+from xbee_capture import BROADCAST, INBOUND, OUTBOUND, CaptureWriter
+from xbee_delta import DeltaCodec, addressed_to
+from xbee_fanout import UNICAST, FanoutPlanner
+from xbee_fec import FecPolicy, pack_parity, parity_blocks, parse_parity, recover_parts
+from xbee_link_quality import LinkQualityEstimator, LinkState
+from xbee_liveness import LivenessTracker, NodeState
+from xbee_metrics import METRICS
+from xbee_port_detect import adapter_key, find_adapter
+from xbee_pubsub import MessageBus
+from xbee_queues import DROP_NEWEST, DROP_OLDEST, BoundedQueue, QueueSpec
+from xbee_scheduler import FragmentScheduler
+from xbee_sequence import (MAX_SENDERS, MESSAGE_ID_LENGTH, SENDER_CHARS, DuplicateFilter,
+                           SequenceNumberer, sender_index_for, sender_prefix)
+
+# Binary frames (bulk transfers and other services) start with this byte
+# followed by a one-byte frame type; JSON message parts always start with "{".
+FRAME_MARKER = 0x02
+
+# Group multicast (see xbee_groups): a group message part is one broadcast of
+# FRAME_MARKER, GROUP_MESSAGE, a one-byte group ID and the usual JSON part.
+# GROUP_MEMBERSHIP carries the full list of a node's group IDs from the ground
+# station, and the node echoes it back as GROUP_MEMBERSHIP_ACK.
+GROUP_MESSAGE = b"M"
+GROUP_MEMBERSHIP = b"G"
+GROUP_MEMBERSHIP_ACK = b"g"
+
+# Sender index assignment (see xbee_senders): the ground station sends a node
+# SENDER_INDEX with a two-byte index for its message IDs, the node echoes it
+# back as SENDER_INDEX_ACK.
+SENDER_INDEX = b"I"
+SENDER_INDEX_ACK = b"i"
+
+# Forward error correction (see xbee_fec): XOR parity blocks sent after a
+# message's parts let receivers rebuild lost parts without a round trip.
+FEC_PARITY = b"P"
+
+# Frame types whose third byte is a group ID (0: not a group message)
+GROUP_TAGGED = (GROUP_MESSAGE[0], FEC_PARITY[0])
+
+# Characters of the message carried by each JSON part.
+PART_CHARS = 10
+
+# How long after a received frame the radio's DB (last hop RSSI) register
+# can still be attributed to that frame's sender.
+RSSI_SAMPLE_WINDOW = 2.0
+
+# How often node liveness is re-evaluated to raise state change events.
+LIVENESS_CHECK_INTERVAL = 0.5
+
+# How often the supervisor checks the serial link, and how long it waits
+# between attempts to reopen a lost one (the last delay repeats).
+LINK_CHECK_INTERVAL = 0.25
+RECONNECT_DELAYS = (0.2, 0.5, 1.0, 2.0)
+
+# Threads that decode, reassemble and forward received frames. Frames from
+# one sender always go to the same worker, so each sender's order is kept.
+RECEIVE_WORKERS = 4
+
+# Messages sent while the link is down are kept (oldest dropped first) and
+# sent once it is back.
+OUTBOX_LIMIT = 1000
+
+# Flow of the outbound scheduler used by send() and send_group() when no
+# traffic class is given; send_single() uses the destination's node ID.
+FLOOD_FLOW = "*"
+# Flow of messages relayed for other nodes, so relaying shares airtime
+# fairly with this node's own traffic.
+RELAY_FLOW = "relay"
+
+# Capacity and overflow policy of each queue between pipeline stages; override
+# per instance with Communicator(queues={"receive": QueueSpec(...)}). Received
+# frames past capacity are dropped (the reader must never wait), reassembled
+# and outbound messages keep the most recent ones. Overflows are counted in
+# xbee_metrics.METRICS under queue.<name>.dropped.
+DEFAULT_QUEUES = {
+    "receive": QueueSpec(2000, DROP_NEWEST),       # per receive worker
+    "reassembled": QueueSpec(1000, DROP_OLDEST),   # message_queue
+    "outbound": QueueSpec(OUTBOX_LIMIT, DROP_OLDEST),
+}
 
 class Communicator:
-    def __init__(self):
+    def __init__(self, sender_index=None, queues=None):
+        self.queue_specs = dict(DEFAULT_QUEUES, **(queues or {}))
         self.device = None
+        self.node_id = None  # NI of the attached radio, cached at attach time
+        self.sender_index = sender_index
+        self.explicit_sender_index = sender_index is not None
+        self.sequence = None
+        self.completed_messages = DuplicateFilter()
+        self.sender_clashes = set()  # nodes seen with our sender index
         self.received_message_ids = set()
         self.message_count = 0
         self.clear_list_after = 15
@@ -20,45 +109,243 @@ class Communicator:
         self.timer_flag = False
         self.discovery_thread = threading.Thread(target=self.run_device_discovery, daemon=True)
         self.timer_thread = threading.Thread(target=self.run_timer, daemon=True)
-        self.message_queue = queue.Queue()
+        self.liveness_thread = threading.Thread(target=self.run_liveness_check, daemon=True)
+        self.supervisor_thread = threading.Thread(target=self.run_supervisor, daemon=True)
+        self.link_up = threading.Event()
+        self.port = None
+        self.baud_rate = 57600
+        self.fast_baud = False
+        self.adapter_key = None
+        self.outbox = BoundedQueue.from_spec(self.queue_specs["outbound"], "outbound")
+        self.connect_lock = threading.RLock()
+        self.reconnect_callbacks = []  # called after the supervisor reopens the link
+        self.receive_queues = [BoundedQueue.from_spec(self.queue_specs["receive"], "receive")
+                               for _ in range(RECEIVE_WORKERS)]
+        # Receive workers forward concurrently; one frame at a time on the serial port
+        self.send_lock = threading.Lock()
+        for frames in self.receive_queues:
+            threading.Thread(target=self.run_receive_worker, args=(frames,), daemon=True).start()
+        self.message_queue = BoundedQueue.from_spec(self.queue_specs["reassembled"], "reassembled")
+        # Фрагменты исходящих сообщений чередуются по получателям (DRR),
+        # так что короткая команда не ждёт длинное сообщение другому узлу
+        self.scheduler = FragmentScheduler()
+        self.scheduler.start()
+        self.bus = MessageBus()
         self.status_discovery = 0
         self.message_parts = {}
+        self.reassembly_lock = threading.Lock()
+        self.link_quality = LinkQualityEstimator()
+        self.fanout = FanoutPlanner(self.link_quality)
+        self.liveness = LivenessTracker()
+        self.pending_tx = {}  # frame_id -> 64-bit address of the destination
+        self.pending_tx_lock = threading.Lock()
+        self.last_rx_node = None
+        self.last_rx_time = 0.0
+        self.frame_handlers = {}
+        self.capture = None
+        self.history = None  # MessageHistory for sent messages, see xbee_history
+        self.groups = set()  # IDs of the groups this node is a member of
+        self.receive_all_groups = False  # ground station: keep every group message
+        self.register_frame_handler(GROUP_MEMBERSHIP, self.handle_group_membership)
+        self.register_frame_handler(SENDER_INDEX, self.handle_sender_index)
+        self.fec = FecPolicy()  # off by default: fec.enabled = True to add parity
+        self.register_frame_handler(FEC_PARITY, self.handle_parity)
+        # Повторяющиеся move/BATT шлются разностью к подтверждённому ключевому кадру;
+        # принимаем всегда, кодируем только при delta.enabled = True
+        self.delta = DeltaCodec()
+
+    def register_frame_handler(self, frame_type, handler):
+        """Route binary frames of ``frame_type`` (one byte) to ``handler(data, source_device)``."""
+        self.frame_handlers[frame_type[0] if isinstance(frame_type, bytes) else frame_type] = handler
+
+    def start_capture(self, path):
+        """Append every raw inbound and outbound frame to the capture file ``path``."""
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+
+    def stop_capture(self):
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+
+    @staticmethod
+    def node_key(remote_device):
+        return str(remote_device.get_64bit_addr())
+
+    def _transmit(self, remote_device, data):
+        """Unicast one frame asynchronously and remember it for TX status."""
+        data = bytearray(data.encode("utf8") if isinstance(data, str) else data)
+        frame_id = self.device.get_next_frame_id()
+        packet = TransmitPacket(frame_id, remote_device.get_64bit_addr(),
+                                XBee16BitAddress.UNKNOWN_ADDRESS, 0,
+                                TransmitOptions.NONE.value, rf_data=data)
+        with self.pending_tx_lock:
+            self.pending_tx[frame_id] = self.node_key(remote_device)
+        capture = self.capture
+        if capture is not None:
+            capture.record_device(OUTBOUND, remote_device, data)
+        with self.send_lock:
+            self.device.send_packet(packet)
+
+    def _broadcast(self, data):
+        """Broadcast one frame asynchronously; broadcasts are never acknowledged."""
+        data = bytearray(data.encode("utf8") if isinstance(data, str) else data)
+        packet = TransmitPacket(0, XBee64BitAddress.BROADCAST_ADDRESS,
+                                XBee16BitAddress.UNKNOWN_ADDRESS, 0,
+                                TransmitOptions.NONE.value, rf_data=data)
+        capture = self.capture
+        if capture is not None:
+            capture.record(BROADCAST, XBee64BitAddress.BROADCAST_ADDRESS, None, data)
+        with self.send_lock:
+            self.device.send_packet(packet)
+
+    def tx_status_callback(self, packet):
+        """Feed transmit status frames into the link quality estimator."""
+        if not isinstance(packet, TransmitStatusPacket):
+            return
+        with self.pending_tx_lock:
+            node = self.pending_tx.pop(packet.frame_id, None)
+        if node is None:
+            return
+        self.link_quality.record_tx_status(
+            node,
+            packet.transmit_status == TransmitStatus.SUCCESS,
+            packet.transmit_retry_count,
+        )
+
+    def sample_link_rssi(self):
+        """Attribute the radio's last-hop RSSI to the node we last heard from.
+
+        Must not run on the packet reader thread: reading DB is a synchronous
+        AT command whose response is delivered by that same thread.
+        """
+        node = self.last_rx_node
+        if node is None or time.monotonic() - self.last_rx_time > RSSI_SAMPLE_WINDOW:
+            return
+        try:
+            value = self.device.get_parameter("DB")
+        except Exception:
+            return
+        if value:
+            self.link_quality.record_rssi(node, -int(value[-1]))
+
+    def select_destinations(self, remote_devices, exclude=None):
+        """Pick the neighbors worth unicasting to.
+
+        Dead neighbors are never used. Neighbors in a BAD link state are
+        skipped, since the nodes with good links forward everything they
+        receive. If every link is BAD, only the best relay is used.
+        """
+        candidates = [dev for dev in remote_devices if self.node_key(dev) != exclude]
+        candidates = self.liveness.live(candidates, key=self.node_key)
+        usable = self.link_quality.usable(candidates, key=self.node_key)
+        if usable or not candidates:
+            return usable
+        return [self.link_quality.best_relay(candidates, key=self.node_key)]
     
     def generate_message_id(self):
-        characters = string.ascii_letters + string.digits
-        return ''.join(secrets.choice(characters) for _ in range(5))
+        if self.sequence is None:
+            if self.sender_index is None:
+                self.sender_index = sender_index_for(self.device.get_64bit_addr())
+            self.sequence = SequenceNumberer(self.sender_index)
+        return self.sequence.next_id()
+
+    def set_sender_index(self, sender_index):
+        """Number this node's messages with ``sender_index`` from now on."""
+        self.sender_index = sender_index % MAX_SENDERS
+        self.explicit_sender_index = True
+        self.sequence = SequenceNumberer(self.sender_index)
+        self.sender_clashes.clear()
+
+    def own_sender_index(self):
+        if self.sender_index is None:
+            return sender_index_for(self.device.get_64bit_addr())
+        return self.sender_index % MAX_SENDERS
+
+    def report_sender_clash(self, node_id):
+        """Warn once per node that shares this node's sender index."""
+        if node_id in self.sender_clashes:
+            return
+        self.sender_clashes.add(node_id)
+        METRICS.incr("sequence.sender_clash")
+        print("Warning: %s uses the same sender index as this node; its messages may be "
+              "dropped as duplicates. Let the ground station assign sender indexes "
+              "(xbee_senders) or give each node its own Communicator(sender_index=...)"
+              % node_id)
+
+    def forward_message(self, full_message, source_device, base_message_id, first_sender=None):
+        # first_sender - узел-источник; сохраняем его, чтобы получатели
+        # (и кодек разностей) видели автора, а не ретранслятор
+        call = ("forward", base_message_id, first_sender, source_device, full_message)
+        # Без радиомодуля (воспроизведение захвата) пересылать нечем
+        if self.device is None:
+            return
+        if not self.link_up.is_set():
+            self.queue_outbound(call)
+            return
 
-    def forward_message(self, full_message, source_device, base_message_id):
         try:
-            chunk_size = 10
-            num_parts = (len(full_message) + chunk_size - 1) // chunk_size
-            
-            remote_devices = self.current_discovered_devices
-
-            for i in range(num_parts):
-                start_index = i * chunk_size
-                end_index = min((i + 1) * chunk_size, len(full_message))
-                message_part = full_message[start_index:end_index]
-
-                message_id = f"{base_message_id}{i + 1}"
-
-                data = {
-                    "id": message_id,
-                    "first": self.device.get_node_id(),
-                    "msg": message_part,
-                    "l": 1 if i + 1 == num_parts else 0
-                }
-                message_send = json.dumps(data)
+            remote_devices = self.select_destinations(
+                self.current_discovered_devices, exclude=self.node_key(source_device))
+            if not remote_devices:
+                return
 
-                for remote_device in remote_devices:
-                    if remote_device.get_64bit_addr() != source_device.get_64bit_addr():
-                        print(f"Forwarding part {i + 1}/{num_parts}: {message_send}")
-                        self.device.send_data_async(remote_device, message_send)
+            frames = self.build_frames(full_message, base_message_id, first_sender)
+            frames += self.parity_frames(full_message, base_message_id,
+                                         self.link_loss(remote_devices, False),
+                                         first_sender=first_sender)
+            # Пересылка идет через планировщик своим потоком, наравне с нашими сообщениями
+            fragments = []
+            for i, message_send in enumerate(frames):
+                print(f"Forwarding part {i + 1}/{len(frames)}: {message_send}")
+                fragments.extend((partial(self._transmit, remote_device, message_send),
+                                  len(message_send)) for remote_device in remote_devices)
+            self.schedule(RELAY_FLOW, fragments, call)
 
         except Exception as e:
             print("Forwarding error:", str(e))
+            self.send_failed(call, e)
 
     def message_callback(self, message):
+        # Вызывается потоком чтения digi: только ставим кадр в очередь,
+        # чтобы чтение с радиомодуля не ждало разбора и пересылки
+        data = message.data
+        source_device = message.remote_device
+        received_at = time.monotonic()
+        # Захват - по времени прихода и до фильтров, чтобы воспроизведение было точным
+        capture = self.capture
+        if capture is not None:
+            timestamp_ns = int(received_at * 1e9)
+            if source_device is None:
+                capture.record(INBOUND, None, None, data, timestamp_ns)
+            else:
+                capture.record_device(INBOUND, source_device, data, timestamp_ns)
+        # Чужие групповые сообщения отбрасываем здесь, до очереди и сборки
+        if (len(data) > 2 and data[0] == FRAME_MARKER and data[1] in GROUP_TAGGED and data[2]
+                and not self.receive_all_groups and data[2] not in self.groups):
+            METRICS.incr("groups.filtered")
+            return
+        key = None if source_device is None else self.node_key(source_device)
+        shard = hash(key) % len(self.receive_queues)
+        if not self.receive_queues[shard].put((message, key, received_at)):
+            print("Receive queue full, frame dropped")
+
+    def run_receive_worker(self, frames):
+        while True:
+            message, key, received_at = frames.get()
+            try:
+                self.process_frame(message, key, received_at)
+            except Exception as e:
+                print("Receive error:", str(e))
+            finally:
+                frames.task_done()
+
+    def wait_receive_idle(self):
+        """Block until every frame given to message_callback so far is processed."""
+        for frames in self.receive_queues:
+            frames.join()
+
+    def process_frame(self, message, key, received_at):
         if message.remote_device is None:
             print("Received message without remote device information:", message.data.decode())
             return
@@ -67,7 +354,28 @@ class Communicator:
         if not message.data:
             return
 
-        message_data = message.data.decode()
+        self.last_rx_node = key
+        self.last_rx_time = received_at
+        # Любой принятый кадр - признак того, что узел жив
+        self.liveness.heartbeat(key, received_at)
+
+        group = None
+        data = message.data
+        if data[0] == FRAME_MARKER and len(data) > 2 and data[1] == GROUP_MESSAGE[0]:
+            # Групповое сообщение: дальше обычная JSON-часть
+            group, data = data[2], data[3:]
+        elif data[0] == FRAME_MARKER and len(data) > 1:
+            handler = self.frame_handlers.get(message.data[1])
+            if handler is None:
+                print("No handler for frame type:", message.data[1])
+                return
+            try:
+                handler(message.data, source_device)
+            except Exception as e:
+                print("Frame handler error:", str(e))
+            return
+
+        message_data = data.decode()
         try:
             # Пытаемся декодировать сообщение как JSON
             data = json.loads(message_data)
@@ -77,63 +385,131 @@ class Communicator:
             received_message_part = data.get("msg")
             is_last_part = data.get("l", 0)
 
-            if message_id:
-                base_id_length = 5
-                base_message_id = message_id[:base_id_length]
-                part_number = int(message_id[base_id_length:])
-
-                # Если впервые видим этот ID, создаем запись для него
-                if base_message_id not in self.message_parts:
-                    self.message_parts[base_message_id] = {"parts": {}, "total_parts": 0, "first_sender": sender_name}
-                else:
-                    # Обновляем first_sender, если он еще не был установлен
-                    if "first_sender" not in self.message_parts[base_message_id]:
-                        self.message_parts[base_message_id]["first_sender"] = sender_name
-                        
-
-                # Сохраняем текущую часть сообщения
-                self.message_parts[base_message_id]["parts"][part_number] = received_message_part
-
-                # Если это последняя часть, сохраняем количество частей
-                if is_last_part:
-                    self.message_parts[base_message_id]["total_parts"] = part_number
+            if not message_id:
+                return
 
-                # Проверяем, получены ли все части сообщения
-                total_parts = self.message_parts[base_message_id]["total_parts"]
-                if total_parts and len(self.message_parts[base_message_id]["parts"]) == total_parts:
-                    # Собираем сообщение из всех частей
-                    full_message = ''.join(
-                        self.message_parts[base_message_id]["parts"][i] for i in range(1, total_parts + 1)
-                    )
+            base_message_id = message_id[:MESSAGE_ID_LENGTH]
+            part_number = int(message_id[MESSAGE_ID_LENGTH:])
 
-                    # Формируем окончательный JSON-объект для полного сообщения
-                    full_message_json = {
-                        "first": self.message_parts[base_message_id]["first_sender"],
-                        "from": source_device.get_node_id(),
-                        "msg": full_message
-                    }
+            # Чужое сообщение с нашим индексом отправителя: его ID совпадут с нашими
+            if (self.device is not None and sender_name not in (None, self.node_id)
+                    and base_message_id[:SENDER_CHARS] == sender_prefix(self.own_sender_index())):
+                self.report_sender_clash(sender_name)
 
-                    # Удаляем ID из записи для предотвращения дубликатов
-                    del self.message_parts[base_message_id]
+            # Уже собранное сообщение (например, вернувшееся через соседа) пропускаем
+            if self.completed_messages.seen(base_message_id):
+                return
 
-                    self.message_queue.put(json.dumps(full_message_json))
+            with self.reassembly_lock:
+                full_message = self._store_part(base_message_id, part_number,
+                                                received_message_part, sender_name,
+                                                is_last_part, source_device, group)
 
-                    # Пробрасываем сообщение дальше
-                    self.forward_message(full_message, source_device, base_message_id)
+            # Групповой broadcast ретранслируют сами радиомодули DigiMesh
+            if full_message is not None and group is None:
+                # Пробрасываем сообщение дальше
+                self.forward_message(full_message, source_device, base_message_id, sender_name)
 
         except json.JSONDecodeError:
             print("Error decoding JSON message:", message_data)
 
+    def _store_part(self, base_message_id, part_number, received_message_part,
+                    sender_name, is_last_part, source_device, group=None):
+        """Store one part; once every part is in, return the full message to relay."""
+        # Если впервые видим этот ID, создаем запись для него
+        if base_message_id not in self.message_parts:
+            self.message_parts[base_message_id] = {"parts": {}, "total_parts": 0, "first_sender": sender_name}
+        else:
+            # Обновляем first_sender, если он еще не был установлен
+            if "first_sender" not in self.message_parts[base_message_id]:
+                self.message_parts[base_message_id]["first_sender"] = sender_name
+
+        # Сохраняем текущую часть сообщения
+        self.message_parts[base_message_id]["parts"][part_number] = received_message_part
+
+        # Если это последняя часть, сохраняем количество частей
+        if is_last_part:
+            self.message_parts[base_message_id]["total_parts"] = part_number
+
+        return self._complete_message(base_message_id, source_device, group)
+
+    def _store_parity(self, frame, source_device):
+        """Store one FEC parity block; return the full message if it completes it."""
+        if frame.message_id not in self.message_parts:
+            self.message_parts[frame.message_id] = {"parts": {}, "total_parts": 0,
+                                                    "first_sender": frame.first_sender}
+        entry = self.message_parts[frame.message_id]
+        entry.setdefault("parity", {})[frame.index] = frame
+        entry["total_parts"] = frame.total
+        return self._complete_message(frame.message_id, source_device, frame.group or None)
+
+    def _complete_message(self, base_message_id, source_device, group):
+        # Недостающие части восстанавливаем по блокам чётности, если они есть
+        total_parts = self.message_parts[base_message_id]["total_parts"]
+        parity = self.message_parts[base_message_id].get("parity")
+        parts = self.message_parts[base_message_id]["parts"]
+        if parity and total_parts and len(parts) < total_parts:
+            recovered = recover_parts(parts, total_parts, parity.values())
+            if recovered:
+                METRICS.incr("fec.recovered", recovered)
+
+        # Проверяем, получены ли все части сообщения
+        if not total_parts or len(self.message_parts[base_message_id]["parts"]) != total_parts:
+            return None
+
+        # Собираем сообщение из всех частей
+        full_message = ''.join(
+            self.message_parts[base_message_id]["parts"][i] for i in range(1, total_parts + 1)
+        )
+
+        first_sender = self.message_parts[base_message_id]["first_sender"]
+
+        # Удаляем ID из записи для предотвращения дубликатов
+        del self.message_parts[base_message_id]
+        self.completed_messages.mark(base_message_id)
+
+        # Ключевой кадр/разность раскрываем; служебные ответы кодеку не публикуем.
+        # Дальше пересылается исходный текст: каждый узел раскрывает его сам.
+        # Поток другому узлу только пересылаем, адресованное нам - не пересылаем
+        # Без радиомодуля (воспроизведение захвата) отвечать некому и нечем
+        direct = source_device.get_node_id() == first_sender
+        message, reply = self.delta.decode(first_sender, full_message, self.node_id, direct)
+        if (reply is not None and self.device is not None
+                and first_sender not in (None, self.node_id)):
+            self.send_control(first_sender, reply)
+        relay = None if addressed_to(full_message, self.node_id) else full_message
+        if message is None:
+            return relay
+
+        # Формируем окончательный JSON-объект для полного сообщения
+        full_message_json = {
+            "first": first_sender,
+            "from": source_device.get_node_id(),
+            "msg": message
+        }
+        if group is not None:
+            full_message_json["group"] = group
+
+        METRICS.incr("messages.reassembled")
+        self.message_queue.put(json.dumps(full_message_json))
+        self.bus.publish(message, full_message_json)
+        return relay
+
     def callback_discover(self):
         xbee_network = self.device.get_network()
         xbee_network.set_discovery_timeout(5) # було 3.2
         try:
             def callback_device_discovered(remote):
-                pass
+                self.liveness.heartbeat(self.node_key(remote))
+                # Индекс по умолчанию - младшие биты адреса; совпадение = общие ID сообщений
+                if (not self.explicit_sender_index
+                        and sender_index_for(remote.get_64bit_addr()) == self.own_sender_index()):
+                    self.report_sender_clash(remote.get_node_id())
 
             def callback_discovery_finished(status):
                 if status == NetworkDiscoveryStatus.SUCCESS:
-                    self.current_discovered_devices = self.device.get_network().get_devices()
+                    # Сеть именно этого устройства: после переподключения self.device уже другое
+                    self.current_discovered_devices = xbee_network.get_devices()
                     self.devices_to_send = {key: value for key, value in self.devices_to_send.items() if value["device"] in self.current_discovered_devices}
                     self.status_discovery = 1
                 else:
@@ -146,137 +522,445 @@ class Communicator:
             print("Connection error:", str(e))
 
     def run_device_discovery(self):
-        while self.device and self.device.is_open():
-            xbee_network = self.device.get_network()
-            if self.timer_flag:
-                xbee_network.clear()
-                self.timer_flag = False
-            xbee_network.start_discovery_process()
-            while xbee_network.is_discovery_running():
-                time.sleep(0.1)
+        # Потоки живут дольше одного подключения: при потере связи ждут,
+        # пока супервизор ее восстановит
+        while True:
+            self.link_up.wait()
+            try:
+                xbee_network = self.device.get_network()
+                if self.timer_flag:
+                    xbee_network.clear()
+                    self.timer_flag = False
+                xbee_network.start_discovery_process()
+                while xbee_network.is_discovery_running() and self.link_up.is_set():
+                    time.sleep(0.1)
+                self.sample_link_rssi()
+                self.flush_outbox()
+            except Exception as e:
+                if self.device_alive():
+                    print("Discovery error:", str(e))
+                time.sleep(LINK_CHECK_INTERVAL)
 
     def run_timer(self):
-        while self.device and self.device.is_open():
+        while True:
+            self.link_up.wait()
             time.sleep(32)
             self.timer_flag = True
 
+    def run_liveness_check(self):
+        while True:
+            self.link_up.wait()
+            time.sleep(LIVENESS_CHECK_INTERVAL)
+            self.liveness.check()
+
     def start_device_discovery(self):
-        self.discovery_thread.start()
+        if self.discovery_thread.ident is None:
+            self.discovery_thread.start()
 
     def start_timer(self):
-        self.timer_thread.start()
+        if self.timer_thread.ident is None:
+            self.timer_thread.start()
+
+    def connect(self, device_name, baud_rate=None, fast_baud=False):
+        # baud_rate None: скорость определяется автоматически (сначала запомненная);
+        # fast_baud: поднять скорость порта до максимальной, что работает надежно
+        with self.connect_lock:
+            if self.device is not None and self.link_up.is_set():
+                print("Device already connected")
+                return
 
-    def connect(self, device_name):
-        if self.device is not None:
-            print("Device already connected")
-            return
-        
-        port = device_name
-        self.device = DigiMeshDevice(port, 57600)
+            if self.device is not None:
+                # Связь была потеряна: подключаемся заново, возможно к другому порту
+                self.close_device()
+            port = device_name
+            self.port = port
+            self.fast_baud = fast_baud
+            self.baud_rate = self.pick_baud(port, baud_rate)
+            self.adapter_key = adapter_key(port)
+            self.attach_device(DigiMeshDevice(port, self.baud_rate))
+            if self.supervisor_thread.ident is None:
+                self.supervisor_thread.start()
+
+    def pick_baud(self, port, baud_rate=None, preferred=None):
+        if baud_rate is None:
+            # Если модуль не отвечает, пусть ошибку покажет открытие порта
+            baud_rate = detect_baud(port, preferred) or preferred or 57600
+        if self.fast_baud:
+            baud_rate = negotiate_baud(port, baud_rate) or baud_rate
+        return baud_rate
+
+    def attach_device(self, device):
+        """Open ``device`` (a DigiMeshDevice or a compatible simulation) and start
+        receiving, discovery and the background timers on it.
+
+        Returns whether the device opened. The background threads are
+        started once and carry over to devices attached after a reconnect.
+        """
+        self.device = device
 
         try:
             self.device.open()
             self.device.add_data_received_callback(self.message_callback)
+            self.device.add_packet_received_callback(self.tx_status_callback)
+            self.node_id = self.device.get_node_id()
         except Exception as e:
             print("Connection error:", str(e))
+            # Не держим порт открытым после неудачной попытки
+            try:
+                device.close()
+            except Exception:
+                pass
+            return False
+        finally:
+            self.start_device_discovery()
+            self.start_timer()
+            if self.liveness_thread.ident is None:
+                self.liveness_thread.start()
 
         self.callback_discover()
-        self.start_device_discovery()
-        self.start_timer()
-
-    def send(self, message):
-        if self.device is None:
-            print("No device connected")
-            return
+        self.link_up.set()
+        if self.current_discovered_devices:
+            # Соседи известны с прошлого подключения - отправляем сразу,
+            # иначе очередь отправит поток обнаружения после первого прохода
+            threading.Thread(target=self.flush_outbox, daemon=True).start()
+        return True
+
+    def device_alive(self):
+        device = self.device
+        if device is None or not device.is_open():
+            return False
+        # При ошибке чтения (модуль отключен) listener digi закрывает порт,
+        # но is_open() остается True
+        comm_iface = getattr(device, "comm_iface", None)
+        return comm_iface is None or comm_iface.is_interface_open
+
+    def close_device(self):
+        self.link_up.clear()
+        try:
+            self.device.close()
+        except Exception:
+            pass
 
+    def connection_lost(self):
+        with self.connect_lock:
+            if not self.link_up.is_set():
+                return
+            print("Connection lost on", self.port)
+            self.close_device()
+
+    def reconnect(self):
+        """Reopen the lost port, or the same USB adapter under a new device path."""
+        ports = [self.port]
+        if self.adapter_key is not None:
+            moved = find_adapter(self.adapter_key)
+            if moved is not None and moved != self.port:
+                ports.insert(0, moved)
+        for port in ports:
+            with self.connect_lock:
+                if self.link_up.is_set():
+                    return True  # connect() got there first
+                # После отключения питания модуль вернется к своей скорости BD
+                baud_rate = self.pick_baud(port, preferred=self.baud_rate)
+                if self.attach_device(DigiMeshDevice(port, baud_rate)):
+                    self.port = port
+                    self.baud_rate = baud_rate
+                    print("Reconnected on", port)
+                    for callback in self.reconnect_callbacks:
+                        callback()
+                    return True
+        return False
+
+    def run_supervisor(self):
+        """Watch the serial link and reopen it with back-off when it drops."""
+        attempt = 0
+        while True:
+            time.sleep(LINK_CHECK_INTERVAL)
+            if self.link_up.is_set():
+                if not self.device_alive():
+                    self.connection_lost()
+                attempt = 0
+                continue
+            if self.port is None or self.reconnect():
+                continue
+            time.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+
+    def queue_outbound(self, call):
+        if self.outbox.full() and self.outbox.policy == DROP_OLDEST:
+            print("Outbox full, dropping the oldest queued message")
+        try:
+            queued = self.outbox.put(call, timeout=0)  # never block the sender
+        except queue.Full:
+            queued = False
+        if queued:
+            print("Link down, message queued:", call[-1])
+        else:
+            print("Outbox full, message dropped:", call[-1])
+
+    def flush_outbox(self):
+        """Send what was queued while the link was down, oldest first."""
+        while self.link_up.is_set():
+            try:
+                call = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            self.outbox.task_done()
+            if call[0] == "send":
+                self.send(call[1])
+            elif call[0] == "send_group":
+                self.send_group(call[1], call[2], call[3])
+            elif call[0] == "forward":
+                self.forward_message(call[4], call[3], call[1], call[2])
+            else:
+                self.send_single(call[1], call[2])
+
+    def prepare_message_id(self):
         self.message_count += 1
         if self.message_count >= self.clear_list_after:
             self.received_message_ids.clear()
             self.message_count = 0
 
-        try:
-            remote_devices = self.current_discovered_devices
-            base_message_id = self.generate_message_id()  # Базовый ID сообщения
-            self.received_message_ids.add(base_message_id)
+        base_message_id = self.generate_message_id()  # Базовый ID сообщения
+        self.received_message_ids.add(base_message_id)
+        return base_message_id
+
+    def build_frames(self, message, base_message_id, first_sender=None):
+        """Split a message into JSON frames of 10 characters each."""
+        if first_sender is None:
+            first_sender = self.device.get_node_id()
+
+        # Разделение сообщения на части по 10 символов
+        message_parts = [message[i:i+PART_CHARS] for i in range(0, len(message), PART_CHARS)]
+        total_parts = len(message_parts)
+
+        frames = []
+        for part_num, message_part in enumerate(message_parts, start=1):
+            # Подготовка данных для отправки
+            data = {
+                "id": f"{base_message_id}{part_num}",  # Уникальный ID для каждой части
+                "first": first_sender,
+                "msg": message_part,
+                "l": 1 if part_num == total_parts else 0  # Метка последней части
+            }
+            frames.append(json.dumps(data))
+        return frames
+
+    def find_remote_device(self, remote_address):
+        for dev in self.current_discovered_devices:
+            if dev.get_node_id() == remote_address:
+                return dev
+        return None
+
+    def send(self, message, traffic_class=None):
+        if self.device is None:
+            print("No device connected")
+            return
 
-            # Разделение сообщения на части по 10 символа
-            message_parts = [message[i:i+10] for i in range(0, len(message), 10)]
-            total_parts = len(message_parts)
+        if not self.link_up.is_set():
+            self.queue_outbound(("send", message))
+            return
+
+        try:
+            remote_devices = self.select_destinations(self.current_discovered_devices)
+            plan = self.fanout.plan(remote_devices, key=self.node_key)
+            base_message_id = self.prepare_message_id()
+            if self.history is not None:
+                self.history.record_sent(None, message)
+            encoded = self.delta.encode(FLOOD_FLOW, message,
+                                        [dev.get_node_id() for dev in remote_devices])
 
             # Отправка каждой части сообщения
-            for part_num, message_part in enumerate(message_parts, start=1):
-                # Формируем уникальный ID для каждой части сообщения
-                message_id = f"{base_message_id}{part_num}"
+            fragments = []
+            for message_send in self.build_frames(encoded, base_message_id):
+                size = len(message_send)
+                # Один broadcast дешевле, чем unicast каждому соседу;
+                # соседям со слабой связью часть досылается unicast
+                if plan.strategy != UNICAST:
+                    fragments.append((partial(self._broadcast, message_send), size))
+                    for remote_device in plan.repairs:
+                        fragments.append((partial(self._transmit, remote_device, message_send), size))
+                    continue
 
-                # Подготовка данных для отправки
-                data = {
-                    "id": message_id,  # Уникальный ID для каждой части
-                    "first": self.device.get_node_id(),
-                    "msg": message_part,
-                    "l": 1 if part_num == total_parts else 0  # Метка последней части
-                }
+                # Отправляем сообщение на все удаленные устройства
+                for remote_device in remote_devices:
+                    fragments.append((partial(self._transmit, remote_device, message_send), size))
 
-                message_send = json.dumps(data)
+            # Блоки чётности идут тем же путём, что и части
+            loss = self.link_loss(remote_devices, plan.strategy != UNICAST)
+            for parity in self.parity_frames(encoded, base_message_id, loss):
+                if plan.strategy != UNICAST:
+                    fragments.append((partial(self._broadcast, parity), len(parity)))
+                else:
+                    fragments.extend((partial(self._transmit, remote_device, parity), len(parity))
+                                     for remote_device in remote_devices)
 
-                # Отправляем сообщение на все удаленные устройства
-                for i, remote_device in enumerate(remote_devices):
-                    self.device.send_data_async(remote_device, message_send)
+            self.schedule(traffic_class or FLOOD_FLOW, fragments, ("send", message))
 
         except Exception as e:
-            print("Send error:", str(e))
+            self.send_failed(("send", message), e)
 
-    def send_single(self, remote_address, message):
+    def send_single(self, remote_address, message, traffic_class=None):
         if self.device is None:
             print("No device connected")
             return
 
-        self.message_count += 1
-        if self.message_count >= self.clear_list_after:
-            self.received_message_ids.clear()
-            self.message_count = 0
+        if not self.link_up.is_set():
+            self.queue_outbound(("send_single", remote_address, message))
+            return
 
         try:
-            remote_devices = self.current_discovered_devices
-            message_id = self.generate_message_id()  # Генерируем ID для сообщения
-            self.received_message_ids.add(message_id)
-            
-            # Разделение сообщения на части по 10 символов
-            message_parts = [message[i:i+10] for i in range(0, len(message), 10)]
-            total_parts = len(message_parts)
+            message_id = self.prepare_message_id()
 
             # Поиск целевого устройства
-            remote_device = None
-            for dev in remote_devices:
-                if dev.get_node_id() == remote_address:
-                    remote_device = dev
-                    break
-
+            remote_device = self.find_remote_device(remote_address)
             if remote_device is None:
                 print("Device not found with address: %s" % remote_address)
                 return
 
+            if self.liveness.state(self.node_key(remote_device)) == NodeState.DEAD:
+                print("Device %s is not responding, message not sent" % remote_address)
+                return
+
+            if self.link_quality.state(self.node_key(remote_device)) == LinkState.BAD:
+                print("Warning: link to %s is in a bad state" % remote_address)
+
+            if self.history is not None:
+                self.history.record_sent(remote_address, message)
+            encoded = self.delta.encode(remote_address, message, [remote_address])
+
             # Отправка каждой части сообщения
-            for part_num, message_part in enumerate(message_parts, start=1):
-                # Формируем уникальный ID для каждой части сообщения
-                part_id = f"{message_id}{part_num}"
-
-                # Подготовка данных для отправки
-                data = {
-                    "id": part_id,  # Уникальный ID для каждой части
-                    "first": self.device.get_node_id(),
-                    "msg": message_part,
-                    "l": 1 if part_num == total_parts else 0  # Метка последней части
-                }
-
-                message_send = json.dumps(data)
+            fragments = []
+            for part_num, message_send in enumerate(self.build_frames(encoded, message_id), start=1):
                 print(message_send)
 
                 # Отправляем сообщение на целевое устройство
-                self.device.send_data_async(remote_device, message_send)
-                print(f"Part {part_num} sent to:", remote_device.get_node_id())
+                fragments.append((partial(self._transmit_part, remote_device, message_send,
+                                          part_num), len(message_send)))
+
+            loss = self.link_loss([remote_device], False)
+            for parity in self.parity_frames(encoded, message_id, loss):
+                fragments.append((partial(self._transmit, remote_device, parity), len(parity)))
+
+            self.schedule(traffic_class or remote_address, fragments,
+                          ("send_single", remote_address, message))
+
+        except Exception as e:
+            self.send_failed(("send_single", remote_address, message), e)
+
+    def send_control(self, node_id, message):
+        """Send a delta codec answer to ``node_id``: unicast to a neighbour, else flooded.
+
+        No history, delta coding or parity; relays forward it like any message.
+        """
+        try:
+            base_message_id = self.prepare_message_id()
+            remote_device = self.find_remote_device(node_id)
+            frames = self.build_frames(message, base_message_id)
+            if remote_device is not None:
+                fragments = [(partial(self._transmit, remote_device, frame), len(frame))
+                             for frame in frames]
+            else:
+                fragments = [(partial(self._broadcast, frame), len(frame)) for frame in frames]
+            # Потерянный ответ не страшен: кодек переспросит, поэтому без outbox
+            self.scheduler.submit(node_id if remote_device is not None else FLOOD_FLOW,
+                                  fragments, lambda error: print("Delta control error:", str(error)))
+        except Exception as e:
+            print("Delta control error:", str(e))
+
+    def _transmit_part(self, remote_device, message_send, part_num):
+        self._transmit(remote_device, message_send)
+        print(f"Part {part_num} sent to:", remote_device.get_node_id())
+
+    def schedule(self, flow, fragments, call):
+        """Hand a message's fragments to the scheduler; on a failure ``call`` is re-queued."""
+        if not self.scheduler.submit(flow, fragments, partial(self.send_failed, call)):
+            print("Outbound scheduler full, message dropped:", call[-1])
+
+    def send_failed(self, call, error):
+        print("Send error:", str(error))
+        if not self.device_alive():
+            self.connection_lost()
+            self.queue_outbound(call)
+
+    def send_group(self, group_id, message, group_name=None):
+        """Send a message to the members of one group as a single broadcast per part.
+
+        Nodes that are not members drop the parts in message_callback; the
+        radios' own mesh broadcast carries them to nodes out of direct range.
+        """
+        if self.device is None:
+            print("No device connected")
+            return
+
+        if not self.link_up.is_set():
+            self.queue_outbound(("send_group", group_id, message, group_name))
+            return
+
+        try:
+            base_message_id = self.prepare_message_id()
+            if self.history is not None:
+                self.history.record_sent(group_name or "group %d" % group_id, message)
+
+            fragments = [(partial(self._broadcast, frame), len(frame))
+                         for frame in self.group_frames(group_id, message, base_message_id)]
+            self.schedule(FLOOD_FLOW, fragments, ("send_group", group_id, message, group_name))
+            METRICS.incr("groups.sent")
 
         except Exception as e:
-            print("Send error:", str(e))
+            self.send_failed(("send_group", group_id, message, group_name), e)
+
+    def group_frames(self, group_id, message, base_message_id):
+        """The parts of a group message, tagged with the group ID, then its parity frames."""
+        header = bytes([FRAME_MARKER]) + GROUP_MESSAGE + bytes([group_id])
+        frames = [header + message_send.encode("utf8")
+                  for message_send in self.build_frames(message, base_message_id)]
+        loss = self.link_loss(self.current_discovered_devices, True)
+        return frames + self.parity_frames(message, base_message_id, loss, group_id)
+
+    def link_loss(self, remote_devices, broadcast):
+        """Expected fraction of fragments lost on the links to ``remote_devices``."""
+        keys = [self.node_key(dev) for dev in remote_devices]
+        if broadcast:
+            # Broadcast: no ACK and no retries, only the radio's repeats
+            return max((self.fanout.miss_probability(key) for key in keys), default=0.0)
+        return max((1.0 - self.link_quality.delivery_ratio(key) for key in keys), default=0.0)
+
+    def parity_frames(self, message, base_message_id, loss, group=0, first_sender=None):
+        """FEC parity frames for a message, as many as self.fec wants for ``loss``."""
+        parts = [message[i:i+PART_CHARS] for i in range(0, len(message), PART_CHARS)]
+        k = self.fec.parity_count(len(parts), loss)
+        if not k:
+            return []
+        METRICS.incr("fec.parity_sent", k)
+        if first_sender is None:
+            first_sender = self.device.get_node_id()
+        return [bytes([FRAME_MARKER]) + FEC_PARITY
+                + pack_parity(group, base_message_id, len(parts), k, index, first_sender, block)
+                for index, block in enumerate(parity_blocks(parts, k))]
+
+    def handle_parity(self, data, source_device):
+        frame = parse_parity(data[2:])
+        if frame is None or self.completed_messages.seen(frame.message_id):
+            return
+        with self.reassembly_lock:
+            full_message = self._store_parity(frame, source_device)
+        if full_message is not None and not frame.group:
+            self.forward_message(full_message, source_device, frame.message_id,
+                                 frame.first_sender)
+
+    def handle_group_membership(self, data, source_device):
+        """Replace this node's group list with the one pushed by the ground station."""
+        self.groups = set(data[2:])
+        print("Group membership:", sorted(self.groups))
+        self._transmit(source_device, bytes([FRAME_MARKER]) + GROUP_MEMBERSHIP_ACK + bytes(data[2:]))
+
+    def handle_sender_index(self, data, source_device):
+        """Take the sender index assigned by the ground station and confirm it."""
+        if len(data) < 4:
+            return
+        self.set_sender_index(int.from_bytes(data[2:4], "big"))
+        print("Sender index:", self.sender_index)
+        self._transmit(source_device, bytes([FRAME_MARKER]) + SENDER_INDEX_ACK + bytes(data[2:4]))
 
     def list_devices(self):
         return [dev.get_node_id() for dev in self.current_discovered_devices]
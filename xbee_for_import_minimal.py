@@ -3,8 +3,6 @@
 import json
 import logging
 import queue
-import secrets
-import string
 from typing import Set, Dict, Any, Optional
 
 from digi.xbee.devices import DigiMeshDevice, NetworkEventReason
@@ -12,6 +10,8 @@ from digi.xbee.models.options import TransmitOptions
 from digi.xbee.models.status import NetworkDiscoveryStatus
 from serial.serialutil import SerialException
 
+from xbee_sequence import DuplicateFilter, SequenceNumberer, sender_index_for
+
 SEPARATOR = "\x1F"
 MAX_MESSAGE_LENGTH = 400
 MAX_PART_LENGTH = 50
@@ -20,8 +20,11 @@ MAX_PART_LENGTH = 50
 class Communicator:
     """Handles XBee device communication and message management."""
     
-    def __init__(self) -> None:
+    def __init__(self, sender_index: Optional[int] = None) -> None:
         self.device: Optional[DigiMeshDevice] = None
+        self.sender_index: Optional[int] = sender_index
+        self.sequence: Optional[SequenceNumberer] = None
+        self.completed_messages = DuplicateFilter()
         self.received_message_ids: Set[str] = set()
         self.message_count: int = 0
         self.clear_list_after: int = 15
@@ -33,9 +36,12 @@ class Communicator:
         self.message_parts: Dict[str, Dict] = {}
 
     def generate_message_id(self) -> str:
-        """Generate a unique 3-character message ID."""
-        characters = string.ascii_letters + string.digits
-        return ''.join(secrets.choice(characters) for _ in range(3))
+        """Generate the next (sender index, sequence number) message ID."""
+        if self.sequence is None:
+            if self.sender_index is None:
+                self.sender_index = sender_index_for(self.device.get_64bit_addr())
+            self.sequence = SequenceNumberer(self.sender_index)
+        return self.sequence.next_id()
 
     def message_callback(self, message) -> None:
         """Process received messages and handle message reassembly."""
@@ -60,6 +66,9 @@ class Communicator:
             part_number = int(part_number)
             is_last_part = int(is_last_part)
 
+            if self.completed_messages.seen(base_message_id):
+                return
+
             if base_message_id not in self.message_parts:
                 self.message_parts[base_message_id] = {
                     "parts": {},
@@ -89,6 +98,7 @@ class Communicator:
                 })
 
                 del self.message_parts[base_message_id]
+                self.completed_messages.mark(base_message_id)
 
         except Exception as error:
             print(f"Error processing message: {error}")
@@ -119,14 +129,14 @@ class Communicator:
             callback_discovery_finished
         )
 
-    def connect(self, device_name: str) -> None:
+    def connect(self, device_name: str, baud_rate: int = 57600) -> None:
         """Connect to XBee device and initialize discovery."""
         if self.device is not None:
             print("Device already connected")
             return
         
         try:
-            self.device = DigiMeshDevice(device_name, 57600)
+            self.device = DigiMeshDevice(device_name, baud_rate)
             self.device.open()
             self.device.add_data_received_callback(self.message_callback)
         except Exception as error:
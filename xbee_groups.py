@@ -0,0 +1,191 @@
+"""Named node groups for multicast, managed on the ground station.
+
+A group ("squad-A") has a one-byte ID and a set of member node IDs. The
+``GroupManager`` keeps the table in ``xbee_groups.json`` in the data
+directory (``xbee_paths``) and pushes each
+node its full list of group IDs (``GROUP_MEMBERSHIP`` frame, unicast); the
+node answers with ``GROUP_MEMBERSHIP_ACK`` and until it does, the push is
+repeated every ``resend_interval`` seconds, and again whenever the node
+comes back after being declared dead (it may have rebooted).
+
+``send(name, message)`` costs one broadcast per message part whatever the
+group size: every part is tagged with the group ID and non-members drop it
+in ``Communicator.message_callback`` before it is queued for reassembly.
+"""
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from xbee_for_import import FRAME_MARKER, GROUP_MEMBERSHIP, GROUP_MEMBERSHIP_ACK
+from xbee_liveness import NodeState
+from xbee_paths import data_path, make_parent
+
+DEFAULT_PATH = data_path("xbee_groups.json")
+MAX_GROUP_ID = 255
+RESEND_INTERVAL = 5.0
+
+
+@dataclass
+class Group:
+    name: str
+    group_id: int
+    members: Set[str] = field(default_factory=set)
+
+
+class GroupManager:
+    def __init__(self, communicator, path: Optional[str] = DEFAULT_PATH,
+                 resend_interval: float = RESEND_INTERVAL) -> None:
+        self.communicator = communicator
+        self.path = path
+        self.resend_interval = resend_interval
+        self.groups: Dict[str, Group] = {}
+        self.nodes: Set[str] = set()  # every node ever pushed to, so removals reach it
+        self.confirmed: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._load()
+        # The ground station sees every group's traffic
+        communicator.receive_all_groups = True
+        communicator.register_frame_handler(GROUP_MEMBERSHIP_ACK, self._on_ack)
+        communicator.liveness.add_listener(self._on_state_change)
+
+    def _load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as stored:
+                data = json.load(stored)
+        except (OSError, ValueError):
+            return
+        for name, group in data.get("groups", {}).items():
+            self.groups[name] = Group(name, group["id"], set(group["members"]))
+        self.nodes = set(data.get("nodes", ()))
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"groups": {group.name: {"id": group.group_id, "members": sorted(group.members)}
+                               for group in self.groups.values()},
+                    "nodes": sorted(self.nodes)}
+        try:
+            make_parent(self.path)
+            with open(self.path, "w") as stored:
+                json.dump(data, stored, indent=1, sort_keys=True)
+        except OSError as error:
+            print("Could not write group table:", str(error))
+
+    # --- membership ----------------------------------------------------
+
+    def create(self, name: str) -> int:
+        """Create ``name`` (if new) and return its group ID."""
+        with self._lock:
+            if name in self.groups:
+                return self.groups[name].group_id
+            used = {group.group_id for group in self.groups.values()}
+            free = [group_id for group_id in range(1, MAX_GROUP_ID + 1) if group_id not in used]
+            if not free:
+                raise ValueError("no free group IDs left")
+            self.groups[name] = Group(name, free[0])
+        self.save()
+        return free[0]
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            group = self.groups.pop(name, None)
+        if group is not None:
+            self.save()
+            self.push(*group.members)
+
+    def add(self, name: str, *node_ids: str) -> None:
+        self.create(name)
+        with self._lock:
+            self.groups[name].members.update(node_ids)
+        self.save()
+        self.push(*node_ids)
+
+    def remove(self, name: str, *node_ids: str) -> None:
+        with self._lock:
+            group = self.groups.get(name)
+            if group is None:
+                return
+            group.members.difference_update(node_ids)
+        self.save()
+        self.push(*node_ids)
+
+    def members(self, name: str) -> List[str]:
+        with self._lock:
+            group = self.groups.get(name)
+            return sorted(group.members) if group else []
+
+    def groups_of(self, node_id: str) -> Tuple[int, ...]:
+        """Sorted IDs of the groups ``node_id`` belongs to."""
+        with self._lock:
+            return tuple(sorted(group.group_id for group in self.groups.values()
+                                if node_id in group.members))
+
+    def pending(self) -> List[str]:
+        """Nodes that have not yet confirmed their current group list."""
+        with self._lock:
+            return sorted(node_id for node_id in self.nodes
+                          if self.confirmed.get(node_id) != self.groups_of(node_id))
+
+    # --- pushing to the nodes --------------------------------------------
+
+    def push(self, *node_ids: str) -> None:
+        """Send each node its group list; unreachable nodes stay pending."""
+        with self._lock:
+            new_nodes = set(node_ids) - self.nodes
+            self.nodes.update(new_nodes)
+        if new_nodes:
+            self.save()
+        for node_id in node_ids:
+            remote = self.communicator.find_remote_device(node_id)
+            if remote is None:
+                continue
+            frame = bytes([FRAME_MARKER]) + GROUP_MEMBERSHIP + bytes(self.groups_of(node_id))
+            try:
+                self.communicator._transmit(remote, frame)
+            except Exception as error:
+                print("Group push error:", str(error))
+
+    def sync(self) -> None:
+        self.push(*self.pending())
+
+    def start(self) -> None:
+        """Re-push unconfirmed group lists in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.resend_interval)
+            if self.communicator.link_up.is_set():
+                self.sync()
+
+    def _on_ack(self, data: bytes, source_device) -> None:
+        with self._lock:
+            self.confirmed[source_device.get_node_id()] = tuple(data[2:])
+
+    def _on_state_change(self, node: str, old: NodeState, new: NodeState) -> None:
+        if old != NodeState.DEAD or new == NodeState.DEAD:
+            return
+        for remote in list(self.communicator.current_discovered_devices):
+            if self.communicator.node_key(remote) == node:
+                with self._lock:
+                    self.confirmed.pop(remote.get_node_id(), None)
+
+    # --- sending ---------------------------------------------------------
+
+    def send(self, name: str, message: str) -> None:
+        """Send ``message`` to the members of group ``name``."""
+        with self._lock:
+            group = self.groups.get(name)
+        if group is None:
+            print("Unknown group: %s" % name)
+            return
+        self.communicator.send_group(group.group_id, message, name)
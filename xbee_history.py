@@ -0,0 +1,411 @@
+"""Append-only message history in memory-mapped segment files with sparse indexes.
+
+Every writer process appends to its own segment files in one directory,
+so a GUI, the console and the daemon can all record into ``history/`` and
+any of them can query the lot. A segment is a sequence of records::
+
+    f64 timestamp | u8 direction | u8 node length | u32 text length | node | text
+
+and each ``.seg`` file has an ``.idx`` companion with one JSON line per
+block of ``block_records`` records: its first and last timestamp, byte
+range and the set of nodes in it. A query bisects the blocks by time,
+skips blocks that do not mention the requested node and decodes only the
+records inside the remaining blocks, straight from an ``mmap`` of the
+segment. Records written since the last index line are scanned once and
+kept in memory until their block is indexed.
+
+Queries take a snapshot of the segments under a reader lock and decode
+outside it, and never hold the writer lock, so a long query does not delay
+``record_sent`` on the send path. Whenever a writer starts a segment, the
+oldest segments go until the directory fits ``max_bytes`` and ``max_age``.
+The newest segment of every writer is always kept.
+"""
+
+import argparse
+import bisect
+import glob
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from typing import Iterator, List, Optional
+
+from xbee_paths import data_path
+
+_RECORD = struct.Struct(">dBBI")
+
+DEFAULT_DIR = data_path("history")
+MAX_BYTES = 256 * 1024 * 1024
+
+RECEIVED = 0
+SENT = 1
+BROADCAST_NODE = "*"
+
+HistoryRecord = namedtuple("HistoryRecord", "timestamp direction node text")
+
+
+def _decode(data, start: int, end: int):
+    offset = start
+    while offset + _RECORD.size <= end:
+        timestamp, direction, node_length, text_length = _RECORD.unpack_from(data, offset)
+        body = offset + _RECORD.size
+        record_end = body + node_length + text_length
+        if record_end > end:
+            return  # record still being written
+        node = data[body:body + node_length].decode("utf8")
+        text = data[body + node_length:record_end].decode("utf8", "replace")
+        yield offset, record_end, HistoryRecord(timestamp, direction, node, text)
+        offset = record_end
+
+
+def _records(data, blocks, start: Optional[float], end: Optional[float],
+             node: Optional[str], direction: Optional[int]) -> Iterator[HistoryRecord]:
+    """Matching records of one segment snapshot (its mmap and blocks)."""
+    first = 0
+    if start is not None:
+        first = bisect.bisect_left([block.last for block in blocks], start)
+    for block in blocks[first:]:
+        if end is not None and block.first > end:
+            return
+        if node is not None and node not in block.nodes:
+            continue
+        for _, _, record in _decode(data, block.start, block.end):
+            if start is not None and record.timestamp < start:
+                continue
+            if end is not None and record.timestamp > end:
+                return
+            if node is not None and record.node != node:
+                continue
+            if direction is not None and record.direction != direction:
+                continue
+            yield record
+
+
+class _Block:
+    __slots__ = ("first", "last", "start", "end", "nodes")
+
+    def __init__(self, first: float, last: float, start: int, end: int, nodes) -> None:
+        self.first = first
+        self.last = last
+        self.start = start
+        self.end = end
+        self.nodes = frozenset(nodes)
+
+
+class _Segment:
+    """Read side of one segment: its index blocks and a read-only mmap."""
+
+    def __init__(self, path: str, block_records: int) -> None:
+        self.path = path
+        self.idx_path = path[:-4] + ".idx"
+        self.block_records = block_records
+        self.blocks: List[_Block] = []
+        self.tail: List[_Block] = []
+        self._idx_offset = 0
+        self._scanned = 0
+        self._map = None
+        self._map_size = 0
+
+    def refresh(self) -> None:
+        if os.path.exists(self.idx_path):
+            with open(self.idx_path, "rb") as idx:
+                idx.seek(self._idx_offset)
+                added = False
+                for line in idx:
+                    if not line.endswith(b"\n"):
+                        break  # half-written line, read it next time
+                    first, last, start, end, nodes = json.loads(line)
+                    self.blocks.append(_Block(first, last, start, end, nodes))
+                    self._idx_offset += len(line)
+                    added = True
+            if added:
+                self.tail = []
+                self._scanned = self.blocks[-1].end
+        size = os.path.getsize(self.path)
+        if size != self._map_size:
+            # A query may still be reading the old map; it closes once released
+            self._map = None
+            if size:
+                with open(self.path, "rb") as segment:
+                    self._map = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_size = size
+        if self._scanned < size:
+            self._scan_tail()
+
+    def _scan_tail(self) -> None:
+        """Group records beyond the last index line into in-memory blocks."""
+        for offset, end, record in _decode(self._map, self._scanned, self._map_size):
+            block = self.tail[-1] if self.tail else None
+            if block is None or block.count >= self.block_records:
+                block = _TailBlock(record.timestamp, offset)
+                self.tail.append(block)
+            block.add(record, end)
+            self._scanned = end
+
+    def snapshot(self):
+        """(mmap, blocks) as of the last refresh, safe to read without the lock."""
+        blocks = self.blocks + [_Block(block.first, block.last, block.start, block.end,
+                                       block.nodes) for block in self.tail]
+        return self._map, blocks
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class _TailBlock(_Block):
+    __slots__ = ("count",)
+
+    def __init__(self, first: float, start: int) -> None:
+        super().__init__(first, first, start, start, ())
+        self.nodes = set()
+        self.count = 0
+
+    def add(self, record: HistoryRecord, end: int) -> None:
+        self.last = record.timestamp
+        self.nodes.add(record.node)
+        self.count += 1
+        self.end = end
+
+
+class MessageHistory:
+    """Records sent and received messages and answers queries over them.
+
+    ``readonly=True`` opens the directory for queries only. Timestamps
+    are wall-clock seconds; each writer assumes its clock does not step
+    backwards within a segment.
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIR, segment_size: int = 16 * 1024 * 1024,
+                 block_records: int = 64, readonly: bool = False,
+                 max_bytes: Optional[int] = MAX_BYTES, max_age: Optional[float] = None) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.block_records = block_records
+        self.readonly = readonly
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # seconds since a segment was last written
+        self._segments = {}
+        self._lock = threading.Lock()       # writer: the open segment
+        self._read_lock = threading.Lock()  # readers: self._segments
+        self._file = None
+        self._idx = None
+        self._block = None  # [first, last, start, nodes, count]
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+
+    # --- writing -------------------------------------------------------
+
+    def _open_segment(self, timestamp: float) -> None:
+        self._close_segment()
+        base = os.path.join(self.directory, "%013d-%d" % (timestamp * 1000, os.getpid()))
+        self._file = open(base + ".seg", "ab")
+        self._idx = open(base + ".idx", "a")
+        self.prune()
+
+    def prune(self) -> int:
+        """Delete the oldest segments beyond ``max_bytes``/``max_age``; return how many."""
+        if self.max_bytes is None and self.max_age is None:
+            return 0
+        segments = []
+        newest = {}  # writer pid -> its newest segment, still being written
+        for path in glob.glob(os.path.join(self.directory, "*.seg")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            segments.append((os.path.basename(path), path, stat.st_size, stat.st_mtime))
+            writer = os.path.basename(path)[:-4].rpartition("-")[2]
+            newest[writer] = max(newest.get(writer, ""), os.path.basename(path))
+        segments.sort()
+        total = sum(size for _, _, size, _ in segments)
+        cutoff = None if self.max_age is None else time.time() - self.max_age
+        removed = 0
+        for name, path, size, mtime in segments:
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            too_old = cutoff is not None and mtime < cutoff
+            if not (too_big or too_old):
+                break
+            if name in newest.values():
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # still mapped by a reader (Windows); next time
+            try:
+                os.remove(path[:-4] + ".idx")
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def _close_block(self) -> None:
+        if self._block is None:
+            return
+        first, last, start, nodes, _ = self._block
+        self._idx.write(json.dumps([first, last, start, self._file.tell(), sorted(nodes)]) + "\n")
+        self._idx.flush()
+        self._block = None
+
+    def _close_segment(self) -> None:
+        if self._file is not None:
+            self._close_block()
+            self._file.close()
+            self._idx.close()
+            self._file = self._idx = None
+
+    def append(self, direction: int, node: str, text: str,
+               timestamp: Optional[float] = None) -> None:
+        if self.readonly:
+            raise ValueError("history opened read-only")
+        timestamp = time.time() if timestamp is None else timestamp
+        node = (node or "").encode("utf8")[:255].decode("utf8", "ignore")
+        node_bytes = node.encode("utf8")
+        text_bytes = text.encode("utf8")
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_size:
+                self._open_segment(timestamp)
+            offset = self._file.tell()
+            self._file.write(_RECORD.pack(timestamp, direction, len(node_bytes), len(text_bytes))
+                             + node_bytes + text_bytes)
+            self._file.flush()
+            if self._block is None:
+                self._block = [timestamp, timestamp, offset, set(), 0]
+            self._block[1] = timestamp
+            self._block[3].add(node)
+            self._block[4] += 1
+            if self._block[4] >= self.block_records:
+                self._close_block()
+
+    def record_received(self, message: dict) -> None:
+        """Store a reassembled message dict under the node that originated it."""
+        self.append(RECEIVED, message.get("first") or message.get("from") or "", message["msg"])
+
+    def record_sent(self, node: Optional[str], text: str) -> None:
+        """Store an outgoing message; ``node`` None means sent to everyone."""
+        self.append(SENT, node or BROADCAST_NODE, text)
+
+    def attach(self, bus) -> None:
+        """Record every message published on a ``MessageBus`` from a background thread."""
+        subscription = bus.subscribe("", maxsize=10000)
+
+        def consume():
+            while True:
+                self.record_received(subscription.get())
+
+        threading.Thread(target=consume, daemon=True).start()
+
+    def bind(self, communicator) -> None:
+        """Record what ``communicator`` receives (via its bus) and sends."""
+        self.attach(communicator.bus)
+        communicator.history = self
+
+    # --- reading -------------------------------------------------------
+
+    def _refresh(self) -> List[_Segment]:
+        """Bring the segment cache up to date; call with ``_read_lock`` held."""
+        paths = set(glob.glob(os.path.join(self.directory, "*.seg")))
+        for path in list(self._segments):
+            if path not in paths:
+                del self._segments[path]  # pruned; its map closes once released
+        for path in paths:
+            if path not in self._segments:
+                self._segments[path] = _Segment(path, self.block_records)
+        segments = []
+        for path in sorted(self._segments):
+            try:
+                self._segments[path].refresh()
+            except FileNotFoundError:
+                del self._segments[path]
+                continue
+            segments.append(self._segments[path])
+        return segments
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None,
+              node: Optional[str] = None, direction: Optional[int] = None,
+              limit: Optional[int] = None) -> List[HistoryRecord]:
+        """Records with ``start <= timestamp <= end`` for ``node``, oldest first.
+
+        ``limit`` keeps only the most recent ``limit`` matches.
+        """
+        with self._read_lock:
+            snapshots = [segment.snapshot() for segment in self._refresh()]
+        merged = heapq.merge(*(_records(data, blocks, start, end, node, direction)
+                               for data, blocks in snapshots if data is not None))
+        records = list(merged)
+        return records[-limit:] if limit else records
+
+    def last_minutes(self, minutes: float, node: Optional[str] = None) -> List[HistoryRecord]:
+        return self.query(start=time.time() - minutes * 60.0, node=node)
+
+    def follow(self, node: Optional[str] = None, direction: Optional[int] = None,
+               poll: float = 0.25, stop: Optional[threading.Event] = None
+               ) -> Iterator[HistoryRecord]:
+        """Yield records appended from now on, like ``tail -f``."""
+        cursors = {}
+        with self._read_lock:
+            for segment in self._refresh():
+                cursors[segment.path] = segment._map_size
+        while stop is None or not stop.is_set():
+            with self._read_lock:
+                views = [(segment.path, segment._map, segment._map_size)
+                         for segment in self._refresh()]
+            fresh = []
+            for path, data, size in views:
+                cursor = cursors.get(path, 0)
+                if data is not None:
+                    for _, cursor, record in _decode(data, cursor, size):
+                        if (node is None or record.node == node) and \
+                                (direction is None or record.direction == direction):
+                            fresh.append(record)
+                cursors[path] = cursor
+            fresh.sort()
+            yield from fresh
+            if not fresh:
+                time.sleep(poll)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+        with self._read_lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+
+def format_record(record: HistoryRecord) -> str:
+    arrow = "<-" if record.direction == RECEIVED else "->"
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.timestamp))
+    return "%s.%03d %s %s %s" % (stamp, record.timestamp % 1 * 1000, arrow, record.node, record.text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query or follow the message history.")
+    parser.add_argument("command", choices=["query", "tail"])
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    parser.add_argument("--node")
+    parser.add_argument("--minutes", type=float, help="only the last N minutes")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    history = MessageHistory(args.dir, readonly=True)
+    if args.command == "query":
+        start = time.time() - args.minutes * 60.0 if args.minutes else None
+        for record in history.query(start=start, node=args.node, limit=args.limit):
+            print(format_record(record))
+        return
+    try:
+        for record in history.follow(node=args.node):
+            print(format_record(record), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
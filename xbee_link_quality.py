@@ -0,0 +1,182 @@
+"""Per-neighbor link quality estimation for mesh destination selection."""
+
+import threading
+import time
+from enum import Enum
+from typing import Dict, Iterable, List, Optional
+
+# DigiMesh repeats every broadcast MT + 1 times (MT defaults to 3) and no
+# acknowledgement comes back, so one broadcast costs this many transmissions.
+BROADCAST_TRANSMISSIONS = 4
+
+RSSI_BAD_DBM = -95.0
+RSSI_MARGINAL_DBM = -85.0
+RSSI_EXCELLENT_DBM = -50.0
+
+
+class LinkState(Enum):
+    """Coarse classification of a neighbor link."""
+    GOOD = "good"
+    MARGINAL = "marginal"
+    BAD = "bad"
+
+
+class LinkStats:
+    """Moving averages kept for a single neighbor."""
+
+    __slots__ = ("rssi", "delivery", "retries", "tx_count", "last_update")
+
+    def __init__(self) -> None:
+        self.rssi: Optional[float] = None
+        self.delivery: float = 1.0
+        self.retries: float = 0.0
+        self.tx_count: int = 0
+        self.last_update: float = time.monotonic()
+
+
+class LinkQualityEstimator:
+    """Combines RSSI, TX-status failures and retries into a per-link score.
+
+    Every input is folded into an exponentially weighted moving average, so
+    a single lost frame does not condemn a link but a run of them does.
+    Nodes are keyed by their 64-bit address string.
+    """
+
+    def __init__(self, alpha: float = 0.25, bad_delivery: float = 0.5,
+                 marginal_delivery: float = 0.85,
+                 marginal_retries: float = 1.5,
+                 stale_after: float = 120.0) -> None:
+        self.alpha = alpha
+        self.bad_delivery = bad_delivery
+        self.marginal_delivery = marginal_delivery
+        self.marginal_retries = marginal_retries
+        self.stale_after = stale_after
+        self._links: Dict[str, LinkStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, node: str) -> LinkStats:
+        stats = self._links.get(node)
+        if stats is None:
+            stats = LinkStats()
+            self._links[node] = stats
+        return stats
+
+    def _ewma(self, previous: float, sample: float) -> float:
+        return previous + self.alpha * (sample - previous)
+
+    def record_rssi(self, node: str, rssi_dbm: float) -> None:
+        """Fold a received signal strength sample (negative dBm) in."""
+        with self._lock:
+            stats = self._stats(node)
+            if stats.rssi is None:
+                stats.rssi = float(rssi_dbm)
+            else:
+                stats.rssi = self._ewma(stats.rssi, float(rssi_dbm))
+            stats.last_update = time.monotonic()
+
+    def record_tx_status(self, node: str, success: bool, retries: int = 0) -> None:
+        """Fold the outcome of one unicast transmission in."""
+        with self._lock:
+            stats = self._stats(node)
+            stats.delivery = self._ewma(stats.delivery, 1.0 if success else 0.0)
+            stats.retries = self._ewma(stats.retries, float(retries))
+            stats.tx_count += 1
+            stats.last_update = time.monotonic()
+
+    def forget(self, node: str) -> None:
+        """Drop everything known about a neighbor."""
+        with self._lock:
+            self._links.pop(node, None)
+
+    def _current(self, node: str) -> Optional[LinkStats]:
+        stats = self._links.get(node)
+        if stats is None:
+            return None
+        if time.monotonic() - stats.last_update > self.stale_after:
+            # Old samples say nothing about the link today; start over.
+            del self._links[node]
+            return None
+        return stats
+
+    def state(self, node: str) -> LinkState:
+        """Classify a link; unknown links are optimistically GOOD."""
+        with self._lock:
+            stats = self._current(node)
+        if stats is None:
+            return LinkState.GOOD
+        if (stats.delivery < self.bad_delivery or
+                (stats.rssi is not None and stats.rssi < RSSI_BAD_DBM)):
+            return LinkState.BAD
+        if (stats.delivery < self.marginal_delivery or
+                stats.retries > self.marginal_retries or
+                (stats.rssi is not None and stats.rssi < RSSI_MARGINAL_DBM)):
+            return LinkState.MARGINAL
+        return LinkState.GOOD
+
+    def score(self, node: str) -> float:
+        """Return a link score in [0, 1], higher is better."""
+        with self._lock:
+            stats = self._current(node)
+        if stats is None:
+            return 0.5
+        if stats.rssi is None:
+            signal = 0.5
+        else:
+            span = RSSI_EXCELLENT_DBM - RSSI_BAD_DBM
+            signal = min(1.0, max(0.0, (stats.rssi - RSSI_BAD_DBM) / span))
+        return stats.delivery * (0.5 + 0.5 * signal) / (1.0 + 0.25 * stats.retries)
+
+    def expected_transmissions(self, node: str) -> float:
+        """Estimate radio transmissions needed to deliver one unicast frame."""
+        with self._lock:
+            stats = self._current(node)
+        if stats is None:
+            return 1.0
+        # Each attempt is one frame plus its retries; failed attempts are
+        # repeated, so divide by the delivery ratio (capped to stay finite).
+        return (1.0 + stats.retries) / max(stats.delivery, 0.05)
+
+    def delivery_ratio(self, node: str) -> float:
+        """Fraction of unicast frames acknowledged, after the radio's own retries."""
+        with self._lock:
+            stats = self._current(node)
+        return 1.0 if stats is None else stats.delivery
+
+    def usable(self, nodes: Iterable, key=str) -> List:
+        """Return the nodes that are not BAD, best link first."""
+        ranked = [node for node in nodes if self.state(key(node)) != LinkState.BAD]
+        ranked.sort(key=lambda node: self.score(key(node)), reverse=True)
+        return ranked
+
+    def best_relay(self, nodes: Iterable, key=str, exclude: Optional[str] = None):
+        """Return the neighbor with the best link, or None."""
+        candidates = [node for node in nodes if key(node) != exclude]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda node: self.score(key(node)))
+
+    def prefer_broadcast(self, nodes: Iterable, key=str,
+                         broadcast_cost: float = BROADCAST_TRANSMISSIONS) -> bool:
+        """Return True when one broadcast is cheaper than unicasting to each node."""
+        unicast_cost = sum(self.expected_transmissions(key(node)) for node in nodes)
+        return unicast_cost > broadcast_cost
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Return a plain-dict view of all tracked links."""
+        with self._lock:
+            nodes = list(self._links)
+        result = {}
+        for node in nodes:
+            with self._lock:
+                stats = self._current(node)
+            if stats is None:
+                continue
+            result[node] = {
+                "state": self.state(node).value,
+                "score": round(self.score(node), 3),
+                "rssi": stats.rssi,
+                "delivery": round(stats.delivery, 3),
+                "retries": round(stats.retries, 2),
+                "tx_count": stats.tx_count,
+            }
+        return result
@@ -0,0 +1,142 @@
+"""Phi-accrual liveness tracking: which nodes have been heard from recently enough."""
+
+import math
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class NodeState(Enum):
+    ALIVE = "alive"
+    SUSPECT = "suspect"
+    DEAD = "dead"
+
+
+class _Arrivals:
+    def __init__(self, window: int) -> None:
+        self.intervals: deque = deque(maxlen=window)
+        self.last = 0.0
+        self.state = NodeState.ALIVE
+
+
+class LivenessTracker:
+    """Turns proof-of-life events into ALIVE / SUSPECT / DEAD node states.
+
+    Every heartbeat, received frame or discovery response is an arrival.
+    The detector keeps the recent inter-arrival times of each node and
+    reports phi, the confidence (-log10 of the probability) that a node
+    which has been silent this long is still up: a node that normally
+    talks every second is suspect much sooner than one that only answers
+    the periodic discovery. ``suspect_after`` and ``dead_after`` bound the
+    silence in seconds on both sides, so jitter never marks a node down
+    early and a node never stays up forever.
+    """
+
+    def __init__(self, suspect_phi: float = 3.0, dead_phi: float = 8.0,
+                 suspect_after: float = 2.0, dead_after: float = 30.0,
+                 expected_interval: float = 5.0, min_std: float = 1.0,
+                 window: int = 50) -> None:
+        self.suspect_phi = suspect_phi
+        self.dead_phi = dead_phi
+        self.suspect_after = suspect_after
+        self.dead_after = dead_after
+        self.expected_interval = expected_interval
+        self.min_std = min_std
+        self.window = window
+        self._nodes: Dict[str, _Arrivals] = {}
+        self._listeners: List[Callable[[str, NodeState, NodeState], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback: Callable[[str, NodeState, NodeState], None]) -> None:
+        """Call ``callback(node, old_state, new_state)`` on every transition."""
+        self._listeners.append(callback)
+
+    def heartbeat(self, node: str, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            arrivals = self._nodes.get(node)
+            if arrivals is None:
+                arrivals = self._nodes[node] = _Arrivals(self.window)
+            elif now > arrivals.last:
+                arrivals.intervals.append(now - arrivals.last)
+            arrivals.last = now
+            old, arrivals.state = arrivals.state, NodeState.ALIVE
+        if old != NodeState.ALIVE:
+            self._notify(node, old, NodeState.ALIVE)
+
+    def forget(self, node: str) -> None:
+        with self._lock:
+            self._nodes.pop(node, None)
+
+    def _phi(self, arrivals: _Arrivals, now: float) -> float:
+        elapsed = now - arrivals.last
+        if arrivals.intervals:
+            mean = sum(arrivals.intervals) / len(arrivals.intervals)
+            variance = sum((x - mean) ** 2 for x in arrivals.intervals) / len(arrivals.intervals)
+        else:
+            mean, variance = self.expected_interval, 0.0
+        std = max(math.sqrt(variance), self.min_std)
+        # P(next arrival later than elapsed) under a normal model of intervals
+        p_later = 0.5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+        return -math.log10(max(p_later, 1e-300))
+
+    def phi(self, node: str, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            arrivals = self._nodes.get(node)
+            return 0.0 if arrivals is None else self._phi(arrivals, now)
+
+    def _evaluate(self, arrivals: _Arrivals, now: float) -> NodeState:
+        elapsed = now - arrivals.last
+        if elapsed < self.suspect_after:
+            return NodeState.ALIVE
+        if elapsed >= self.dead_after:
+            return NodeState.DEAD
+        phi = self._phi(arrivals, now)
+        if phi >= self.dead_phi:
+            return NodeState.DEAD
+        if phi >= self.suspect_phi:
+            return NodeState.SUSPECT
+        return NodeState.ALIVE
+
+    def state(self, node: str, now: Optional[float] = None) -> NodeState:
+        """Current state; nodes never heard from count as ALIVE."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            arrivals = self._nodes.get(node)
+            return NodeState.ALIVE if arrivals is None else self._evaluate(arrivals, now)
+
+    def check(self, now: Optional[float] = None) -> None:
+        """Re-evaluate every node and fire listeners for the ones that changed."""
+        now = time.monotonic() if now is None else now
+        changes = []
+        with self._lock:
+            for node, arrivals in self._nodes.items():
+                new = self._evaluate(arrivals, now)
+                if new != arrivals.state:
+                    changes.append((node, arrivals.state, new))
+                    arrivals.state = new
+        for change in changes:
+            self._notify(*change)
+
+    def _notify(self, node: str, old: NodeState, new: NodeState) -> None:
+        for callback in self._listeners:
+            try:
+                callback(node, old, new)
+            except Exception as error:
+                print("Liveness listener error:", str(error))
+
+    def live(self, nodes: Iterable, key: Callable = str) -> list:
+        """The nodes that are not DEAD, in their original order."""
+        now = time.monotonic()
+        return [node for node in nodes if self.state(key(node), now) != NodeState.DEAD]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return {node: {"state": self._evaluate(arrivals, now).value,
+                           "phi": round(self._phi(arrivals, now), 2),
+                           "silent": round(now - arrivals.last, 1)}
+                    for node, arrivals in self._nodes.items()}
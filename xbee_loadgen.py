@@ -0,0 +1,279 @@
+"""Synthetic traffic generator and soak test for the mesh stack.
+
+One ``Communicator`` sends a configurable mix of message sizes, unicast
+and broadcast traffic at a fixed or Poisson rate; the others receive.
+Every message carries its sequence number and send time, so each report
+interval can print throughput, latency percentiles, loss, the size of the
+reassembly stores and the process RSS as one JSON line. Runs over
+simulated radios by default, or over real ones with ``--ports``::
+
+    python xbee_loadgen.py --nodes 4 --rate 20 --duration 3600
+    python xbee_loadgen.py --ports COM3,COM4,COM5 --rate 5 --sizes 10:3,200:1
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from xbee_for_import import Communicator
+
+PREFIX = "LG "
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def process_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, if the platform tells us."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+
+@dataclass
+class LoadProfile:
+    rate: float = 10.0                      # messages per second
+    sizes: List[Tuple[int, float]] = field(default_factory=lambda: [(20, 1.0)])
+    broadcast_fraction: float = 0.2
+    destinations: int = 1                   # unicast targets per message
+    poisson: bool = False
+
+    @staticmethod
+    def parse_sizes(text: str) -> List[Tuple[int, float]]:
+        """"10:3,200:1" -> [(10, 3.0), (200, 1.0)]; a weight defaults to 1."""
+        sizes = []
+        for item in text.split(","):
+            size, _, weight = item.partition(":")
+            sizes.append((int(size), float(weight or 1)))
+        return sizes
+
+
+class _Pending:
+    __slots__ = ("sent_ns", "expected", "received")
+
+    def __init__(self, sent_ns: int, expected: set) -> None:
+        self.sent_ns = sent_ns
+        self.expected = expected
+        self.received = set()
+
+
+class LoadGenerator:
+    """Drives ``sender`` and measures what the ``receivers`` get."""
+
+    def __init__(self, sender: Communicator, receivers: List[Communicator],
+                 profile: LoadProfile, loss_timeout: float = 10.0,
+                 seed: Optional[int] = None) -> None:
+        self.sender = sender
+        self.receivers = receivers
+        self.profile = profile
+        self.loss_timeout = loss_timeout
+        self.random = random.Random(seed)
+        self._busy_time = 0.0
+        self.pending: Dict[int, _Pending] = {}
+        self.lock = threading.Lock()
+        self._reset_interval()
+        self.totals = {"sent": 0, "delivered": 0, "lost": 0}
+        for receiver in receivers:
+            subscription = receiver.bus.subscribe(PREFIX, maxsize=10000)
+            threading.Thread(target=self._receive, args=(receiver, subscription),
+                             daemon=True).start()
+
+    def _reset_interval(self) -> None:
+        self.sent = 0
+        self.sent_bytes = 0
+        self.delivered = 0
+        self.delivered_bytes = 0
+        self.latencies: List[float] = []
+        self.matured = 0
+        self.lost = 0
+
+    def _receive(self, receiver: Communicator, subscription) -> None:
+        node = receiver.device.get_node_id()
+        while True:
+            message = subscription.get()
+            arrived = time.monotonic_ns()
+            _, sequence, _ = message["msg"].split(" ", 2)
+            with self.lock:
+                pending = self.pending.get(int(sequence))
+                if pending is None or node not in pending.expected or node in pending.received:
+                    continue  # a late, forwarded or unexpected copy
+                pending.received.add(node)
+                self.delivered += 1
+                self.delivered_bytes += len(message["msg"])
+                self.latencies.append((arrived - pending.sent_ns) / 1e6)
+
+    def wait_for_discovery(self, timeout: float) -> List[str]:
+        """Wait until the sender sees every receiver; return the node IDs it sees."""
+        wanted = {receiver.device.get_node_id() for receiver in self.receivers}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if wanted <= set(self.sender.list_devices()):
+                break
+            time.sleep(0.1)
+        return sorted(wanted & set(self.sender.list_devices()))
+
+    def _message(self, sequence: int) -> str:
+        sizes, weights = zip(*self.profile.sizes)
+        size = self.random.choices(sizes, weights)[0]
+        header = "%s%d %d " % (PREFIX, sequence, time.monotonic_ns())
+        return header + "x" * max(0, size - len(header))
+
+    def send_one(self, sequence: int, nodes: List[str]) -> None:
+        message = self._message(sequence)
+        broadcast = self.random.random() < self.profile.broadcast_fraction
+        targets = nodes if broadcast else self.random.sample(
+            nodes, min(self.profile.destinations, len(nodes)))
+        sent_ns = int(message.split(" ", 3)[2])
+        with self.lock:
+            self.pending[sequence] = _Pending(sent_ns, set(targets))
+            self.sent += 1
+            self.sent_bytes += len(message) * len(targets)
+        if broadcast:
+            self.sender.send(message)
+        else:
+            for node in targets:
+                self.sender.send_single(node, message)
+
+    def _mature(self, now_ns: int) -> None:
+        """Count messages older than ``loss_timeout`` as delivered or lost."""
+        cutoff = now_ns - int(self.loss_timeout * 1e9)
+        for sequence in [s for s, p in self.pending.items() if p.sent_ns < cutoff]:
+            pending = self.pending.pop(sequence)
+            self.matured += len(pending.expected)
+            self.lost += len(pending.expected - pending.received)
+
+    def report(self, elapsed: float, interval: float, medium=None) -> dict:
+        with self.lock:
+            self._mature(time.monotonic_ns())
+            latencies = sorted(self.latencies)
+            report = {
+                "t": round(elapsed, 3),
+                "sent": self.sent,
+                "delivered": self.delivered,
+                "msgs_per_s": round(self.delivered / interval, 3),
+                "bytes_per_s": round(self.delivered_bytes / interval, 1),
+                "offered_bytes_per_s": round(self.sent_bytes / interval, 1),
+                "latency_ms": {
+                    "p50": percentile(latencies, 0.50),
+                    "p90": percentile(latencies, 0.90),
+                    "p99": percentile(latencies, 0.99),
+                    "max": percentile(latencies, 1.0),
+                },
+                "loss": round(self.lost / self.matured, 4) if self.matured else None,
+                "in_flight": len(self.pending),
+                "reassembly_parts": sum(len(c.message_parts)
+                                        for c in [self.sender] + self.receivers),
+                "rss_bytes": process_rss(),
+            }
+            if medium is not None:
+                # Airtime offered per second of wall time; above 1 the channel
+                # is saturated and frames queue up.
+                report["channel_load"] = round((medium.busy_time - self._busy_time) / interval, 3)
+                self._busy_time = medium.busy_time
+            self.totals["sent"] += self.sent
+            self.totals["delivered"] += self.delivered
+            self.totals["lost"] += self.lost
+            self._reset_interval()
+        return report
+
+    def run(self, duration: float, report_interval: float, emit, medium=None) -> None:
+        nodes = self.wait_for_discovery(timeout=30.0)
+        if not nodes:
+            raise RuntimeError("sender did not discover any receiver")
+        start = time.monotonic()
+        next_send = start
+        next_report = start + report_interval
+        last_report = start
+        sequence = 0
+        while True:
+            now = time.monotonic()
+            if now - start >= duration:
+                break
+            if now >= next_report:
+                emit(self.report(now - start, now - last_report, medium))
+                last_report = now
+                next_report += report_interval
+            if now >= next_send:
+                self.send_one(sequence, nodes)
+                sequence += 1
+                gap = self.random.expovariate(self.profile.rate) if self.profile.poisson \
+                    else 1.0 / self.profile.rate
+                next_send += gap
+                continue
+            time.sleep(max(0.0, min(next_send, next_report) - time.monotonic()))
+        now = time.monotonic()
+        emit(self.report(now - start, now - last_report, medium))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic mesh traffic and report.")
+    parser.add_argument("--ports", help="real radios: sender port, then receiver ports, comma separated")
+    parser.add_argument("--nodes", type=int, default=3, help="simulated receivers")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second")
+    parser.add_argument("--poisson", action="store_true", help="Poisson rather than fixed spacing")
+    parser.add_argument("--sizes", default="20", help="message sizes and weights, e.g. 10:3,200:1")
+    parser.add_argument("--broadcast", type=float, default=0.2, help="fraction sent to everyone")
+    parser.add_argument("--destinations", type=int, default=1, help="unicast targets per message")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between reports")
+    parser.add_argument("--loss", type=float, default=0.0, help="simulated per-frame loss")
+    parser.add_argument("--latency", type=float, default=0.005, help="simulated latency, s")
+    parser.add_argument("--air-rate", type=float, default=25000.0, help="simulated bytes/s on air")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write JSON lines here instead of stdout")
+    args = parser.parse_args()
+
+    out = open(args.output, "a") if args.output else sys.stdout
+
+    def emit(report):
+        out.write(json.dumps(report) + "\n")
+        out.flush()
+
+    profile = LoadProfile(args.rate, LoadProfile.parse_sizes(args.sizes), args.broadcast,
+                          args.destinations, args.poisson)
+    medium = None
+    communicators = [Communicator(sender_index=index) for index in
+                     range(len(args.ports.split(",")) if args.ports else args.nodes + 1)]
+    # The stack prints every fragment, from several threads; keep all of
+    # that out of the report stream.
+    sys.stdout = open(os.devnull, "w")
+    if args.ports:
+        for communicator, port in zip(communicators, args.ports.split(",")):
+            communicator.connect(port.strip())
+    else:
+        from xbee_sim import SimulatedDevice, SimulatedMedium
+        medium = SimulatedMedium(args.loss, args.latency, args.air_rate, seed=args.seed)
+        for index, communicator in enumerate(communicators):
+            name = "GS" if index == 0 else "SIM%d" % index
+            communicator.attach_device(SimulatedDevice(medium, name, 0x0013A20000000000 + index))
+    generator = LoadGenerator(communicators[0], communicators[1:], profile, seed=args.seed)
+    try:
+        generator.run(args.duration, args.interval, emit, medium)
+    except KeyboardInterrupt:
+        pass
+    emit({"summary": True, **generator.totals})
+
+
+if __name__ == "__main__":
+    main()
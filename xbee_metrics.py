@@ -0,0 +1,48 @@
+"""Process-wide counters and gauges for the messaging pipeline.
+
+Names are dotted, e.g. ``queue.receive.dropped``; several objects may
+report under the same name and their counts add up. ``snapshot()`` is what
+the daemon's ``stats`` op and the console's ``metrics`` command print.
+"""
+
+import threading
+from typing import Dict
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def max_gauge(self, name: str, value: float) -> None:
+        """Raise ``name`` to ``value`` if it is higher, for high-water marks."""
+        with self._lock:
+            if value > self._gauges.get(name, float("-inf")):
+                self._gauges[name] = value
+
+    def get(self, name: str, default: float = 0) -> float:
+        with self._lock:
+            return self._counters.get(name, self._gauges.get(name, default))
+
+    def snapshot(self, prefix: str = "") -> Dict[str, float]:
+        with self._lock:
+            merged = dict(self._gauges)
+            merged.update(self._counters)
+        return {name: value for name, value in sorted(merged.items()) if name.startswith(prefix)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+METRICS = Metrics()
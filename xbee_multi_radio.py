@@ -0,0 +1,315 @@
+"""Spread traffic across several XBee modules attached to one ground station."""
+
+import queue
+import threading
+from functools import partial
+from typing import Dict, List, Optional
+
+from xbee_delta import DeltaCodec
+from xbee_fanout import UNICAST
+from xbee_fec import FecPolicy
+from xbee_for_import import DEFAULT_QUEUES, FLOOD_FLOW, Communicator
+from xbee_metrics import METRICS
+from xbee_pubsub import MessageBus
+from xbee_queues import BoundedQueue
+from xbee_sequence import DuplicateFilter
+
+
+class MultiRadioCommunicator:
+    """Drop-in replacement for ``Communicator`` that drives several radios.
+
+    Every radio is a regular ``Communicator``; they share one reassembly
+    store, one ``message_queue`` and one ``bus``, so fragments of a message
+    can arrive over any radio. Outbound fragments are balanced across the live radios
+    that can reach each destination, unless the destination or traffic
+    class has been pinned to a radio. A radio whose serial port closes is
+    skipped until it comes back.
+
+    Each radio's share of a message goes through that radio's scheduler, so
+    flows are interleaved per radio as with a single ``Communicator``. When
+    no radio is live, messages wait in this object's own outbox and go out
+    through its routing as soon as any radio is back; a message whose radio
+    fails while sending it is sent again at once over the radios still live.
+    The radios share one FEC policy and one delta codec.
+    """
+
+    def __init__(self) -> None:
+        self.radios: List[Communicator] = []
+        self.message_queue = BoundedQueue.from_spec(DEFAULT_QUEUES["reassembled"], "reassembled")
+        self.bus = MessageBus()
+        self.message_parts: Dict[str, Dict] = {}
+        self.reassembly_lock = threading.Lock()
+        self.completed_messages = DuplicateFilter()
+        self.destination_radios: Dict[str, int] = {}
+        self.class_radios: Dict[str, int] = {}
+        self._round_robin: Dict[str, int] = {}
+        self.history = None
+        self.fec = FecPolicy()
+        self.delta = DeltaCodec()
+        self.outbox = BoundedQueue.from_spec(DEFAULT_QUEUES["outbound"], "outbound")
+
+    @property
+    def device(self):
+        """The first live device, so ``if communicator.device`` checks keep working."""
+        radios = self.live_radios()
+        return radios[0].device if radios else None
+
+    def add_radio(self, port: str, channel: Optional[int] = None,
+                  network_id: Optional[int] = None,
+                  baud_rate: Optional[int] = None) -> Communicator:
+        """Open one more radio, optionally on its own channel or network ID."""
+        radio = Communicator()
+        radio.message_queue = self.message_queue
+        radio.bus = self.bus
+        radio.message_parts = self.message_parts
+        radio.reassembly_lock = self.reassembly_lock
+        radio.completed_messages = self.completed_messages
+        radio.fec = self.fec
+        radio.delta = self.delta
+        # The radio flushes after each discovery pass and on reconnect: let it
+        # flush the shared outbox too, through multi-radio routing (its own
+        # outbox only ever holds the messages it relays)
+        radio.flush_outbox = partial(self._flush_radio, radio.flush_outbox)
+        radio.connect(port, baud_rate)
+        if radio.link_up.is_set():
+            self._configure_radio(radio, channel, network_id)
+        # A radio that was unplugged comes back with its saved settings
+        radio.reconnect_callbacks.append(
+            lambda: self._configure_radio(radio, channel, network_id))
+        self.radios.append(radio)
+        return radio
+
+    def _configure_radio(self, radio: Communicator, channel: Optional[int],
+                         network_id: Optional[int]) -> None:
+        try:
+            if channel is not None:
+                radio.device.set_parameter("CH", bytearray([channel]))
+            if network_id is not None:
+                radio.device.set_parameter("ID", bytearray(network_id.to_bytes(2, "big")))
+            if channel is not None or network_id is not None:
+                radio.device.apply_changes()
+        except Exception as error:
+            print("Radio configuration error:", str(error))
+
+    def connect(self, device_name: str, baud_rate: Optional[int] = None) -> None:
+        """Open every port in a comma-separated list, e.g. ``COM3,COM4``."""
+        for port in device_name.split(","):
+            port = port.strip()
+            if port:
+                self.add_radio(port, baud_rate=baud_rate)
+
+    def live_radios(self) -> List[Communicator]:
+        return [radio for radio in self.radios
+                if radio.link_up.is_set()]
+
+    def assign_destination(self, node_id: str, radio_index: int) -> None:
+        """Pin all traffic to ``node_id`` to one radio while it is live."""
+        self.destination_radios[node_id] = radio_index
+
+    def assign_class(self, traffic_class: str, radio_index: int) -> None:
+        """Pin a traffic class (e.g. "control", "bulk") to one radio while it is live."""
+        self.class_radios[traffic_class] = radio_index
+
+    def _pinned_radio(self, node_id: str,
+                      traffic_class: Optional[str]) -> Optional[Communicator]:
+        for table, key in ((self.destination_radios, node_id),
+                           (self.class_radios, traffic_class)):
+            index = table.get(key)
+            if index is not None and index < len(self.radios):
+                radio = self.radios[index]
+                if radio.link_up.is_set():
+                    return radio
+        return None
+
+    def _routes(self, node_ids: Optional[List[str]] = None) -> Dict[str, List]:
+        """Map each reachable node ID to the (radio, remote) pairs that reach it.
+
+        Flooding sends skip bad links like ``Communicator.send`` does; a send
+        to named nodes considers every radio that has discovered them.
+        """
+        routes: Dict[str, List] = {}
+        for radio in self.live_radios():
+            if node_ids is None:
+                remotes = radio.select_destinations(radio.current_discovered_devices)
+            else:
+                remotes = radio.current_discovered_devices
+            for remote in remotes:
+                node_id = remote.get_node_id()
+                if node_ids is None or node_id in node_ids:
+                    routes.setdefault(node_id, []).append((radio, remote))
+        return routes
+
+    def _pick_route(self, node_id: str, candidates: List,
+                    traffic_class: Optional[str]):
+        pinned = self._pinned_radio(node_id, traffic_class)
+        if pinned is not None:
+            for radio, remote in candidates:
+                if radio is pinned:
+                    return radio, remote
+        turn = self._round_robin.get(node_id, 0)
+        self._round_robin[node_id] = turn + 1
+        return candidates[turn % len(candidates)]
+
+    def _schedule_frames(self, frames: List, routes: Dict[str, List],
+                         traffic_class: Optional[str], flow: str, call: tuple) -> None:
+        """Spread each frame over the radios reaching its destinations and hand
+        every radio its share through its own scheduler."""
+        shares: Dict[int, List] = {}
+        for frame in frames:
+            size = len(frame)
+            batches: Dict[int, List] = {}
+            for node_id, candidates in routes.items():
+                radio, remote = self._pick_route(node_id, candidates, traffic_class)
+                batches.setdefault(id(radio), [radio]).append(remote)
+            for radio, *remotes in batches.values():
+                fragments = shares.setdefault(id(radio), [radio])
+                plan = radio.fanout.plan(remotes, key=radio.node_key)
+                if plan.strategy != UNICAST:
+                    fragments.append((partial(radio._broadcast, frame), size))
+                    remotes = plan.repairs
+                fragments.extend((partial(radio._transmit, remote, frame), size)
+                                 for remote in remotes)
+        for radio, *fragments in shares.values():
+            self._submit(radio, flow, fragments, call)
+
+    def _submit(self, radio: Communicator, flow: str, fragments: List, call: tuple) -> None:
+        """Like ``radio.schedule``, but a failure is handled here rather than by ``radio``."""
+        if not radio.scheduler.submit(flow, fragments, partial(self.send_failed, radio, call)):
+            print("Outbound scheduler full, message dropped:", call[-1])
+
+    def _link_loss(self, routes: Dict[str, List]) -> float:
+        return max((radio.link_loss([remote], False)
+                    for candidates in routes.values() for radio, remote in candidates),
+                   default=0.0)
+
+    def _ready(self, call: tuple) -> Optional[List[Communicator]]:
+        """The live radios, or None after queueing ``call`` while all links are down."""
+        if not self.radios:
+            print("No device connected")
+            return None
+        radios = self.live_radios()
+        if not radios:
+            self.queue_outbound(call)
+            return None
+        return radios
+
+    def queue_outbound(self, call: tuple) -> None:
+        try:
+            queued = self.outbox.put(call, timeout=0)  # never block the sender
+        except queue.Full:
+            queued = False
+        if queued:
+            print("All links down, message queued:", call[-1])
+        else:
+            print("Outbox full, message dropped:", call[-1])
+
+    def flush_outbox(self) -> None:
+        """Send what was queued while every link was down, oldest first."""
+        while self.live_radios():
+            try:
+                call = self.outbox.get_nowait()
+            except queue.Empty:
+                return
+            self.outbox.task_done()
+            self._dispatch(call)
+
+    def _flush_radio(self, flush_radio) -> None:
+        flush_radio()
+        self.flush_outbox()
+
+    def _dispatch(self, call: tuple) -> None:
+        if call[0] == "send":
+            self.send(call[1])
+        elif call[0] == "send_group":
+            self.send_group(call[1], call[2], call[3])
+        else:
+            self.send_single(call[1], call[2])
+
+    def send_failed(self, radio: Optional[Communicator], call: tuple,
+                    error: Exception) -> None:
+        """Send ``call`` again over the radios still live if ``radio`` (None: any
+        radio) has lost its link; queue it if none is left."""
+        print("Send error:", str(error))
+        failed = [radio] if radio is not None else self.live_radios()
+        failed = [radio for radio in failed if not radio.device_alive()]
+        if not failed:
+            return
+        for radio in failed:
+            radio.connection_lost()
+        if self.live_radios():
+            self._dispatch(call)
+        else:
+            self.queue_outbound(call)
+
+    def send(self, message: str, traffic_class: Optional[str] = None) -> None:
+        """Send a message to every node reachable through any live radio."""
+        call = ("send", message)
+        radios = self._ready(call)
+        if radios is None:
+            return
+        try:
+            routes = self._routes()
+            base_message_id = radios[0].prepare_message_id()
+            if self.history is not None:
+                self.history.record_sent(None, message)
+            encoded = self.delta.encode(FLOOD_FLOW, message, list(routes))
+            frames = radios[0].build_frames(encoded, base_message_id)
+            frames += radios[0].parity_frames(encoded, base_message_id, self._link_loss(routes))
+            self._schedule_frames(frames, routes, traffic_class, traffic_class or FLOOD_FLOW,
+                                  call)
+        except Exception as error:
+            self.send_failed(None, call, error)
+
+    def send_single(self, remote_address: str, message: str,
+                    traffic_class: Optional[str] = None) -> None:
+        """Send a message to one node, over whichever live radio reaches it."""
+        call = ("send_single", remote_address, message)
+        radios = self._ready(call)
+        if radios is None:
+            return
+        try:
+            routes = self._routes([remote_address])
+            if not routes:
+                print("Device not found with address: %s" % remote_address)
+                return
+            base_message_id = radios[0].prepare_message_id()
+            if self.history is not None:
+                self.history.record_sent(remote_address, message)
+            encoded = self.delta.encode(remote_address, message, [remote_address])
+            frames = radios[0].build_frames(encoded, base_message_id)
+            frames += radios[0].parity_frames(encoded, base_message_id, self._link_loss(routes))
+            self._schedule_frames(frames, routes, traffic_class,
+                                  traffic_class or remote_address, call)
+        except Exception as error:
+            self.send_failed(None, call, error)
+
+    def send_group(self, group_id: int, message: str, group_name: Optional[str] = None) -> None:
+        """Broadcast a group message on every live radio; members drop the copies."""
+        call = ("send_group", group_id, message, group_name)
+        radios = self._ready(call)
+        if radios is None:
+            return
+        try:
+            base_message_id = radios[0].prepare_message_id()
+            if self.history is not None:
+                self.history.record_sent(group_name or "group %d" % group_id, message)
+            frames = radios[0].group_frames(group_id, message, base_message_id)
+            for radio in radios:
+                self._submit(radio, FLOOD_FLOW, [(partial(radio._broadcast, frame), len(frame))
+                                                 for frame in frames], call)
+            METRICS.incr("groups.sent")
+        except Exception as error:
+            self.send_failed(None, call, error)
+
+    def list_devices(self) -> list:
+        """Return the node IDs seen by any live radio."""
+        seen = []
+        for radio in self.live_radios():
+            for node_id in radio.list_devices():
+                if node_id not in seen:
+                    seen.append(node_id)
+        return seen
+
+    def refresh(self) -> None:
+        for radio in self.radios:
+            radio.refresh()
@@ -0,0 +1,38 @@
+"""Where the XBee tools keep their state between sessions.
+
+Message history, the group and sender index tables and the port cache live
+in a per-user data directory rather than the current one: ``$XBEE_DATA_DIR``
+if set, else ``%LOCALAPPDATA%\\xbee`` on Windows,
+``~/Library/Application Support/xbee`` on macOS and
+``$XDG_DATA_HOME/xbee`` (``~/.local/share/xbee``) elsewhere.
+"""
+
+import os
+import sys
+
+APP_NAME = "xbee"
+
+
+def data_dir() -> str:
+    override = os.environ.get("XBEE_DATA_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, APP_NAME)
+
+
+def data_path(name: str) -> str:
+    """``name`` inside the data directory (which is created when written to)."""
+    return os.path.join(data_dir(), name)
+
+
+def make_parent(path: str) -> None:
+    """Create the directory ``path`` will be written to, if it is missing."""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
@@ -0,0 +1,228 @@
+"""Find the serial ports with an XBee on them and remember where they were.
+
+Every candidate port is probed in parallel with an API-mode ``AT NI``
+request (node identifier) at the likely baud rates; a port that answers
+with an ``AT Command Response`` frame has an XBee in API mode on it. The
+result is cached on disk under the adapter's USB identity
+(``VID:PID:serial``), so the next session probes only the cached baud rate
+first, even if the adapter came back under a different device path.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from xbee_paths import data_path, make_parent
+
+DEFAULT_CACHE = data_path("xbee_ports.json")
+# The stack's default first, then the XBee factory default and the fast one.
+BAUD_RATES = (57600, 9600, 115200, 230400)
+PROBE_TIMEOUT = 0.3
+
+_START = 0x7E
+_ESCAPE = 0x7D
+_ESCAPED = (0x7E, 0x7D, 0x11, 0x13)
+_AT_COMMAND = 0x08
+_AT_RESPONSE = 0x88
+# Chosen so the NI request needs no escaping and works in AP=1 and AP=2 alike.
+_PROBE_FRAME_ID = 0x52
+
+
+@dataclass
+class DetectedRadio:
+    port: str
+    baud: int
+    node_id: str
+    key: Optional[str] = None   # VID:PID:serial of the USB adapter, if it has one
+
+
+def port_key(port_info) -> Optional[str]:
+    """``VID:PID:serial`` of a ``ListPortInfo``, or None for non-USB ports."""
+    if port_info.vid is None:
+        return None
+    return "%04X:%04X:%s" % (port_info.vid, port_info.pid, port_info.serial_number or "")
+
+
+def at_request(command: str, frame_id: int = _PROBE_FRAME_ID, parameter: bytes = b"") -> bytes:
+    """An unescaped API frame for a local AT command."""
+    body = bytes([_AT_COMMAND, frame_id]) + command.encode("ascii") + bytes(parameter)
+    checksum = 0xFF - (sum(body) & 0xFF)
+    return bytes([_START, len(body) >> 8, len(body) & 0xFF]) + body + bytes([checksum])
+
+
+def clean_at_request(command: str, parameter: bytes = b"") -> Tuple[bytes, int]:
+    """An AT request and its frame ID, picked so that no byte needs escaping.
+
+    Such a frame reads the same to a radio in API mode 1 and 2.
+    """
+    for frame_id in range(_PROBE_FRAME_ID, _PROBE_FRAME_ID + 0x100):
+        frame = at_request(command, frame_id & 0xFF or 1, parameter)
+        if not any(byte in _ESCAPED for byte in frame[1:]):
+            return frame, frame_id & 0xFF or 1
+    raise ValueError("cannot encode %s %r without escaping" % (command, parameter))
+
+
+def parse_at_response(data: bytes, command: str,
+                      frame_id: int = _PROBE_FRAME_ID) -> Optional[bytes]:
+    """Parameter value of an OK ``AT Command Response`` frame in ``data``, if any.
+
+    Accepts escaped (AP=2) and unescaped (AP=1) frames and skips any
+    unrelated frames (e.g. modem status) before it.
+    """
+    unescaped = bytearray()
+    escape = False
+    for byte in data:
+        if escape:
+            unescaped.append(byte ^ 0x20)
+            escape = False
+        elif byte == _ESCAPE:
+            escape = True
+        else:
+            unescaped.append(byte)
+    start = unescaped.find(_START)
+    while start != -1 and start + 3 <= len(unescaped):
+        length = (unescaped[start + 1] << 8) | unescaped[start + 2]
+        body = unescaped[start + 3:start + 3 + length]
+        end = start + 3 + length
+        if end >= len(unescaped):
+            return None  # incomplete
+        if (sum(body) + unescaped[end]) & 0xFF == 0xFF and len(body) >= 5 \
+                and body[0] == _AT_RESPONSE and body[1] == frame_id \
+                and body[2:4] == command.encode("ascii") and body[4] == 0:
+            return bytes(body[5:])
+        start = unescaped.find(_START, start + 1)
+    return None
+
+
+def at_exchange(link, command: str, parameter: bytes = b"",
+                timeout: float = PROBE_TIMEOUT) -> Optional[bytes]:
+    """Send one AT command on an open ``serial.Serial``; its OK value or None."""
+    frame, frame_id = clean_at_request(command, parameter)
+    link.reset_input_buffer()
+    link.write(frame)
+    received = b""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        received += link.read(link.in_waiting or 1)
+        value = parse_at_response(received, command, frame_id)
+        if value is not None:
+            return value
+    return None
+
+
+def probe(port: str, baud: int, timeout: float = PROBE_TIMEOUT) -> Optional[str]:
+    """Node ID of the XBee answering on ``port`` at ``baud``, or None."""
+    import serial
+    try:
+        with serial.Serial(port, baud, timeout=0.05, write_timeout=timeout) as link:
+            value = at_exchange(link, "NI", timeout=timeout)
+            if value is not None:
+                return value.decode("ascii", "replace").strip()
+    except (serial.SerialException, OSError, ValueError):
+        pass
+    return None
+
+
+class PortDetector:
+    """Probes ports on a thread pool and keeps the results in ``cache_path``."""
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE, bauds=BAUD_RATES,
+                 timeout: float = PROBE_TIMEOUT, workers: int = 16) -> None:
+        self.cache_path = cache_path
+        self.bauds = tuple(bauds)
+        self.timeout = timeout
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.cache: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.cache_path) as cache:
+                return json.load(cache)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        try:
+            make_parent(self.cache_path)
+            with open(self.cache_path, "w") as cache:
+                json.dump(self.cache, cache, indent=1, sort_keys=True)
+        except OSError as error:
+            print("Could not write port cache:", str(error))
+
+    def _bauds_for(self, key: Optional[str]) -> List[int]:
+        cached = self.cache.get(key) if key else None
+        if cached is None:
+            return list(self.bauds)
+        return [cached["baud"]] + [baud for baud in self.bauds if baud != cached["baud"]]
+
+    def _probe_port(self, port_info) -> Optional[DetectedRadio]:
+        key = port_key(port_info)
+        for baud in self._bauds_for(key):
+            node_id = probe(port_info.device, baud, self.timeout)
+            if node_id is not None:
+                return DetectedRadio(port_info.device, baud, node_id, key)
+        return None
+
+    def detect(self, ports=None) -> List[DetectedRadio]:
+        """Probe ``ports`` (default: every serial port) in parallel.
+
+        Cached adapters are tried at their last baud rate first, so a known
+        radio costs one probe round.
+        """
+        if ports is None:
+            import serial.tools.list_ports
+            ports = serial.tools.list_ports.comports()
+        ports = list(ports)
+        if not ports:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(ports))) as pool:
+            found = [radio for radio in pool.map(self._probe_port, ports) if radio is not None]
+        with self._lock:
+            for radio in found:
+                if radio.key is not None:
+                    self.cache[radio.key] = {"port": radio.port, "baud": radio.baud,
+                                             "node_id": radio.node_id, "seen": time.time()}
+            if found:
+                self.save()
+        return found
+
+    def cached(self, ports=None) -> List[DetectedRadio]:
+        """Radios from the cache whose adapter is plugged in now, without probing."""
+        if ports is None:
+            import serial.tools.list_ports
+            ports = serial.tools.list_ports.comports()
+        radios = []
+        for port_info in ports:
+            key = port_key(port_info)
+            entry = self.cache.get(key) if key else None
+            if entry is not None:
+                radios.append(DetectedRadio(port_info.device, entry["baud"],
+                                            entry["node_id"], key))
+        return radios
+
+
+def detect_radios(cache_path: str = DEFAULT_CACHE) -> List[DetectedRadio]:
+    """Probe every serial port and return the XBee radios found."""
+    return PortDetector(cache_path).detect()
+
+
+def adapter_key(port: str) -> Optional[str]:
+    """``VID:PID:serial`` of the adapter behind ``port``, if it is a USB one."""
+    import serial.tools.list_ports
+    for port_info in serial.tools.list_ports.comports():
+        if port_info.device == port:
+            return port_key(port_info)
+    return None
+
+
+def find_adapter(key: str) -> Optional[str]:
+    """The device path the adapter ``key`` is plugged in under now, if any."""
+    import serial.tools.list_ports
+    for port_info in serial.tools.list_ports.comports():
+        if port_key(port_info) == key:
+            return port_info.device
+    return None
@@ -0,0 +1,217 @@
+"""Run the radio stack in a child process so it never waits on the GUI's GIL."""
+
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Optional
+
+from xbee_pubsub import MessageBus
+from xbee_queues import DROP_OLDEST, BoundedQueue
+from xbee_shm_ring import SharedRingBuffer
+
+RING_CAPACITY = 1 << 20
+IDLE_SLEEP = 0.001
+PUMP_TIMEOUT = 0.1
+DEVICES_INTERVAL = 0.5
+
+# Inbound records start with their kind: a reassembled message, a send the
+# child's Communicator accepted (for the history) or the device list
+INBOUND_MESSAGE = b"M"
+INBOUND_SENT = b"S"
+INBOUND_DEVICES = b"L"
+
+
+class _SentReport:
+    """Stands in for ``MessageHistory`` in the child: the Communicator records
+    only the sends it accepted, and those are passed on to the parent's history."""
+
+    def __init__(self, post) -> None:
+        self.post = post
+
+    def record_sent(self, node: Optional[str], text: str) -> None:
+        self.post(INBOUND_SENT, json.dumps([node, text]))
+
+
+def _radio_main(port: str, inbound_name: str, outbound_name: str, control,
+                baud_rate: Optional[int] = None) -> None:
+    """Child process: own the serial port and shuttle messages through the rings."""
+    from xbee_for_import import Communicator
+
+    inbound = SharedRingBuffer(inbound_name, create=False)
+    outbound = SharedRingBuffer(outbound_name, create=False)
+    communicator = Communicator()
+    stopping = threading.Event()
+    # The ring takes one producer; the pump, this loop and the scheduler share it
+    inbound_lock = threading.Lock()
+
+    def post(kind: bytes, body: str) -> None:
+        with inbound_lock:
+            inbound.put_wait(kind + body.encode("utf8"))
+
+    communicator.history = _SentReport(post)
+    communicator.connect(port, baud_rate)
+
+    def pump_inbound():
+        while not stopping.is_set():
+            try:
+                message = communicator.message_queue.get(timeout=PUMP_TIMEOUT)
+            except queue.Empty:
+                continue
+            post(INBOUND_MESSAGE, message)
+
+    pump = threading.Thread(target=pump_inbound, daemon=True)
+    pump.start()
+
+    devices = None
+    next_devices = 0.0
+    try:
+        while True:
+            idle = True
+            record = outbound.get()
+            if record is not None:
+                idle = False
+                command = json.loads(record)
+                if command["op"] == "send":
+                    communicator.send(command["msg"], command.get("class"))
+                elif command["op"] == "send_single":
+                    communicator.send_single(command["to"], command["msg"], command.get("class"))
+                elif command["op"] == "send_group":
+                    communicator.send_group(command["group"], command["msg"], command.get("name"))
+            if time.monotonic() >= next_devices:
+                next_devices = time.monotonic() + DEVICES_INTERVAL
+                current = communicator.list_devices()
+                if current != devices:
+                    devices = current
+                    post(INBOUND_DEVICES, json.dumps(devices))
+            if control.poll():
+                idle = False
+                request = control.recv()
+                if request == "refresh":
+                    communicator.refresh()
+                elif request == "stop":
+                    break
+            if idle:
+                time.sleep(IDLE_SLEEP)
+    finally:
+        stopping.set()
+        pump.join()
+        if communicator.device is not None and communicator.device.is_open():
+            communicator.device.close()
+        inbound.close()
+        outbound.close()
+
+
+class ProcessCommunicator:
+    """Same API as ``Communicator``, with the radio in a separate process.
+
+    Inbound messages and outbound commands cross the process boundary in
+    shared-memory ring buffers; a pipe carries the rare control requests
+    (refresh, stop). The child reports its device list whenever it changes
+    and every send it accepted, so ``list_devices`` never waits on it and
+    the history only holds messages that were actually sent.
+    """
+
+    def __init__(self) -> None:
+        self.message_queue = BoundedQueue(1000, DROP_OLDEST, name="reassembled")
+        self.bus = MessageBus()
+        self.process: Optional[multiprocessing.Process] = None
+        self.inbound: Optional[SharedRingBuffer] = None
+        self.outbound: Optional[SharedRingBuffer] = None
+        self.control = None
+        self.control_lock = threading.Lock()
+        self.devices: list = []
+        self.pump: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.outbound_lock = threading.Lock()
+        self.history = None
+
+    @property
+    def device(self):
+        """Truthy while the radio process is running."""
+        return self.process if self.process and self.process.is_alive() else None
+
+    def connect(self, device_name: str, baud_rate: Optional[int] = None) -> None:
+        """Start the radio process on ``device_name``; ``baud_rate`` as for
+        ``Communicator.connect`` (None: detect it)."""
+        if self.process is not None:
+            print("Device already connected")
+            return
+
+        self.inbound = SharedRingBuffer(capacity=RING_CAPACITY)
+        self.outbound = SharedRingBuffer(capacity=RING_CAPACITY)
+        self.control, child_control = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_radio_main,
+            args=(device_name, self.inbound.name, self.outbound.name, child_control, baud_rate),
+            daemon=True,
+        )
+        self.stopping.clear()
+        self.process.start()
+        self.pump = threading.Thread(target=self._pump_inbound, daemon=True)
+        self.pump.start()
+
+    def _pump_inbound(self) -> None:
+        while not self.stopping.is_set() and self.process.is_alive():
+            record = self.inbound.get()
+            if record is None:
+                time.sleep(IDLE_SLEEP)
+                continue
+            kind, body = record[:1], record[1:].decode("utf8")
+            if kind == INBOUND_DEVICES:
+                self.devices = json.loads(body)
+            elif kind == INBOUND_SENT:
+                if self.history is not None:
+                    node, text = json.loads(body)
+                    self.history.record_sent(node, text)
+            else:
+                self.message_queue.put(body)
+                data = json.loads(body)
+                self.bus.publish(data["msg"], data)
+
+    def _submit(self, command: dict) -> None:
+        if self.device is None:
+            print("No device connected")
+            return
+        with self.outbound_lock:
+            if not self.outbound.put_wait(json.dumps(command).encode("utf8")):
+                print("Send error: radio process is not keeping up")
+
+    def send(self, message: str, traffic_class: Optional[str] = None) -> None:
+        self._submit({"op": "send", "msg": message, "class": traffic_class})
+
+    def send_single(self, remote_address: str, message: str,
+                    traffic_class: Optional[str] = None) -> None:
+        self._submit({"op": "send_single", "to": remote_address, "msg": message,
+                      "class": traffic_class})
+
+    def send_group(self, group_id: int, message: str, group_name: Optional[str] = None) -> None:
+        self._submit({"op": "send_group", "group": group_id, "msg": message, "name": group_name})
+
+    def _request(self, request: str) -> None:
+        if self.device is None:
+            return
+        with self.control_lock:
+            self.control.send(request)
+
+    def list_devices(self) -> list:
+        """The device list as last reported by the radio process."""
+        return list(self.devices)
+
+    def refresh(self) -> None:
+        self._request("refresh")
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        self._request("stop")
+        self.process.join(timeout=2.0)
+        # Stop the pump before the ring it reads is closed under it
+        self.stopping.set()
+        self.pump.join()
+        self.process = None
+        self.devices = []
+        self.control.close()
+        self.inbound.close()
+        self.outbound.close()
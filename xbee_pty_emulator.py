@@ -0,0 +1,151 @@
+"""An XBee in API mode behind a pseudo-terminal, for serial-level testing.
+
+``PtyRadio`` opens a pty and answers on its master side like a local
+radio would on its UART: AT commands (``NI``, ``BD``, ``AC``, ``AP`` and a
+few identification registers) and transmit requests, which get a
+successful ``Transmit Status``. Point pyserial (or ``xbee_port_detect`` /
+``xbee_baud``) at ``radio.port``.
+
+The emulator takes the host's line speed from the pty's termios settings:
+bytes sent at a rate other than the radio's ``BD`` are dropped, as a real
+UART would garble them, and every frame in either direction takes as long
+as it would on a wire at that rate (10 bits per byte). POSIX only.
+"""
+
+import os
+import termios
+import threading
+import time
+import tty
+from typing import Dict, Optional
+
+from xbee_baud import BD_CODES
+
+_SPEEDS = {getattr(termios, "B%d" % rate): rate for rate in BD_CODES
+           if hasattr(termios, "B%d" % rate)}
+_RATES = {code: rate for rate, code in BD_CODES.items()}
+
+_START = 0x7E
+_ESCAPE = 0x7D
+_ESCAPED = (0x7E, 0x7D, 0x11, 0x13)
+
+
+def _frame(body: bytes, escaped: bool) -> bytes:
+    raw = bytes([len(body) >> 8, len(body) & 0xFF]) + body + bytes([0xFF - (sum(body) & 0xFF)])
+    if escaped:
+        raw = b"".join(bytes([_ESCAPE, byte ^ 0x20]) if byte in _ESCAPED else bytes([byte])
+                       for byte in raw)
+    return bytes([_START]) + raw
+
+
+class PtyRadio:
+    def __init__(self, node_id: str = "EMU", baud: int = 9600, api_mode: int = 1,
+                 address: int = 0x0013A20040000001) -> None:
+        self.node_id = node_id
+        self.baud = baud
+        self.api_mode = api_mode
+        self.registers: Dict[str, bytes] = {
+            "SH": (address >> 32).to_bytes(4, "big"),
+            "SL": (address & 0xFFFFFFFF).to_bytes(4, "big"),
+            "MY": b"\xff\xfe",
+            "HV": b"\x1e\x46",
+            "VR": b"\x90\x0b",
+        }
+        self._pending_bd: Optional[int] = None
+        self.frames_in = 0
+        self.frames_out = 0
+        self.garbled = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def close(self) -> None:
+        self._closed = True
+        os.close(self._slave)
+        os.close(self._master)
+
+    def _host_rate(self) -> Optional[int]:
+        return _SPEEDS.get(termios.tcgetattr(self._master)[5])
+
+    def _wire(self, length: int) -> None:
+        time.sleep(length * 10.0 / self.baud)
+
+    def _send(self, body: bytes) -> None:
+        frame = _frame(body, self.api_mode == 2)
+        self._wire(len(frame))
+        os.write(self._master, frame)
+        self.frames_out += 1
+
+    def _run(self) -> None:
+        buffer = bytearray()
+        while not self._closed:
+            try:
+                chunk = os.read(self._master, 4096)
+            except OSError:
+                return
+            if self._host_rate() != self.baud:
+                self.garbled += len(chunk)
+                continue
+            self._wire(len(chunk))
+            buffer += chunk
+            for body in self._frames(buffer):
+                self.frames_in += 1
+                self._handle(body)
+
+    def _frames(self, buffer: bytearray):
+        """Pop complete, valid frame bodies off the front of ``buffer``."""
+        while True:
+            start = buffer.find(_START)
+            if start < 0:
+                buffer.clear()
+                return
+            del buffer[:start]
+            data = bytearray()
+            index = 1
+            escape = False
+            while index < len(buffer) and (len(data) < 2 or len(data) < 3 + (data[0] << 8 | data[1])):
+                byte = buffer[index]
+                index += 1
+                if self.api_mode == 2 and byte == _ESCAPE:
+                    escape = True
+                    continue
+                data.append(byte ^ 0x20 if escape else byte)
+                escape = False
+            if len(data) < 3 or len(data) < 3 + (data[0] << 8 | data[1]):
+                return  # incomplete
+            del buffer[:index]
+            body = bytes(data[2:-1])
+            if (sum(body) + data[-1]) & 0xFF == 0xFF:
+                yield body
+
+    def _handle(self, body: bytes) -> None:
+        if body[0] == 0x08 and len(body) >= 4:
+            frame_id, command, parameter = body[1], body[2:4].decode("ascii", "replace"), body[4:]
+            status, value, after = 0, b"", None
+            if command == "NI":
+                value = self.node_id.encode("ascii")
+            elif command == "AP":
+                value = bytes([self.api_mode])
+            elif command == "BD":
+                if parameter:
+                    if parameter[-1] in _RATES:
+                        self._pending_bd = _RATES[parameter[-1]]
+                    else:
+                        status = 3  # invalid parameter
+                else:
+                    value = bytes([BD_CODES[self.baud]])
+            elif command == "AC":
+                after = self._pending_bd
+                self._pending_bd = None
+            elif command in self.registers:
+                value = self.registers[command]
+            if frame_id:
+                self._send(bytes([0x88, frame_id]) + body[2:4] + bytes([status]) + value)
+            if after is not None:
+                self.baud = after
+        elif body[0] == 0x10 and len(body) >= 14:
+            # Transmit request: report it delivered on the first try
+            if body[1]:
+                self._send(bytes([0x8B, body[1], 0xFF, 0xFE, 0, 0, 0]))
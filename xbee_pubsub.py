@@ -0,0 +1,155 @@
+"""Topic and prefix based fan-out of reassembled messages to independent consumers."""
+
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from xbee_queues import DROP_OLDEST, BoundedQueue
+
+# The topic of a message is its first token: "BATT 12.3V" -> "BATT",
+# "move,1500,..." -> "move", "BATTERY_STATUS: Error" -> "BATTERY_STATUS".
+_TOPIC = re.compile(r"[^\s,:]*")
+
+
+def message_topic(text: str) -> str:
+    return _TOPIC.match(text).group()
+
+
+class Subscription:
+    """One consumer's bounded queue with an optional token-bucket rate limit.
+
+    By default the oldest message is discarded when the queue is full, so a
+    stalled consumer loses history instead of holding up the publisher or
+    the other consumers. ``policy`` picks another ``xbee_queues`` policy,
+    e.g. ``coalesce`` with a ``key`` to keep only the latest message per
+    key, or ``block`` to push back on the publisher.
+
+    ``offer`` is called from every receive worker at once, so the token
+    bucket, the enqueue and the counters are updated under one lock.
+    """
+
+    def __init__(self, prefixes: List[str], topics: List[str], maxsize: int,
+                 rate: Optional[float], burst: Optional[int], policy: str = DROP_OLDEST,
+                 key: Optional[Callable[[Any], Any]] = None) -> None:
+        self.prefixes = prefixes
+        self.topics = topics
+        self.queue = BoundedQueue(maxsize, policy, key, name="delivery")
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self.delivered = 0
+        self.dropped_rate = 0
+        self._lock = threading.Lock()
+
+    @property
+    def dropped_full(self) -> int:
+        return self.queue.dropped
+
+    def _take_token(self) -> bool:
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def offer(self, message) -> None:
+        with self._lock:
+            if not self._take_token():
+                self.dropped_rate += 1
+                return
+            if self.queue.put(message):
+                self.delivered += 1
+
+    def get(self, timeout: Optional[float] = None):
+        """Next message; raises ``queue.Empty`` after ``timeout`` seconds."""
+        return self.queue.get(timeout=timeout)
+
+
+class MessageBus:
+    """Dispatches each message to the subscriptions whose prefix or topic matches.
+
+    Prefixes are compiled into a character trie, so routing a message costs
+    one walk over at most the longest subscribed prefix regardless of how
+    many consumers there are; topics are a single dict lookup. The index is
+    rebuilt on (un)subscribe and swapped in whole, so ``publish`` takes no
+    lock.
+    """
+
+    def __init__(self) -> None:
+        self._subscriptions: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._trie: Dict = {}
+        self._topics: Dict[str, List[Subscription]] = {}
+
+    def subscribe(self, prefixes: Union[str, Iterable[str]] = (),
+                  topics: Union[str, Iterable[str]] = (), maxsize: int = 100,
+                  rate: Optional[float] = None,
+                  burst: Optional[int] = None, policy: str = DROP_OLDEST,
+                  key: Optional[Callable[[Any], Any]] = None) -> Subscription:
+        """Subscribe to messages starting with any of ``prefixes`` or whose
+        first token is one of ``topics``. ``prefixes=""`` matches everything.
+        ``policy`` and ``key`` choose what happens when the queue is full.
+        """
+        prefixes = [prefixes] if isinstance(prefixes, str) else list(prefixes)
+        topics = [topics] if isinstance(topics, str) else list(topics)
+        subscription = Subscription(prefixes, topics, maxsize, rate, burst, policy, key)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._compile()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                self._compile()
+
+    def _compile(self) -> None:
+        trie: Dict = {}
+        topics: Dict[str, List[Subscription]] = {}
+        for subscription in self._subscriptions:
+            for prefix in subscription.prefixes:
+                node = trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(subscription)
+            for topic in subscription.topics:
+                topics.setdefault(topic, []).append(subscription)
+        self._trie, self._topics = trie, topics
+
+    def publish(self, text: str, message=None) -> int:
+        """Deliver ``message`` (default: ``text``) to every matching subscription.
+
+        Returns the number of subscriptions it was offered to.
+        """
+        if message is None:
+            message = text
+        node = self._trie
+        matched = list(node.get(None, ()))
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            matched.extend(node.get(None, ()))
+        matched.extend(self._topics.get(message_topic(text), ()))
+        delivered = set()
+        for subscription in matched:
+            if id(subscription) not in delivered:
+                delivered.add(id(subscription))
+                subscription.offer(message)
+        return len(delivered)
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        return [{"prefixes": s.prefixes, "topics": s.topics,
+                 "queued": s.queue.qsize(), "delivered": s.delivered,
+                 "dropped_full": s.dropped_full, "dropped_rate": s.dropped_rate,
+                 "coalesced": s.queue.coalesced}
+                for s in subscriptions]
@@ -0,0 +1,186 @@
+"""Bounded queues with an explicit overflow policy.
+
+Every queue between two stages of the pipeline (radio reader -> receive
+workers, reassembled messages, outbound messages, bus subscribers) is a
+``BoundedQueue`` with a capacity and one of these policies for a put that
+finds it full:
+
+``block``
+    wait for room (``put(timeout=...)`` raises ``queue.Full`` on timeout);
+``drop_oldest``
+    discard the head to make room: consumers see the most recent items;
+``drop_newest``
+    discard the item being put: consumers see the oldest items;
+``coalesce``
+    replace the queued item with the same ``key(item)`` in place, so at
+    most one item per key waits; a new key in a full queue drops the oldest.
+
+Each queue counts puts, drops, coalesced items and blocked puts under
+``queue.<name>.*`` in ``xbee_metrics.METRICS``, plus a high-water mark.
+The interface is the subset of ``queue.Queue`` the code base uses, so a
+``BoundedQueue`` can stand in for one.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from xbee_metrics import METRICS, Metrics
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+@dataclass
+class QueueSpec:
+    """Capacity and overflow policy of one queue, e.g. in ``Communicator(queues=...)``."""
+    capacity: int
+    policy: str = DROP_OLDEST
+    key: Optional[Callable[[Any], Any]] = None
+
+
+class BoundedQueue:
+    def __init__(self, capacity: int, policy: str = DROP_OLDEST,
+                 key: Optional[Callable[[Any], Any]] = None, name: str = "queue",
+                 metrics: Metrics = METRICS) -> None:
+        if policy not in POLICIES:
+            raise ValueError("unknown queue policy: %s" % policy)
+        if policy == COALESCE and key is None:
+            raise ValueError("the coalesce policy needs a key function")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.policy = policy
+        self.key = key
+        self.name = name
+        self.metrics = metrics
+        self._items: deque = deque()
+        self._cells: Dict[Any, list] = {}  # coalesce: key -> [key, item] in _items
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0
+        self.puts = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self._prefix = "queue.%s." % name
+
+    @classmethod
+    def from_spec(cls, spec: QueueSpec, name: str, metrics: Metrics = METRICS) -> "BoundedQueue":
+        return cls(spec.capacity, spec.policy, spec.key, name, metrics)
+
+    def _count(self, what: str) -> None:
+        setattr(self, what, getattr(self, what) + 1)
+        self.metrics.incr(self._prefix + what)
+
+    def _pop(self):
+        item = self._items.popleft()
+        if self.policy == COALESCE:
+            key, value = item
+            if self._cells.get(key) is item:
+                del self._cells[key]
+            return value
+        return item
+
+    def _append(self, item) -> None:
+        if self.policy == COALESCE:
+            cell = [self.key(item), item]
+            self._cells[cell[0]] = cell
+            item = cell
+        self._items.append(item)
+        self._unfinished += 1
+        self._not_empty.notify()
+
+    def put(self, item, block: bool = True, timeout: Optional[float] = None) -> bool:
+        """Queue ``item`` under the policy; False if it was dropped.
+
+        ``block`` and ``timeout`` only matter for the ``block`` policy.
+        """
+        with self._lock:
+            self._count("puts")
+            if self.policy == COALESCE:
+                cell = self._cells.get(self.key(item))
+                if cell is not None:
+                    cell[1] = item
+                    self._count("coalesced")
+                    return True
+            if len(self._items) >= self.capacity:
+                if self.policy == DROP_NEWEST:
+                    self._count("dropped")
+                    return False
+                if self.policy == BLOCK:
+                    if not block:
+                        raise queue.Full
+                    self._count("blocked")
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    while len(self._items) >= self.capacity:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise queue.Full
+                        self._not_full.wait(remaining)
+                else:
+                    self._pop()
+                    self._unfinished -= 1
+                    self._count("dropped")
+                    if not self._unfinished:
+                        self._all_done.notify_all()
+            self._append(item)
+            self.metrics.max_gauge(self._prefix + "high_water", len(self._items))
+            return True
+
+    def put_nowait(self, item) -> bool:
+        return self.put(item, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        """Next item; raises ``queue.Empty`` if none arrives within ``timeout``."""
+        with self._lock:
+            if not block and not self._items:
+                raise queue.Empty
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._not_empty.wait(remaining)
+            item = self._pop()
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self) -> None:
+        with self._lock:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._all_done.notify_all()
+
+    def join(self) -> None:
+        """Wait until every item put (and not dropped) has been marked done."""
+        with self._lock:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return self.qsize() >= self.capacity
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._items), "capacity": self.capacity, "puts": self.puts,
+                    "dropped": self.dropped, "coalesced": self.coalesced, "blocked": self.blocked}
@@ -1,14 +1,19 @@
 import time
 import threading
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from digi.xbee.devices import DigiMeshDevice, NetworkEventReason
 from digi.xbee.models.status import NetworkDiscoveryStatus
 import secrets
 import string
 import json
 import serial
-import queue
 from datetime import datetime
 import logging
+from xbee_history import DEFAULT_DIR as HISTORY_DIR, MessageHistory, format_record
+from xbee_metrics import METRICS
+from xbee_queues import DROP_OLDEST, BoundedQueue
 
 SEPARATOR = "\x1F" 
 logging.basicConfig(level=logging.DEBUG)
@@ -24,7 +29,8 @@ class Communicator:
         self.devices_to_send = {}
         self.timer_flag = False
         self.message_parts = {}
-        self.message_queue = queue.Queue()
+        self.message_queue = BoundedQueue(1000, DROP_OLDEST, name="reassembled")
+        self.history = None
 
     # Генерація ідентифікатора
     def generate_message_id(self):
@@ -117,14 +123,18 @@ class Communicator:
 
                 print(f"Full message: {full_message}")
                 print(f"LEN MESSAGE: {len(full_message)} | Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.{str(datetime.now().microsecond)[:3]}")
-                print(f"Fisrt sender: {self.message_parts[base_message_id]["first_sender"]}")
+                print(f"Fisrt sender: {self.message_parts[base_message_id]['first_sender']}")
 
-                # Помещаем в очередь для дальнейшей обработки
-                self.message_queue.put({
+                full_message_json = {
                     "first": self.message_parts[base_message_id]["first_sender"],
                     "from": source_device.get_node_id(),
                     "msg": full_message
-                })
+                }
+
+                # Помещаем в очередь для дальнейшей обработки
+                self.message_queue.put(full_message_json)
+                if self.history is not None:
+                    self.history.record_received(full_message_json)
 
                 # Теперь удаляем ID, так как сообщение собрано и обработано
                 del self.message_parts[base_message_id]
@@ -204,8 +214,17 @@ class Communicator:
         
         #port = "/dev/cu.usbserial-" + device_name
         port = "" + device_name
-        print("Try connect to: %s" % port)
-        self.device = DigiMeshDevice(port, 57600)
+        # connect PORT [BAUD | fast]: без скорости она определяется автоматически,
+        # fast - поднять скорость порта до максимальной надежной
+        from xbee_baud import detect_baud, negotiate_baud
+        if len(params) > 1 and params[1] == "fast":
+            baud_rate = negotiate_baud(port) or 57600
+        elif len(params) > 1:
+            baud_rate = int(params[1])
+        else:
+            baud_rate = detect_baud(port) or 57600
+        print("Try connect to: %s at %d baud" % (port, baud_rate))
+        self.device = DigiMeshDevice(port, baud_rate)
 
         try:
             self.device.open()
@@ -241,6 +260,8 @@ class Communicator:
             remote_devices = self.current_discovered_devices
             base_message_id = self.generate_message_id()  # Базовый ID сообщения
             self.received_message_ids.add(base_message_id)
+            if self.history is not None:
+                self.history.record_sent(None, message)
 
             # Разделение сообщения на части по 10 символа
             message_parts = [message[i:i+10] for i in range(0, len(message), 10)]
@@ -310,6 +331,9 @@ class Communicator:
                 print("Device not found with address: %s" % remote_address)
                 return
 
+            if self.history is not None:
+                self.history.record_sent(remote_address, message)
+
             # Отправка каждой части сообщения
             for part_num, message_part in enumerate(message_parts, start=1):
                 # Формируем уникальный ID для каждой части сообщения
@@ -345,15 +369,41 @@ class Communicator:
     def handle_refresh(self, params):
         self.timer_flag = True
 
+    #Команда history [minutes] [node]
+    def handle_history(self, params):
+        if self.history is None:
+            print("Error, history is not enabled")
+            return
+        try:
+            minutes = float(params[0]) if params else 10.0
+        except ValueError:
+            print("Error, history [minutes] [node]")
+            return
+        node = params[1] if len(params) > 1 else None
+        for record in self.history.last_minutes(minutes, node):
+            print(format_record(record))
+
+    #Команда metrics [prefix]: лічильники черг (queue.<name>.dropped тощо)
+    def handle_metrics(self, params):
+        for name, value in METRICS.snapshot(params[0] if params else "").items():
+            print(f"{name}: {value}")
+
 class CommunicatorCommandProcessor:
-    def __init__(self):
+    def __init__(self, history=True):
         self.commands = {}
         self.communicator = Communicator()
+        if history:
+            self.communicator.history = MessageHistory()
         self.commands["connect"] = self.communicator.handle_connect
         self.commands["send"] = self.communicator.handle_send
         self.commands["send_single"] = self.communicator.handle_send_single
         self.commands["list"] = self.communicator.handle_list
         self.commands["refresh"] = self.communicator.handle_refresh
+        self.commands["history"] = self.communicator.handle_history
+        self.commands["metrics"] = self.communicator.handle_metrics
+        # Communicator консолі не потокобезпечний: команди, що працюють з радіомодулем,
+        # виконуються по одній навіть при --pipeline > 1
+        self.radio_lock = threading.Lock()
 
     def process_command(self, input_text):
         parts = input_text.split()
@@ -363,13 +413,162 @@ class CommunicatorCommandProcessor:
         command = parts[0]
         params = parts[1:]
 
-        if command in self.commands:
+        if command in RADIO_COMMANDS:
+            with self.radio_lock:
+                self.commands[command](params)
+        elif command in self.commands:
             self.commands[command](params)
         else:
             print(f"Unknown command: {command}")
 
+# Команди, що звертаються до радіомодуля або його стану
+RADIO_COMMANDS = ("connect", "send", "send_single", "list", "refresh")
+
+# Початок рядків, якими команди повідомляють про помилку
+ERROR_PREFIXES = ("Error, ", "No send params ", "No send param ", "Connection error: ",
+                  "Send error: ", "Device not found with address: ", "Unknown command: ")
+
+class ThreadOutput:
+    """sys.stdout replacement: each batch command's prints go to its own buffer.
+
+    Output of threads that are not running a command (discovery, received
+    messages) goes to ``fallback`` so it never mixes with the JSON results.
+    """
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.fallback.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self.fallback.flush()
+
+class BatchRunner:
+    """Runs a command script and prints one JSON line per command.
+
+    Besides console commands a script may contain:
+        # comment
+        @sleep SECONDS   - pause before the next command
+        @at SECONDS      - start the next command SECONDS after the script began
+        @wait            - wait until every command in flight has finished
+    Up to ``pipeline`` commands run at once; with the default of 1 they run
+    strictly in order.
+    """
+    def __init__(self, processor, pipeline=1, out=None):
+        self.processor = processor
+        self.pipeline = max(1, pipeline)
+        self.out = out or sys.stdout
+        self.output = ThreadOutput(sys.stderr)
+        self.emit_lock = threading.Lock()
+        self.failed = 0
+        self.start = 0.0
+
+    def emit(self, result):
+        with self.emit_lock:
+            if result.get("ok") is False:
+                self.failed += 1
+            self.out.write(json.dumps(result) + "\n")
+            self.out.flush()
+
+    def execute(self, line_number, command_text):
+        buffer = []
+        self.output.local.buffer = buffer
+        started = time.monotonic()
+        error = None
+        try:
+            self.processor.process_command(command_text)
+        except Exception as e:
+            error = str(e)
+        finally:
+            self.output.local.buffer = None
+        finished = time.monotonic()
+
+        lines = [line for line in "".join(buffer).splitlines() if line]
+        if error is None:
+            error = next((line for line in lines if line.startswith(ERROR_PREFIXES)), None)
+        result = {
+            "line": line_number,
+            "command": command_text,
+            "ok": error is None,
+            "start_s": round(started - self.start, 6),
+            "duration_ms": round((finished - started) * 1000, 3),
+            "output": lines,
+        }
+        if error is not None:
+            result["error"] = error
+        self.emit(result)
+
+    def run(self, lines):
+        self.start = time.monotonic()
+        in_flight = set()
+        commands = 0
+        real_stdout, sys.stdout = sys.stdout, self.output
+        try:
+            with ThreadPoolExecutor(max_workers=self.pipeline) as executor:
+                for line_number, line in enumerate(lines, start=1):
+                    text = line.strip()
+                    if not text or text.startswith("#"):
+                        continue
+                    if text.startswith("@"):
+                        self.directive(line_number, text, in_flight)
+                        continue
+                    while len(in_flight) >= self.pipeline:
+                        _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    in_flight.add(executor.submit(self.execute, line_number, text))
+                    commands += 1
+                wait(in_flight)
+        finally:
+            sys.stdout = real_stdout
+        elapsed = time.monotonic() - self.start
+        self.emit({
+            "summary": True,
+            "commands": commands,
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 6),
+            "commands_per_s": round(commands / elapsed, 3) if elapsed > 0 else None,
+        })
+        return self.failed == 0
+
+    def directive(self, line_number, text, in_flight):
+        parts = text.split()
+        try:
+            if parts[0] == "@sleep":
+                time.sleep(float(parts[1]))
+            elif parts[0] == "@at":
+                delay = self.start + float(parts[1]) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            elif parts[0] == "@wait":
+                wait(in_flight)
+            else:
+                raise ValueError("unknown directive %s" % parts[0])
+        except (IndexError, ValueError) as e:
+            self.emit({"line": line_number, "command": text, "ok": False, "error": str(e)})
+
 if __name__ == "__main__":
-    processor = CommunicatorCommandProcessor()
+    parser = argparse.ArgumentParser(description="XBee console")
+    parser.add_argument("--script", help="run commands from a file ('-' for stdin) and exit")
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="commands allowed in flight at once in script mode")
+    parser.add_argument("--no-history", action="store_true",
+                        help="do not record messages in %s" % HISTORY_DIR)
+    args = parser.parse_args()
+
+    processor = CommunicatorCommandProcessor(history=not args.no_history)
+
+    # Скрипт из файла или из конвейера stdin: выполняем и выходим
+    if args.script or not sys.stdin.isatty():
+        if args.script and args.script != "-":
+            with open(args.script, encoding="utf8") as script:
+                ok = BatchRunner(processor, args.pipeline).run(script)
+        else:
+            ok = BatchRunner(processor, args.pipeline).run(sys.stdin)
+        sys.exit(0 if ok else 1)
 
     while True:
         user_input = input("Input command: ")
@@ -1,16 +1,13 @@
 import sys
-import json
 import threading
 import queue
 import time
-import serial.tools.list_ports
 import logging
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
     QPushButton, QLineEdit, QTextEdit, QLabel, QGroupBox
 )
-from PySide6.QtCore import Qt, Signal, QObject
-from xbee_for_import import Communicator
+from PySide6.QtCore import Qt, Signal, QObject, QTimer
 import os
 import platform
 try:
@@ -44,20 +41,93 @@ def cross_platform_beep(frequency=1000, duration=100):
         # Final fallback - ASCII bell
         print('\a', end='', flush=True)
 
+def serial_port_lines():
+    """Describe the available serial ports, one output line per port."""
+    import serial.tools.list_ports
+    ports = serial.tools.list_ports.comports()
+    if not ports:
+        return ["No serial ports available"]
+    return ["Available serial ports:"] + [
+        f"- Port: {port.device}\n  Description: {port.description}" for port in ports]
+
 class CommunicatorSignals(QObject):
     message_received = Signal(str)
+    battery_received = Signal(object)
+    alive_received = Signal(str)
+    liveness_changed = Signal(str, str)
+    backend_loaded = Signal(list)
+    radios_detected = Signal(list, str)
 
 class XBeeGUIPySide(QMainWindow):
-    def __init__(self):
+    def __init__(self, radio_process=False):
         super().__init__()
         self.setWindowTitle("XBee Communicator")
-        self.communicator = Communicator()
+        self.radio_process = radio_process
+        self._communicator = None
+        self.backend_ready = threading.Event()
         self.setup_logging()
         self.signals = CommunicatorSignals()
         self.signals.message_received.connect(self.handle_received_message)
+        self.signals.battery_received.connect(self.handle_battery_message)
+        self.signals.alive_received.connect(self.handle_alive_message)
+        self.signals.liveness_changed.connect(self.handle_liveness_change)
+        self.signals.backend_loaded.connect(self.handle_backend_loaded)
+        self.signals.radios_detected.connect(self.handle_radios_detected)
+        self.detected_bauds = {}
+        self.subscriptions = []
+        self.telemetry = None
+        self.history = None
         self.init_ui()
         self.logger.info("XBee Communicator started")
-        self.start_message_receiver()
+        # Fires on the first event loop pass, after the window is shown
+        QTimer.singleShot(0, lambda: threading.Thread(target=self.load_backend, daemon=True).start())
+
+    @property
+    def communicator(self):
+        """The radio link; waits for load_backend if it has not finished yet."""
+        self.backend_ready.wait()
+        return self._communicator
+
+    @communicator.setter
+    def communicator(self, communicator):
+        self._communicator = communicator
+
+    def load_backend(self):
+        """Thread target: import the radio stack, build the communicator and list ports.
+
+        digi.xbee, numpy and pyserial take longer to import than the whole
+        window takes to draw, so none of it happens before the window is up.
+        """
+        try:
+            from xbee_history import MessageHistory
+            from xbee_telemetry import TelemetryStore
+            self.telemetry = TelemetryStore()
+            self.history = MessageHistory()
+            if self.radio_process:
+                # In radio-process mode the serial I/O runs outside this interpreter's GIL
+                from xbee_process_radio import ProcessCommunicator
+                self._communicator = ProcessCommunicator()
+            else:
+                from xbee_for_import import Communicator
+                self._communicator = Communicator()
+        except Exception as e:
+            self.signals.backend_loaded.emit([f"Error loading radio stack: {str(e)}"])
+            return
+        finally:
+            self.backend_ready.set()
+        self.signals.backend_loaded.emit(serial_port_lines())
+        # Radios found in an earlier session, if their adapters are plugged in
+        from xbee_port_detect import PortDetector
+        cached = PortDetector().cached()
+        if cached:
+            self.signals.radios_detected.emit(cached, "Known XBee radios:")
+
+    def handle_backend_loaded(self, lines):
+        """Start the receivers once the communicator exists and show the ports."""
+        if self._communicator is not None:
+            self.start_message_receiver()
+        for line in lines:
+            self.append_output(line)
 
     def setup_logging(self):
         """Setup logging configuration to write to log directory."""
@@ -90,6 +160,9 @@ class XBeeGUIPySide(QMainWindow):
         self.connect_btn = QPushButton("Connect to Device")
         self.connect_btn.clicked.connect(self.connect_device)
         conn_layout.addWidget(self.connect_btn)
+        self.detect_btn = QPushButton("Detect")
+        self.detect_btn.clicked.connect(self.detect_ports)
+        conn_layout.addWidget(self.detect_btn)
         self.list_ports_btn = QPushButton("Ports")
         self.list_ports_btn.clicked.connect(self.list_serial_ports)
         conn_layout.addWidget(self.list_ports_btn)
@@ -189,6 +262,20 @@ class XBeeGUIPySide(QMainWindow):
         add_layout.addWidget(self.battery_status_btn, 1, 2)
         add_group.setLayout(add_layout)
         left_layout.addWidget(add_group)
+        # Message history
+        history_group = QGroupBox("History")
+        history_layout = QHBoxLayout()
+        self.history_node_entry = QLineEdit()
+        self.history_node_entry.setPlaceholderText("Node (all)")
+        history_layout.addWidget(self.history_node_entry)
+        self.history_minutes_entry = QLineEdit("10")
+        history_layout.addWidget(QLabel("Minutes:"))
+        history_layout.addWidget(self.history_minutes_entry)
+        self.history_btn = QPushButton("Show History")
+        self.history_btn.clicked.connect(self.show_history)
+        history_layout.addWidget(self.history_btn)
+        history_group.setLayout(history_layout)
+        left_layout.addWidget(history_group)
         # Add stretch
         left_layout.addStretch(1)
         # Output area
@@ -206,7 +293,22 @@ class XBeeGUIPySide(QMainWindow):
         try:
             if port:
                 self.logger.info(f"Attempting to connect to device on port: {port}")
-                self.communicator.connect(port)
+                if port.startswith("daemon:"):
+                    # Share a radio owned by xbee_daemon.py, e.g. "daemon:/tmp/xbee-daemon.sock"
+                    from xbee_daemon import DaemonClient
+                    self.communicator = DaemonClient()
+                    self.start_message_receiver()
+                    port = port[len("daemon:"):]
+                elif "," in port:
+                    # Several ports, e.g. "COM3,COM4": drive them as one multi-radio link
+                    from xbee_multi_radio import MultiRadioCommunicator
+                    self.communicator = MultiRadioCommunicator()
+                    self.start_message_receiver()
+                if port in self.detected_bauds:
+                    # Found by Detect: open it at the baud rate it answered on
+                    self.communicator.connect(port, self.detected_bauds[port])
+                else:
+                    self.communicator.connect(port)
                 self.append_output(f"Connected to device on port: {port}")
                 self.logger.info(f"Successfully connected to device on port: {port}")
             else:
@@ -334,19 +436,46 @@ class XBeeGUIPySide(QMainWindow):
 
 
     def start_message_receiver(self):
-        """Start the background thread for receiving messages."""
-        self.message_receiver_thread = threading.Thread(target=self.update_received_messages, daemon=True)
-        self.message_receiver_thread.start()
+        """Subscribe the output, telemetry and heartbeat consumers to the communicator."""
+        from xbee_daemon import DaemonClient
+        bus = self.communicator.bus
+        self.telemetry.attach(bus, on_record=self.signals.battery_received.emit)
+        if not isinstance(self.communicator, DaemonClient):
+            # A shared radio is recorded by the daemon that owns it
+            self.history.bind(self.communicator)
+        liveness = getattr(self.communicator, "liveness", None)
+        if liveness is not None:
+            liveness.add_listener(
+                lambda node, old, new: self.signals.liveness_changed.emit(node, new.value))
+        self.subscriptions = [
+            (bus.subscribe(""), self.signals.message_received),
+            # One beep per second is plenty, however often nodes report in
+            (bus.subscribe("I'm alive", maxsize=1, rate=1.0), self.signals.alive_received),
+        ]
+        for subscription, signal in self.subscriptions:
+            threading.Thread(target=self.update_received_messages,
+                             args=(subscription, signal), daemon=True).start()
+        threading.Thread(target=self.drain_message_queue,
+                         args=(self.communicator,), daemon=True).start()
+
+
+    def update_received_messages(self, subscription, signal):
+        """Thread target: wait on one subscription and emit its messages to the GUI."""
+        while any(subscription is current for current, _ in self.subscriptions):
+            try:
+                message = subscription.get(timeout=1)
+                signal.emit(message["msg"])
+            except queue.Empty:
+                continue
 
 
-    def update_received_messages(self):
-        """Thread target: poll for new messages and emit signal to GUI."""
-        while True:
+    def drain_message_queue(self, communicator):
+        """Thread target: discard message_queue, which is still filled for other
+        callers, while ``communicator`` is in use; the GUI reads the bus."""
+        message_queue = getattr(communicator, "message_queue", None)
+        while message_queue is not None and communicator is self.communicator:
             try:
-                message = self.communicator.message_queue.get(timeout=1)
-                data = json.loads(message)
-                text = data["msg"]
-                self.signals.message_received.emit(text)
+                message_queue.get(timeout=1)
             except queue.Empty:
                 continue
 
@@ -354,17 +483,46 @@ class XBeeGUIPySide(QMainWindow):
     def handle_received_message(self, text):
         """Handle a message received from the communicator thread."""
         self.append_output(f"Received message: {text}")
-        # Check for battery voltage message
-        if text.startswith("BATT "):
-            parts = text.split()
-            if len(parts) >= 2 and parts[1].endswith("V"):
-                voltage = parts[1][:-1]  # Remove trailing 'V'
-                self.battery_status_entry.setText(voltage)
-        if text.strip() == "BATTERY_STATUS: Error":
+
+
+    def handle_battery_message(self, record):
+        """Show the latest battery reading or error and the low-voltage estimate."""
+        from xbee_telemetry import BatteryError, BatteryReading
+        if isinstance(record, BatteryReading):
+            self.battery_status_entry.setText(f"{record.voltage:g}")
+            remaining = self.telemetry.seconds_to_low_voltage(record.node)
+            self.battery_status_entry.setToolTip(
+                "" if remaining is None else f"Low voltage in ~{remaining / 60:.0f} min")
+        elif isinstance(record, BatteryError):
             self.battery_status_entry.setText("ERROR")
-        # Play beep if "I'm alive" message received
-        if text.startswith("I'm alive"):
-            cross_platform_beep(1000, 100)
+
+
+    def handle_alive_message(self, text):
+        """Play a beep when a node reports "I'm alive"."""
+        cross_platform_beep(1000, 100)
+
+    def show_history(self):
+        """Print the stored messages of the last N minutes, optionally for one node."""
+        node = self.history_node_entry.text().strip() or None
+        try:
+            minutes = float(self.history_minutes_entry.text())
+        except ValueError:
+            self.append_output("Invalid minutes value.")
+            return
+        from xbee_daemon import DaemonClient
+        from xbee_history import HistoryRecord, format_record
+        if isinstance(self.communicator, DaemonClient):
+            records = [HistoryRecord(**record) for record in
+                       self.communicator.query_history(minutes, node)]
+        else:
+            records = self.history.last_minutes(minutes, node)
+        self.output_area.append(f"History: {len(records)} messages")
+        for record in records:
+            self.output_area.append(format_record(record))
+
+    def handle_liveness_change(self, node, state):
+        """Report a node going alive, suspect or dead."""
+        self.append_output(f"Node {node} is now {state}")
 
     def log_message(self, message):
         """Log a message using the configured logger."""
@@ -374,19 +532,37 @@ class XBeeGUIPySide(QMainWindow):
             print(f"Error writing to log file: {e}")
 
 
+    def detect_ports(self):
+        """Probe every serial port for an XBee in the background."""
+        self.append_output("Detecting XBee radios...")
+        threading.Thread(target=self.run_port_detection, daemon=True).start()
+
+    def run_port_detection(self):
+        """Thread target: probe all ports in parallel and report the radios found."""
+        from xbee_port_detect import PortDetector
+        radios = PortDetector().detect()
+        self.signals.radios_detected.emit(radios, "XBee radios found:")
+
+    def handle_radios_detected(self, radios, title):
+        """List detected radios and pre-fill the first one if no port is entered."""
+        if not radios:
+            self.append_output("No XBee radios found")
+            return
+        self.append_output(title)
+        for radio in radios:
+            self.detected_bauds[radio.port] = radio.baud
+            self.append_output(f"- {radio.node_id} on {radio.port} at {radio.baud} baud")
+        if not self.port_entry.text():
+            self.port_entry.setText(radios[0].port)
+
     def list_serial_ports(self):
         """List available serial ports."""
-        ports = serial.tools.list_ports.comports()
-        if ports:
-            self.append_output("Available serial ports:")
-            for port in ports:
-                self.append_output(f"- Port: {port.device}\n  Description: {port.description}")
-        else:
-            self.append_output("No serial ports available")
+        for line in serial_port_lines():
+            self.append_output(line)
 
 def main():
     app = QApplication(sys.argv)
-    window = XBeeGUIPySide()
+    window = XBeeGUIPySide(radio_process="--radio-process" in sys.argv)
     window.show()
     sys.exit(app.exec())
 
@@ -1,14 +1,17 @@
 import tkinter as tk
 from tkinter import scrolledtext
-from xbee_for_import import Communicator
-import json
 import threading
 import queue
 from tkinter import ttk
 import os
 import time
-import serial.tools.list_ports
-import winsound
+try:
+    import winsound
+except ImportError:
+    winsound = None
+
+# The radio stack (digi.xbee, numpy, pyserial) is imported by load_backend
+# after the window is up, so the GUI appears without waiting for it.
 
 class XBeeGUI:
     def __init__(self, root):
@@ -16,7 +19,11 @@ class XBeeGUI:
         self.timeout_RC = tk.DoubleVar(value=1.0)
         self.timer = None
         self.root.title("XBee Communicator")
-        self.communicator = Communicator()
+        self._communicator = None
+        self.telemetry = None
+        self.history = None
+        self.backend_ready = threading.Event()
+        self.detected_bauds = {}
         timestamp = time.strftime("%Y-%m-%d-%H-%M-%S", time.localtime())
         self.log_file_path = str(f"received_messages{timestamp}.txt")
 
@@ -31,6 +38,9 @@ class XBeeGUI:
         self.list_ports = tk.Button(root, text="Ports", command=self.list_serial_ports, height=2, width=20)
         self.list_ports.grid(row=1, column=1, pady=2)
 
+        self.detect_button = tk.Button(root, text="Detect", command=self.detect_ports, width=20)
+        self.detect_button.grid(row=0, column=2, pady=2)
+
         self.list_button = tk.Button(root, text="List", command=self.list_devices, height=2, width=20)
         self.list_button.grid(row=1, column=2, pady=2)
 
@@ -73,6 +83,16 @@ class XBeeGUI:
                                         command=self.battery_status, bg="#0ff573")
         self.battery_status_button.grid(row=6, column=3, columnspan=3, pady=2)
 
+        # Message history: node (empty for all) and how many minutes back
+        self.history_node_entry = tk.Entry(self.move_frame, width=20)
+        self.history_node_entry.grid(row=7, column=0, columnspan=2, pady=2, padx=5)
+        self.history_minutes_entry = tk.Entry(self.move_frame, width=20)
+        self.history_minutes_entry.insert(0, "10")
+        self.history_minutes_entry.grid(row=7, column=2, pady=2, padx=5)
+        self.history_button = tk.Button(self.move_frame, text="Show History", height=2, width=15,
+                                        command=self.show_history)
+        self.history_button.grid(row=7, column=3, columnspan=3, pady=2)
+
         # Ensure the grid configuration allows for resizing
         root.grid_columnconfigure(0, weight=1, uniform="equal")
         root.grid_columnconfigure(1, weight=1, uniform="equal")
@@ -82,8 +102,37 @@ class XBeeGUI:
             with open(self.log_file_path, "a") as log_file:
                 log_file.write("\n\n---------Start logging---------\n")
 
-        self.start_message_receiver()
+        # Runs once the event loop is idle, i.e. after the window is shown
+        self.root.after(0, lambda: threading.Thread(target=self.load_backend, daemon=True).start())
+
+    @property
+    def communicator(self):
+        # Buttons pressed before load_backend has finished wait for it
+        self.backend_ready.wait()
+        return self._communicator
 
+    @communicator.setter
+    def communicator(self, communicator):
+        self._communicator = communicator
+
+    def load_backend(self):
+        try:
+            from xbee_for_import import Communicator
+            from xbee_history import MessageHistory
+            from xbee_telemetry import TelemetryStore
+            self.telemetry = TelemetryStore()
+            self.history = MessageHistory()
+            self._communicator = Communicator()
+        except Exception as e:
+            self.append_output(f"Error loading radio stack: {str(e)}")
+            return
+        finally:
+            self.backend_ready.set()
+        self.start_message_receiver()
+        self.list_serial_ports()
+        # Radios found in an earlier session, if their adapters are plugged in
+        from xbee_port_detect import PortDetector
+        self.show_detected_radios(PortDetector().cached(), "Known XBee radios:")
 
     def create_buttons_and_fields(self):
         # First Row: Three Groups
@@ -222,7 +271,19 @@ class XBeeGUI:
         port = self.port_entry.get()
         try:
             if port:
-                self.communicator.connect(port)
+                if port.startswith("daemon:"):
+                    from xbee_daemon import DaemonClient
+                    self.communicator = DaemonClient()
+                    self.start_message_receiver()
+                    port = port[len("daemon:"):]
+                elif "," in port:
+                    from xbee_multi_radio import MultiRadioCommunicator
+                    self.communicator = MultiRadioCommunicator()
+                    self.start_message_receiver()
+                if port in self.detected_bauds:
+                    self.communicator.connect(port, self.detected_bauds[port])
+                else:
+                    self.communicator.connect(port)
                 self.append_output(f"Connected to device on port: {port}")
             else:
                 self.append_output("No port entered.")
@@ -331,33 +392,83 @@ class XBeeGUI:
         self.log_message(message)
 
     def start_message_receiver(self):
-        self.message_receiver_thread = threading.Thread(target=self.update_received_messages, daemon=True)
-        self.message_receiver_thread.start()
+        from xbee_daemon import DaemonClient
+        bus = self.communicator.bus
+        self.telemetry.attach(bus, on_record=self.show_battery_status)
+        if not isinstance(self.communicator, DaemonClient):
+            self.history.bind(self.communicator)
+        liveness = getattr(self.communicator, "liveness", None)
+        if liveness is not None:
+            liveness.add_listener(
+                lambda node, old, new: self.append_output(f"Node {node} is now {new.value}"))
+        self.subscriptions = [
+            (bus.subscribe(""), self.show_received_message),
+            (bus.subscribe("I'm alive", maxsize=1, rate=1.0), lambda text: self.beep()),
+        ]
+        for subscription, handler in self.subscriptions:
+            threading.Thread(target=self.update_received_messages, args=(subscription, handler), daemon=True).start()
+        threading.Thread(target=self.drain_message_queue, args=(self.communicator,), daemon=True).start()
+
+    def update_received_messages(self, subscription, handler):
+        while any(subscription is current for current, _ in self.subscriptions):
+            try:
+                message = subscription.get(timeout=1)
+                handler(message["msg"])
+            except queue.Empty:
+                continue
 
-    def update_received_messages(self):
-        while True:
+    def drain_message_queue(self, communicator):
+        # Messages reach the GUI through the bus; message_queue is still filled
+        # for other callers, so empty it to keep it from growing
+        message_queue = getattr(communicator, "message_queue", None)
+        while message_queue is not None and communicator is self.communicator:
             try:
-                message = self.communicator.message_queue.get(timeout=1)
-                data = json.loads(message)
-                text = data["msg"]
-                self.append_output(f"Received message: {text}")
-                self.log_message(text)
-                # Check for battery voltage message
-                if text.startswith("BATT "):
-                    parts = text.split()
-                    if len(parts) >= 2 and parts[1].endswith("V"):
-                        voltage = parts[1][:-1]  # Remove trailing 'V'
-                        self.battery_status_entry.delete(0, tk.END)
-                        self.battery_status_entry.insert(0, voltage)
-                # Check for battery status error
-                if text.strip() == "BATTERY_STATUS: Error":
-                    self.battery_status_entry.delete(0, tk.END)
-                    self.battery_status_entry.insert(0, "ERROR")
-                if text.startswith("I'm alive"):
-                    winsound.Beep(1000, 100)
+                message_queue.get(timeout=1)
             except queue.Empty:
                 continue
 
+    def show_received_message(self, text):
+        self.append_output(f"Received message: {text}")
+        self.log_message(text)
+
+    def beep(self):
+        if winsound is not None:
+            winsound.Beep(1000, 100)
+        else:
+            self.root.bell()
+
+    def show_battery_status(self, record):
+        # Typed records from the telemetry store: voltage or battery error
+        from xbee_telemetry import BatteryError, BatteryReading
+        if isinstance(record, BatteryReading):
+            self.battery_status_entry.delete(0, tk.END)
+            self.battery_status_entry.insert(0, f"{record.voltage:g}")
+        elif isinstance(record, BatteryError):
+            self.battery_status_entry.delete(0, tk.END)
+            self.battery_status_entry.insert(0, "ERROR")
+
+    def show_history(self):
+        node = self.history_node_entry.get().strip() or None
+        try:
+            minutes = float(self.history_minutes_entry.get())
+        except ValueError:
+            self.append_output("Invalid minutes value.")
+            return
+        from xbee_daemon import DaemonClient
+        from xbee_history import HistoryRecord, format_record
+        if isinstance(self.communicator, DaemonClient):
+            records = [HistoryRecord(**record) for record in
+                       self.communicator.query_history(minutes, node)]
+        else:
+            records = self.history.last_minutes(minutes, node)
+        # Not through append_output: the history is already on disk
+        self.output_area.config(state='normal')
+        self.output_area.insert(tk.END, f"History: {len(records)} messages\n")
+        for record in records:
+            self.output_area.insert(tk.END, format_record(record) + "\n")
+        self.output_area.config(state='disabled')
+        self.output_area.yview(tk.END)
+
     def log_message(self, message):
         try:                    
             with open(self.log_file_path, "a") as log_file:
@@ -366,7 +477,31 @@ class XBeeGUI:
         except Exception as e:
             print(f"Error writing to log file: {e}")
 
+    def detect_ports(self):
+        threading.Thread(target=self.run_port_detection, daemon=True).start()
+
+    def run_port_detection(self):
+        # Probes every port in parallel at the likely baud rates
+        from xbee_port_detect import PortDetector
+        self.append_output("Detecting XBee radios...")
+        radios = PortDetector().detect()
+        if not radios:
+            self.append_output("No XBee radios found")
+        self.show_detected_radios(radios, "XBee radios found:")
+
+    def show_detected_radios(self, radios, title):
+        if not radios:
+            return
+        self.append_output(title)
+        for radio in radios:
+            self.detected_bauds[radio.port] = radio.baud
+            self.append_output(f"- {radio.node_id} on {radio.port} at {radio.baud} baud")
+        # Pre-fill the first one unless the operator has typed something
+        if not self.port_entry.get():
+            self.port_entry.insert(0, radios[0].port)
+
     def list_serial_ports(self):
+        import serial.tools.list_ports
         ports = serial.tools.list_ports.comports()
         if ports:
             print("Available serial ports:")
@@ -0,0 +1,163 @@
+"""Deficit round robin over outbound message fragments.
+
+``send`` and ``send_single`` used to write all of a message's fragments back
+to back from the calling thread, so a short command to one drone waited
+behind every fragment of a long message to another. ``FragmentScheduler``
+instead keeps one FIFO of messages per flow (a destination or a traffic
+class) and a sender thread that visits the active flows in turn: each turn
+credits the flow ``quantum * weight`` bytes and sends its fragments while
+the credit covers them. Messages within a flow stay in order, a flow with
+weight 2 gets twice the airtime of one with weight 1 while both are busy,
+and an idle flow does not bank credit.
+"""
+
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from xbee_metrics import METRICS, Metrics
+
+# Bytes credited per turn at weight 1: one JSON part with its header.
+QUANTUM = 80
+# Fragments waiting across all flows; a message that does not fit is dropped.
+SCHEDULER_LIMIT = 4000
+
+Fragment = Tuple[Callable[[], None], int]  # (send it, its size in bytes)
+
+
+class _Message:
+    __slots__ = ("fragments", "index", "on_error", "failed")
+
+    def __init__(self, fragments: List[Fragment],
+                 on_error: Optional[Callable[[Exception], None]]) -> None:
+        self.fragments = fragments
+        self.index = 0
+        self.on_error = on_error
+        self.failed = False
+
+
+class FragmentScheduler:
+    def __init__(self, quantum: int = QUANTUM, weights: Optional[Dict[str, float]] = None,
+                 limit: int = SCHEDULER_LIMIT, name: str = "scheduled",
+                 metrics: Metrics = METRICS) -> None:
+        self.quantum = quantum
+        self.weights: Dict[str, float] = {}
+        self.limit = limit
+        self.metrics = metrics
+        self._prefix = "queue.%s." % name
+        self._flows: Dict[str, Deque[_Message]] = {}
+        self._active: Deque[str] = deque()
+        self._deficits: Dict[str, float] = {}
+        self._credited = False
+        self._pending = 0
+        self._sending = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        for flow, weight in (weights or {}).items():
+            self.set_weight(flow, weight)
+
+    def set_weight(self, flow: str, weight: float) -> None:
+        if weight <= 0:
+            raise ValueError("flow weight must be positive, got %r" % weight)
+        with self._condition:
+            self.weights[flow] = weight
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def submit(self, flow: str, fragments: Sequence[Fragment],
+               on_error: Optional[Callable[[Exception], None]] = None) -> bool:
+        """Queue one message's fragments on ``flow``; False if it was dropped.
+
+        If sending a fragment raises, the rest of the message is discarded
+        and ``on_error(exception)`` is called from the sender thread.
+        """
+        fragments = list(fragments)
+        if not fragments:
+            return True
+        with self._condition:
+            self.metrics.incr(self._prefix + "puts")
+            if self._pending + len(fragments) > self.limit:
+                self.metrics.incr(self._prefix + "dropped")
+                return False
+            messages = self._flows.get(flow)
+            if messages is None:
+                messages = self._flows[flow] = deque()
+                self._active.append(flow)
+                self._deficits[flow] = 0.0
+            messages.append(_Message(fragments, on_error))
+            self._pending += len(fragments)
+            self.metrics.max_gauge(self._prefix + "high_water", self._pending)
+            self._condition.notify_all()
+        return True
+
+    def pending(self) -> int:
+        with self._condition:
+            return self._pending
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted fragment has been sent (or discarded)."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._sending,
+                                            timeout)
+
+    def _retire(self, flow: str) -> None:
+        """Drop the (head) flow once it has nothing queued; its credit goes too."""
+        self._active.popleft()
+        del self._flows[flow]
+        del self._deficits[flow]
+        self._credited = False
+
+    def _next(self) -> Optional[Tuple[_Message, Callable[[], None]]]:
+        """Pop the next fragment to send, or None if nothing is queued."""
+        while self._active:
+            flow = self._active[0]
+            messages = self._flows[flow]
+            message = messages[0]
+            if message.failed:
+                self._pending -= len(message.fragments) - message.index
+                messages.popleft()
+                if not messages:
+                    self._retire(flow)
+                continue
+            if not self._credited:
+                self._deficits[flow] += self.quantum * self.weights.get(flow, 1.0)
+                self._credited = True
+            send, size = message.fragments[message.index]
+            if self._deficits[flow] < size:
+                self._active.rotate(-1)
+                self._credited = False
+                continue
+            self._deficits[flow] -= size
+            message.index += 1
+            self._pending -= 1
+            if message.index == len(message.fragments):
+                messages.popleft()
+                if not messages:
+                    self._retire(flow)
+            return message, send
+        return None
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                item = self._next()
+                while item is None:
+                    self._condition.notify_all()  # idle: wake wait_idle
+                    self._condition.wait()
+                    item = self._next()
+                self._sending += 1
+            message, send = item
+            try:
+                send()
+            except Exception as error:
+                with self._condition:
+                    message.failed = True
+                if message.on_error is not None:
+                    message.on_error(error)
+            finally:
+                with self._condition:
+                    self._sending -= 1
+                    self._condition.notify_all()
@@ -0,0 +1,134 @@
+"""Sender indexes for message IDs, assigned by the ground station.
+
+Message IDs (``xbee_sequence``) only stay unique if every node numbers its
+messages with its own sender index. ``SenderIndexManager`` hands each node
+it discovers the lowest free index below ``ASSIGNED_SENDERS`` and keeps the
+table in ``xbee_senders.json`` in the data directory, so a node gets the same index every session.
+Like group membership, the index is pushed to the node (``SENDER_INDEX``
+frame, unicast) and re-pushed every ``resend_interval`` seconds until the
+node echoes it with ``SENDER_INDEX_ACK``, and again whenever the node comes
+back after being declared dead (it may have rebooted).
+"""
+
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from xbee_for_import import FRAME_MARKER, SENDER_INDEX, SENDER_INDEX_ACK
+from xbee_liveness import NodeState
+from xbee_paths import data_path, make_parent
+from xbee_sequence import ASSIGNED_SENDERS
+
+DEFAULT_PATH = data_path("xbee_senders.json")
+GROUND_STATION_INDEX = 0
+RESEND_INTERVAL = 5.0
+
+
+class SenderIndexManager:
+    def __init__(self, communicator, path: Optional[str] = DEFAULT_PATH,
+                 resend_interval: float = RESEND_INTERVAL) -> None:
+        self.communicator = communicator
+        self.path = path
+        self.resend_interval = resend_interval
+        self.indexes: Dict[str, int] = {}
+        self.confirmed: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._load()
+        # The ground station numbers its own messages from the assigned range too
+        if not communicator.explicit_sender_index:
+            communicator.set_sender_index(GROUND_STATION_INDEX)
+        communicator.register_frame_handler(SENDER_INDEX_ACK, self._on_ack)
+        communicator.liveness.add_listener(self._on_state_change)
+
+    def _load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as stored:
+                data = json.load(stored)
+        except (OSError, ValueError):
+            return
+        self.indexes = {node_id: int(index) for node_id, index in data.get("senders", {}).items()}
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"senders": dict(self.indexes)}
+        try:
+            make_parent(self.path)
+            with open(self.path, "w") as stored:
+                json.dump(data, stored, indent=1, sort_keys=True)
+        except OSError as error:
+            print("Could not write sender index table:", str(error))
+
+    # --- assignment ------------------------------------------------------
+
+    def index_of(self, node_id: str) -> int:
+        """The index assigned to ``node_id``, assigning one if it has none."""
+        with self._lock:
+            if node_id in self.indexes:
+                return self.indexes[node_id]
+            used = set(self.indexes.values())
+            used.add(self.communicator.own_sender_index())
+            free = [index for index in range(ASSIGNED_SENDERS) if index not in used]
+            if not free:
+                raise ValueError("no free sender indexes left")
+            self.indexes[node_id] = free[0]
+        self.save()
+        return free[0]
+
+    def pending(self) -> List[str]:
+        """Discovered nodes that have not yet confirmed their index."""
+        node_ids = [remote.get_node_id()
+                    for remote in list(self.communicator.current_discovered_devices)]
+        with self._lock:
+            return sorted(node_id for node_id in node_ids
+                          if node_id not in self.indexes
+                          or self.confirmed.get(node_id) != self.indexes[node_id])
+
+    # --- pushing to the nodes --------------------------------------------
+
+    def push(self, *node_ids: str) -> None:
+        """Send each node its index; unreachable nodes stay pending."""
+        for node_id in node_ids:
+            remote = self.communicator.find_remote_device(node_id)
+            if remote is None:
+                continue
+            try:
+                index = self.index_of(node_id)
+                frame = bytes([FRAME_MARKER]) + SENDER_INDEX + index.to_bytes(2, "big")
+                self.communicator._transmit(remote, frame)
+            except Exception as error:
+                print("Sender index push error:", str(error))
+
+    def sync(self) -> None:
+        self.push(*self.pending())
+
+    def start(self) -> None:
+        """Push indexes to newly discovered and unconfirmed nodes in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.resend_interval)
+            if self.communicator.link_up.is_set():
+                self.sync()
+
+    def _on_ack(self, data: bytes, source_device) -> None:
+        if len(data) < 4:
+            return
+        with self._lock:
+            self.confirmed[source_device.get_node_id()] = int.from_bytes(data[2:4], "big")
+
+    def _on_state_change(self, node: str, old: NodeState, new: NodeState) -> None:
+        if old != NodeState.DEAD or new == NodeState.DEAD:
+            return
+        for remote in list(self.communicator.current_discovered_devices):
+            if self.communicator.node_key(remote) == node:
+                with self._lock:
+                    self.confirmed.pop(remote.get_node_id(), None)
@@ -0,0 +1,126 @@
+"""Compact message IDs built from (sender index, sequence number).
+
+An ID is ``SENDER_CHARS`` characters of sender index followed by
+``SEQUENCE_CHARS`` characters of sequence number, both in a 64-symbol
+alphabet that is safe inside JSON and never contains the 0x1F separator.
+As long as every node on the mesh has its own sender index, two senders can
+never produce the same ID, and one sender repeats an ID only after
+``SEQUENCE_SPACE`` messages. Five characters fit the old random IDs' budget.
+
+Indexes below ``ASSIGNED_SENDERS`` are handed out by the ground station
+(``xbee_senders.SenderIndexManager``, like group membership), so assigned
+indexes are unique by construction. Until a node has one, it uses a default
+derived from its 64-bit address in the upper half of the range: it can
+clash only with another node that has not been assigned an index yet, and
+``Communicator`` reports such a clash at discovery or in received IDs.
+"""
+
+import itertools
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+_INDEX = {symbol: value for value, symbol in enumerate(ALPHABET)}
+
+SENDER_CHARS = 2
+SEQUENCE_CHARS = 3
+MESSAGE_ID_LENGTH = SENDER_CHARS + SEQUENCE_CHARS
+MAX_SENDERS = len(ALPHABET) ** SENDER_CHARS
+SEQUENCE_SPACE = len(ALPHABET) ** SEQUENCE_CHARS
+# Indexes the ground station assigns; defaults come from the rest.
+ASSIGNED_SENDERS = MAX_SENDERS // 2
+
+
+def _encode(value: int, width: int) -> str:
+    symbols = []
+    for _ in range(width):
+        value, digit = divmod(value, len(ALPHABET))
+        symbols.append(ALPHABET[digit])
+    return "".join(reversed(symbols))
+
+
+def _decode(text: str) -> int:
+    value = 0
+    for symbol in text:
+        value = value * len(ALPHABET) + _INDEX[symbol]
+    return value
+
+
+def encode_message_id(sender_index: int, sequence: int) -> str:
+    return (_encode(sender_index % MAX_SENDERS, SENDER_CHARS)
+            + _encode(sequence % SEQUENCE_SPACE, SEQUENCE_CHARS))
+
+
+def decode_message_id(message_id: str) -> Tuple[int, int]:
+    """Return (sender index, sequence number) for an encoded ID."""
+    return (_decode(message_id[:SENDER_CHARS]),
+            _decode(message_id[SENDER_CHARS:MESSAGE_ID_LENGTH]))
+
+
+def sender_prefix(sender_index: int) -> str:
+    """The leading ``SENDER_CHARS`` characters of every ID sent with ``sender_index``."""
+    return _encode(sender_index % MAX_SENDERS, SENDER_CHARS)
+
+
+def sender_index_for(address) -> int:
+    """Default sender index, from the low bits of the node's 64-bit address.
+
+    Always ``ASSIGNED_SENDERS`` or above, so it never equals an assigned
+    index; only unique if the addresses differ in those bits.
+    """
+    return ASSIGNED_SENDERS + int(str(address), 16) % (MAX_SENDERS - ASSIGNED_SENDERS)
+
+
+class SequenceNumberer:
+    """Hands out message IDs for one sender.
+
+    The counter starts at a random point so a restarted node does not
+    reuse the IDs it sent just before the restart.
+    """
+
+    def __init__(self, sender_index: int) -> None:
+        self.sender_index = sender_index % MAX_SENDERS
+        self._counter = itertools.count(secrets.randbelow(SEQUENCE_SPACE))
+
+    def next_id(self) -> str:
+        # next() on itertools.count is atomic under the GIL; the sequence
+        # wraps around modulo SEQUENCE_SPACE inside encode_message_id.
+        return encode_message_id(self.sender_index, next(self._counter))
+
+
+class DuplicateFilter:
+    """Remembers recently completed message IDs per sender.
+
+    Entries expire after ``ttl`` seconds and each sender keeps at most
+    ``window`` of them, so memory stays bounded however long a node runs.
+    """
+
+    def __init__(self, window: int = 512, ttl: float = 120.0) -> None:
+        self.window = window
+        self.ttl = ttl
+        self._seen: Dict[str, OrderedDict] = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, message_id) -> OrderedDict:
+        sender = message_id[:SENDER_CHARS]
+        recent = self._seen.get(sender)
+        if recent is None:
+            recent = self._seen[sender] = OrderedDict()
+        cutoff = time.monotonic() - self.ttl
+        while recent and (len(recent) > self.window or
+                          next(iter(recent.values())) < cutoff):
+            recent.popitem(last=False)
+        return recent
+
+    def seen(self, message_id) -> bool:
+        with self._lock:
+            return message_id in self._recent(message_id)
+
+    def mark(self, message_id) -> None:
+        with self._lock:
+            recent = self._recent(message_id)
+            recent[message_id] = time.monotonic()
+            recent.move_to_end(message_id)
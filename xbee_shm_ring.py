@@ -0,0 +1,90 @@
+"""Single-producer/single-consumer ring buffer in shared memory."""
+
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+# Header: write counter, read counter (both monotonically increasing byte
+# offsets; the position in the data area is the counter modulo capacity).
+_HEADER = struct.Struct("<QQ")
+_LENGTH = struct.Struct("<I")
+
+
+class SharedRingBuffer:
+    """Length-prefixed records in a ``multiprocessing.shared_memory`` block.
+
+    Exactly one process may call ``put`` and exactly one may call ``get``.
+    The producer only ever advances the write counter and the consumer only
+    the read counter, so no lock is needed between them.
+    """
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 1 << 20,
+                 create: bool = True) -> None:
+        if create:
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=_HEADER.size + capacity)
+            _HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.capacity = self.shm.size - _HEADER.size
+        self.owner = create
+        self.dropped = 0
+
+    def _counters(self):
+        return _HEADER.unpack_from(self.shm.buf, 0)
+
+    def _copy_in(self, position: int, data) -> None:
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        base = _HEADER.size
+        self.shm.buf[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.shm.buf[base:base + len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        base = _HEADER.size
+        data = bytes(self.shm.buf[base + start:base + start + first])
+        if first < length:
+            data += bytes(self.shm.buf[base:base + length - first])
+        return data
+
+    def put(self, data: bytes) -> bool:
+        """Append one record; return False if there is no room for it."""
+        needed = _LENGTH.size + len(data)
+        write, read = self._counters()
+        if needed > self.capacity - (write - read):
+            return False
+        self._copy_in(write, _LENGTH.pack(len(data)))
+        self._copy_in(write + _LENGTH.size, data)
+        # Publish the record only after its bytes are in place.
+        struct.pack_into("<Q", self.shm.buf, 0, write + needed)
+        return True
+
+    def put_wait(self, data: bytes, timeout: float = 1.0) -> bool:
+        """Like ``put``, but wait up to ``timeout`` seconds for room."""
+        deadline = time.monotonic() + timeout
+        while not self.put(data):
+            if time.monotonic() >= deadline:
+                self.dropped += 1
+                return False
+            time.sleep(0.001)
+        return True
+
+    def get(self) -> Optional[bytes]:
+        """Remove and return the oldest record, or None if empty."""
+        write, read = self._counters()
+        if write == read:
+            return None
+        (length,) = _LENGTH.unpack(self._copy_out(read, _LENGTH.size))
+        data = self._copy_out(read + _LENGTH.size, length)
+        struct.pack_into("<Q", self.shm.buf, 8, read + _LENGTH.size + length)
+        return data
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,264 @@
+"""Simulated DigiMesh radios on a shared, lossy, rate-limited medium.
+
+``SimulatedDevice`` implements the part of ``DigiMeshDevice`` that
+``Communicator`` uses, so ``communicator.attach_device(device)`` runs the
+real stack over the simulation. Frames share one channel with a fixed air
+rate, so offered load beyond it queues up exactly as it would on air;
+unicasts are retried up to ``max_retries`` times and answered with a
+``TransmitStatusPacket``. Each device delivers on its own thread, like
+the reader thread of a real serial device.
+"""
+
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from digi.xbee.models.address import XBee16BitAddress, XBee64BitAddress
+from digi.xbee.models.status import NetworkDiscoveryStatus, TransmitStatus
+from digi.xbee.packets.common import TransmitStatusPacket
+
+# API frame, MAC and mesh headers around each payload, in bytes.
+FRAME_OVERHEAD = 30
+
+
+class SimulatedRemote:
+    """What ``get_network().get_devices()`` returns for a neighbor."""
+
+    def __init__(self, node_id: str, address: XBee64BitAddress) -> None:
+        self._node_id = node_id
+        self._address = address
+
+    def get_node_id(self) -> str:
+        return self._node_id
+
+    def get_64bit_addr(self) -> XBee64BitAddress:
+        return self._address
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SimulatedRemote) and other._address == self._address
+
+    def __hash__(self) -> int:
+        return hash(str(self._address))
+
+    def __repr__(self) -> str:
+        return "SimulatedRemote(%s)" % self._node_id
+
+
+class SimulatedMessage:
+    def __init__(self, remote_device: SimulatedRemote, data: bytearray,
+                 is_broadcast: bool) -> None:
+        self.remote_device = remote_device
+        self.data = data
+        self.is_broadcast = is_broadcast
+        self.timestamp = time.time()
+
+
+class SimulatedNetwork:
+    """Discovery over the medium: finds every other open device after ``discovery_time``."""
+
+    def __init__(self, device: "SimulatedDevice") -> None:
+        self.device = device
+        self._devices: List[SimulatedRemote] = []
+        self._discovered: List[Callable] = []
+        self._finished: List[Callable] = []
+        self._running = False
+
+    def set_discovery_timeout(self, timeout: float) -> None:
+        pass
+
+    def add_device_discovered_callback(self, callback: Callable) -> None:
+        self._discovered.append(callback)
+
+    def add_discovery_process_finished_callback(self, callback: Callable) -> None:
+        self._finished.append(callback)
+
+    def start_discovery_process(self) -> None:
+        self._running = True
+        timer = threading.Timer(self.device.medium.discovery_time, self._finish)
+        timer.daemon = True
+        timer.start()
+
+    def _finish(self) -> None:
+        found = [other.as_remote for other in self.device.medium.neighbors(self.device)]
+        for remote in found:
+            for callback in self._discovered:
+                callback(remote)
+        self._devices = found
+        for callback in self._finished:
+            callback(NetworkDiscoveryStatus.SUCCESS)
+        self._running = False
+
+    def is_discovery_running(self) -> bool:
+        return self._running
+
+    def get_devices(self) -> List[SimulatedRemote]:
+        return list(self._devices)
+
+    def clear(self) -> None:
+        self._devices = []
+
+
+class SimulatedDevice:
+    """Stands in for ``DigiMeshDevice`` on a ``SimulatedMedium``."""
+
+    def __init__(self, medium: "SimulatedMedium", node_id: str, address: int,
+                 rssi: int = 60) -> None:
+        self.medium = medium
+        self.node_id = node_id
+        self.address = XBee64BitAddress(address.to_bytes(8, "big"))
+        self.as_remote = SimulatedRemote(node_id, self.address)
+        self.rssi = rssi
+        self.network = SimulatedNetwork(self)
+        self.inbox: queue.Queue = queue.Queue()
+        self._data_callbacks: List[Callable] = []
+        self._packet_callbacks: List[Callable] = []
+        self._frame_ids = itertools.cycle(range(1, 256))
+        self._open = False
+
+    def open(self) -> None:
+        self._open = True
+        self.medium.attach(self)
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def close(self) -> None:
+        self._open = False
+        self.medium.detach(self)
+        self.inbox.put(None)
+
+    def is_open(self) -> bool:
+        return self._open
+
+    def get_node_id(self) -> str:
+        return self.node_id
+
+    def get_64bit_addr(self) -> XBee64BitAddress:
+        return self.address
+
+    def get_next_frame_id(self) -> int:
+        return next(self._frame_ids)
+
+    def get_network(self) -> SimulatedNetwork:
+        return self.network
+
+    def get_parameter(self, parameter: str) -> bytearray:
+        if parameter == "DB":
+            return bytearray([self.rssi])
+        return bytearray()
+
+    def set_parameter(self, parameter: str, value) -> None:
+        pass
+
+    def apply_changes(self) -> None:
+        pass
+
+    def add_data_received_callback(self, callback: Callable) -> None:
+        self._data_callbacks.append(callback)
+
+    def add_packet_received_callback(self, callback: Callable) -> None:
+        self._packet_callbacks.append(callback)
+
+    def send_packet(self, packet, sync: bool = False) -> None:
+        self.medium.transmit(self, packet)
+
+    def _reader(self) -> None:
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                return
+            callbacks = self._data_callbacks if isinstance(item, SimulatedMessage) \
+                else self._packet_callbacks
+            for callback in callbacks:
+                try:
+                    callback(item)
+                except Exception as error:
+                    print("Simulated callback error:", str(error))
+
+
+class SimulatedMedium:
+    """One shared channel connecting every attached device to every other."""
+
+    def __init__(self, loss: float = 0.0, latency: float = 0.005,
+                 air_rate: float = 25000.0, max_retries: int = 3,
+                 discovery_time: float = 1.0, seed: Optional[int] = None) -> None:
+        self.loss = loss
+        self.latency = latency
+        self.air_rate = air_rate
+        self.max_retries = max_retries
+        self.discovery_time = discovery_time
+        self.random = random.Random(seed)
+        self.devices: Dict[str, SimulatedDevice] = {}
+        self.frames = 0
+        self.busy_time = 0.0
+        self._channel_free = 0.0
+        self._events: list = []
+        self._sequence = itertools.count()
+        self._lock = threading.Condition()
+        threading.Thread(target=self._scheduler, daemon=True).start()
+
+    def attach(self, device: SimulatedDevice) -> None:
+        with self._lock:
+            self.devices[str(device.address)] = device
+
+    def detach(self, device: SimulatedDevice) -> None:
+        with self._lock:
+            self.devices.pop(str(device.address), None)
+
+    def neighbors(self, device: SimulatedDevice) -> List[SimulatedDevice]:
+        with self._lock:
+            return [other for other in self.devices.values() if other is not device]
+
+    def _schedule(self, due: float, device: SimulatedDevice, item) -> None:
+        heapq.heappush(self._events, (due, next(self._sequence), device, item))
+
+    def _airtime(self, now: float, length: int) -> float:
+        """Occupy the channel for one frame; return when it has been sent."""
+        airtime = (length + FRAME_OVERHEAD) / self.air_rate
+        self._channel_free = max(now, self._channel_free) + airtime
+        self.frames += 1
+        self.busy_time += airtime
+        return self._channel_free
+
+    def transmit(self, sender: SimulatedDevice, packet) -> None:
+        data = bytearray(packet.rf_data)
+        destination = str(packet.x64bit_dest_addr)
+        now = time.monotonic()
+        with self._lock:
+            if destination == str(XBee64BitAddress.BROADCAST_ADDRESS):
+                sent = self._airtime(now, len(data))
+                for other in self.devices.values():
+                    if other is not sender and self.random.random() >= self.loss:
+                        self._schedule(sent + self.latency, other,
+                                       SimulatedMessage(sender.as_remote, bytearray(data), True))
+            else:
+                target = self.devices.get(destination)
+                status, retries, sent = TransmitStatus.ADDRESS_NOT_FOUND, 0, now
+                if target is not None:
+                    status = TransmitStatus.NO_ACK
+                    for retries in range(self.max_retries + 1):
+                        sent = self._airtime(now, len(data))
+                        if self.random.random() >= self.loss:
+                            status = TransmitStatus.SUCCESS
+                            self._schedule(sent + self.latency, target,
+                                           SimulatedMessage(sender.as_remote, data, False))
+                            break
+                if packet.frame_id:
+                    self._schedule(sent + self.latency, sender, TransmitStatusPacket(
+                        packet.frame_id, XBee16BitAddress.UNKNOWN_ADDRESS, retries, status))
+            self._lock.notify()
+
+    def _scheduler(self) -> None:
+        with self._lock:
+            while True:
+                if not self._events:
+                    self._lock.wait()
+                    continue
+                delay = self._events[0][0] - time.monotonic()
+                if delay > 0:
+                    self._lock.wait(delay)
+                    continue
+                _, _, device, item = heapq.heappop(self._events)
+                device.inbox.put(item)
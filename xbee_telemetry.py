@@ -0,0 +1,225 @@
+"""Typed telemetry records and per-node NumPy ring-buffer time series."""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+LOW_VOLTAGE = 10.5
+
+
+@dataclass(frozen=True)
+class BatteryReading:
+    node: str
+    timestamp: float
+    voltage: float
+
+
+@dataclass(frozen=True)
+class BatteryError:
+    node: str
+    timestamp: float
+
+
+@dataclass(frozen=True)
+class Heartbeat:
+    node: str
+    timestamp: float
+
+
+def _parse_battery(text: str, node: str, timestamp: float) -> Optional[BatteryReading]:
+    parts = text.split()
+    if len(parts) >= 2 and parts[1].endswith("V"):
+        try:
+            return BatteryReading(node, timestamp, float(parts[1][:-1]))
+        except ValueError:
+            return None
+    return None
+
+
+def _parse_battery_error(text: str, node: str, timestamp: float) -> Optional[BatteryError]:
+    return BatteryError(node, timestamp) if text.strip() == "BATTERY_STATUS: Error" else None
+
+
+# Message prefix -> parser; add an entry here to teach the store a new kind.
+PARSERS: Dict[str, Callable] = {
+    "BATT ": _parse_battery,
+    "BATTERY_STATUS: Error": _parse_battery_error,
+    "I'm alive": lambda text, node, timestamp: Heartbeat(node, timestamp),
+}
+
+
+def parse_telemetry(text: str, node: str, timestamp: Optional[float] = None):
+    """Turn a received message into a typed record, or None if it is not telemetry."""
+    timestamp = time.time() if timestamp is None else timestamp
+    for prefix, parser in PARSERS.items():
+        if text.startswith(prefix):
+            return parser(text, node, timestamp)
+    return None
+
+
+class RingSeries:
+    """Fixed-capacity (timestamp, value) series backed by two NumPy arrays."""
+
+    def __init__(self, capacity: int) -> None:
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp: float, value: float) -> None:
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (times, values) oldest first."""
+        if self.count < self.capacity:
+            return self.times[:self.count].copy(), self.values[:self.count].copy()
+        order = np.r_[self.head:self.capacity, 0:self.head]
+        return self.times[order], self.values[order]
+
+    def oldest(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return float(self.times[self.head if self.count == self.capacity else 0])
+
+    def since(self, start: float) -> Tuple[np.ndarray, np.ndarray]:
+        times, values = self.ordered()
+        first = np.searchsorted(times, start)
+        return times[first:], values[first:]
+
+
+class DownsampledSeries:
+    """Raw samples plus coarser tiers of per-bucket means for long windows.
+
+    Each tier is ``(bucket_seconds, capacity)``. Samples are folded into
+    the open bucket of every tier; when a sample falls in a later bucket
+    the finished one is appended to that tier's ring as its mean.
+    """
+
+    def __init__(self, raw_capacity: int, tiers) -> None:
+        self.raw = RingSeries(raw_capacity)
+        self.tiers = [(width, RingSeries(capacity)) for width, capacity in tiers]
+        self._open = [None] * len(self.tiers)  # (bucket start, sum, count)
+
+    def append(self, timestamp: float, value: float) -> None:
+        self.raw.append(timestamp, value)
+        for index, (width, ring) in enumerate(self.tiers):
+            start = timestamp - timestamp % width
+            bucket = self._open[index]
+            if bucket is not None and bucket[0] != start:
+                ring.append(bucket[0] + width / 2, bucket[1] / bucket[2])
+                bucket = None
+            if bucket is None:
+                self._open[index] = (start, value, 1)
+            else:
+                self._open[index] = (start, bucket[1] + value, bucket[2] + 1)
+
+    def since(self, start: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples since ``start`` at the finest resolution that covers it."""
+        oldest = self.raw.oldest()
+        if oldest is None or oldest <= start:
+            return self.raw.since(start)
+        for _, ring in self.tiers:
+            tier_oldest = ring.oldest()
+            if tier_oldest is not None and tier_oldest <= start:
+                return ring.since(start)
+        # Nothing reaches back that far: return the longest history we have.
+        ring = self.tiers[-1][1] if self.tiers and self.tiers[-1][1].count else self.raw
+        return ring.since(start)
+
+
+class TelemetryStore:
+    """Per-node battery history with queries and low-voltage prediction.
+
+    The defaults keep one hour of raw samples (at one per second), six
+    hours of 10-second means and a day of one-minute means per node.
+    """
+
+    def __init__(self, raw_capacity: int = 3600,
+                 tiers=((10.0, 2160), (60.0, 1440))) -> None:
+        self.raw_capacity = raw_capacity
+        self.tiers = tiers
+        self.voltage: Dict[str, DownsampledSeries] = {}
+        self.last_error: Dict[str, float] = {}
+        self.last_heartbeat: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ingest(self, record) -> None:
+        with self._lock:
+            if isinstance(record, BatteryReading):
+                series = self.voltage.get(record.node)
+                if series is None:
+                    series = self.voltage[record.node] = DownsampledSeries(
+                        self.raw_capacity, self.tiers)
+                series.append(record.timestamp, record.voltage)
+            elif isinstance(record, BatteryError):
+                self.last_error[record.node] = record.timestamp
+            elif isinstance(record, Heartbeat):
+                self.last_heartbeat[record.node] = record.timestamp
+
+    def handle_message(self, message: dict):
+        """Parse and store a reassembled message dict; return the record or None."""
+        record = parse_telemetry(message["msg"], message.get("first") or message.get("from"))
+        if record is not None:
+            self.ingest(record)
+        return record
+
+    def attach(self, bus, on_record: Optional[Callable] = None) -> None:
+        """Ingest the telemetry prefixes from a ``MessageBus`` on a background thread.
+
+        ``on_record`` is called with each typed record after it is stored.
+        """
+        subscription = bus.subscribe(list(PARSERS), maxsize=1000)
+
+        def consume():
+            while True:
+                record = self.handle_message(subscription.get())
+                if record is not None and on_record is not None:
+                    on_record(record)
+
+        threading.Thread(target=consume, daemon=True).start()
+
+    def nodes(self) -> List[str]:
+        with self._lock:
+            return sorted(self.voltage)
+
+    def voltage_history(self, node: str, minutes: float,
+                        now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(timestamps, volts) for the last ``minutes`` minutes of ``node``."""
+        now = time.time() if now is None else now
+        with self._lock:
+            series = self.voltage.get(node)
+            if series is None:
+                return np.empty(0), np.empty(0, dtype=np.float32)
+            return series.since(now - minutes * 60.0)
+
+    def latest_voltage(self, node: str) -> Optional[float]:
+        with self._lock:
+            series = self.voltage.get(node)
+            if series is None or series.raw.count == 0:
+                return None
+            return float(series.raw.values[(series.raw.head - 1) % series.raw.capacity])
+
+    def seconds_to_low_voltage(self, node: str, threshold: float = LOW_VOLTAGE,
+                               minutes: float = 5.0,
+                               now: Optional[float] = None) -> Optional[float]:
+        """Extrapolate the recent voltage trend to ``threshold``.
+
+        Returns 0 if already below it, or None if there is too little data
+        or the voltage is not falling.
+        """
+        times, values = self.voltage_history(node, minutes, now)
+        if len(values) < 3:
+            return None
+        if values[-1] <= threshold:
+            return 0.0
+        slope, intercept = np.polyfit(times - times[-1], values, 1)
+        if slope >= 0:
+            return None
+        return float((threshold - intercept) / slope)